@@ -1,13 +1,60 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, abort, stream_with_context
 from datetime import timedelta
-import random
-import hashlib
+from decimal import Decimal
+import csv
+import hmac
+import io
+import json
+import re
+import click
 from database import db
+from config import Config
+from result_queue import result_writer
+from instrumentation import profiler
+from sessions import session_interface, regenerate_session
+from partitions import partition_manager
+from scheduler import scheduler
+from leaderboard import leaderboard, display_name
+from passwords import (
+    password_hasher, hash_password, check_password, PasswordHasherBusy,
+    new_invite_code, invite_code_hash, check_invite_code,
+)
+from tasks import task_generator, UnknownExerciseType, SUPPORTED_OPERATORS
 from functools import wraps
 
 app = Flask(__name__)
 app.secret_key = "dev-secret-change-me"
 app.permanent_session_lifetime = timedelta(days=7)
+if Config.SESSION_BACKEND == 'database':
+    # Сессии в user_sessions: в cookie только токен
+    app.session_interface = session_interface
+
+# -------------------- Unit of work --------------------
+# Все вызовы db.* внутри одного HTTP-запроса идут через одно соединение
+# и одну транзакцию; COMMIT — один раз, перед отправкой ответа.
+@app.before_request
+def _db_begin_request():
+    # Фоновое досоздание месячных секций (и архивация, если задан срок хранения)
+    partition_manager.ensure_started()
+    profiler.start_request()
+    db.begin_request()
+
+@app.after_request
+def _db_commit_request(response):
+    db.end_request(commit=response.status_code < 500)
+    if Config.DB_STATS_HEADERS:
+        queries, db_ms = profiler.request_summary()
+        response.headers["X-DB-Queries"] = str(queries)
+        response.headers["X-DB-Time-ms"] = f"{db_ms:.2f}"
+        response.headers["Server-Timing"] = f'db;dur={db_ms:.2f};desc="{queries} queries"'
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    profiler.finish_request(route, request.method, response.status_code)
+    return response
+
+@app.teardown_request
+def _db_teardown_request(exc):
+    # Если after_request не дошёл (исключение) — откатываем и возвращаем соединение
+    db.end_request(commit=False)
 
 # -------------------- Helpers --------------------
 def login_required(fn):
@@ -27,8 +74,92 @@ def teacher_required(fn):
         return fn(*args, **kwargs)
     return wrapper
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+INT32_MAX = 2 ** 31 - 1     # INTEGER в PostgreSQL
+OPERAND_MAX = 10 ** 6       # операнды задач от клиента — с запасом к exercise_types.parameters
+
+def _int_or_none(value, bound=INT32_MAX):
+    """
+    Целое из JSON или None; дробные (3.5) не усекаем, а отклоняем — иначе неверный ответ засчитается.
+    Значения вне [-bound, bound] тоже отклоняем: в INTEGER-колонку они сорвали бы INSERT всего пакета.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError
+    number = int(value)
+    if abs(number) > bound:
+        raise ValueError
+    return number
+
+def validate_attempt(item):
+    """Проверка одного ответа из пакета /api/attempts; возвращает строку для exercise_attempts."""
+    if not isinstance(item, dict):
+        raise ValueError("ожидается объект")
+    task = item.get("task")
+    if not isinstance(task, dict):
+        raise ValueError("нет поля task")
+    try:
+        a, b = _int_or_none(task["a"], OPERAND_MAX), _int_or_none(task["b"], OPERAND_MAX)
+    except (KeyError, TypeError, ValueError):
+        a = b = None
+    if a is None or b is None:
+        raise ValueError("task должен содержать целые числа a и b")
+    op = task.get("op") or "*"
+    if op not in SUPPORTED_OPERATORS:
+        raise ValueError("неизвестная операция")
+    try:
+        user_answer = _int_or_none(item.get("user_answer"))
+    except (TypeError, ValueError):
+        raise ValueError("user_answer должен быть целым числом")
+    try:
+        time_spent = float(item.get("time_spent", 0) or 0)
+    except (TypeError, ValueError):
+        raise ValueError("time_spent должен быть числом")
+    if not 0 <= time_spent <= 3600:   # NaN тоже не проходит
+        raise ValueError("time_spent вне диапазона")
+    exercise_type = str(item.get("exercise_type") or "multiplication_basic")
+    if len(exercise_type) > 100:
+        raise ValueError("слишком длинный exercise_type")
+    # Ответ и правильность считаем на сервере, клиенту не доверяем
+    task_data = task_generator.make_task(a, b, op)
+    return {
+        "exercise_type": exercise_type,
+        "task_data": task_data,
+        "user_answer": user_answer,
+        "is_correct": user_answer is not None and user_answer == task_data["answer"],
+        "time_spent": round(time_spent, 3),
+    }
+
+RESULT_KEY_RE = re.compile(r"^[A-Za-z0-9-]{8,64}$")
+
+def result_key(value):
+    """Ключ идемпотентности результата от клиента (повторная отправка не задвоит запись)."""
+    if isinstance(value, str) and RESULT_KEY_RE.match(value):
+        return value
+    return None
+
+POINTS_PER_CORRECT = 10  # как в static/js/trainer.js: +10 за верный ответ, −5 за неверный
+
+def validate_result(data):
+    """Проверка итогов раунда /result; возвращает (correct, wrong, points, avg_time)."""
+    try:
+        correct = _int_or_none(data.get("correct")) or 0
+        wrong = _int_or_none(data.get("wrong")) or 0
+        points = _int_or_none(data.get("points"))
+        avg_time = float(data.get("avg_time", 0.0) or 0.0)
+    except (TypeError, ValueError):
+        raise ValueError("итоги раунда должны быть числами")
+    if correct < 0 or wrong < 0 or correct + wrong > Config.RESULT_MAX_ANSWERS:
+        raise ValueError("число ответов вне диапазона")
+    if not 0 <= avg_time <= 3600:
+        raise ValueError("avg_time вне диапазона")
+    # Очки присылает клиент; больше, чем за все верные ответы раунда, набрать нельзя
+    if points is None:
+        points = correct
+    points = min(max(points, 0), POINTS_PER_CORRECT * correct)
+    return correct, wrong, points, avg_time
 
 # -------------------- Routes --------------------
 @app.route("/", methods=["GET"])
@@ -51,16 +182,33 @@ def login():
         if email and password:
             try:
                 user = db.get_user_by_email(email)
+                # KDF занимает до PASSWORD_WAIT_TIMEOUT — соединение запроса на это время отдаём пулу
+                db.release_connection()
                 if not user:
                     # Авторегистрация нового пользователя
                     user_id = db.create_user(email, hash_password(password))
                     user = {'id': user_id, 'email': email}
+                elif not user.get('password_hash'):
+                    # Ученик из импорта списка класса: первый пароль — только с кодом от учителя,
+                    # иначе аккаунт забрал бы любой, кто первым введёт этот e-mail
+                    if not check_invite_code(request.form.get("invite", ""), user.get('invite_hash')):
+                        return render_template("login.html", error="Для первого входа введите код от учителя",
+                                               need_invite=True), 401
+                    if not db.accept_invite(user['id'], hash_password(password), user['invite_hash']):
+                        return render_template("login.html", error="Неверный пароль"), 401
                 else:
-                    # Проверяем пароль (упрощенно)
-                    if user.get('password_hash') != hash_password(password):
+                    stored = user['password_hash']
+                    if not check_password(password, stored):
                         return render_template("login.html", error="Неверный пароль"), 401
+                    # Старый формат или параметры хеша — пересчитываем, пока знаем пароль
+                    if password_hasher.needs_rehash(stored):
+                        try:
+                            db.update_password_hash(user['id'], hash_password(password), current=stored)
+                        except Exception as e:
+                            print(f"Password rehash error: {e}")
 
-                # Устанавливаем сессию
+                # Устанавливаем сессию под новым токеном (токен, выданный до входа, не авторизуется)
+                regenerate_session(session)
                 session.permanent = True
                 session["user"] = {
                     "id": user['id'],            # ID из БД
@@ -74,13 +222,13 @@ def login():
 
                 return redirect(url_for("trainer"))
 
+            except PasswordHasherBusy as e:
+                print(f"Login busy: {e}")
+                return render_template("login.html", error="Слишком много входов, попробуйте через несколько секунд"), 503
             except Exception as e:
+                # Без БД пароль не проверить — не впускаем (прежний вход «по email» пропускал любого)
                 print(f"Login error: {e}")
-                # Fallback к старой логике при ошибке БД
-                session.permanent = True
-                session["user"] = {"email": email}
-                session.setdefault("record", 0)
-                return redirect(url_for("trainer"))
+                return render_template("login.html", error="Вход временно недоступен, попробуйте позже"), 503
         else:
             return render_template("login.html", error="Заполните поля"), 400
 
@@ -103,35 +251,29 @@ def trainer():
 @login_required
 def result():
     data = request.get_json(silent=True) or request.form
-    correct = int(data.get("correct", 0))
-    wrong = int(data.get("wrong", 0))
-    points = int(data.get("points", correct))
-    avg_time = float(data.get("avg_time", 0.0))
+    try:
+        correct, wrong, points, avg_time = validate_result(data)
+    except ValueError:
+        abort(400)
     total = correct + wrong
     percent = round((correct / total) * 100, 2) if total else 0.0
 
-    try:
-        # Сохраняем в БД, если есть ID пользователя
-        if session.get("user") and session["user"].get("id"):
-            db.save_exercise_result(session["user"]["id"], {
+    # Результат уходит в очередь отложенной записи: экран результата не ждёт БД,
+    # а при недоступной БД результат сохранится в spool-файл и будет дослан позже
+    if session.get("user") and session["user"].get("id"):
+        try:
+            result_writer.enqueue(session["user"]["id"], {
                 "correct": correct,
                 "wrong": wrong,
                 "points": points,
                 "avg_time": avg_time,
                 "exercise_type": "multiplication_basic"
-            })
-
-            # Обновляем рекорд в сессии (и, при желании, можно обновлять в БД)
-            if points > session.get("record", 0):
-                session["record"] = points
-                # Если есть метод обновления лучшего результата, можно раскомментировать:
-                # db.update_user_best_score(session["user"]["id"], points)
+            }, key=result_key(data.get("result_id")))
+        except Exception as e:
+            print(f"Result saving error: {e}")
 
-    except Exception as e:
-        print(f"Result saving error: {e}")
-        # Fallback: сохраняем только в сессии
-        if points > session.get("record", 0):
-            session["record"] = points
+    if points > session.get("record", 0):
+        session["record"] = points
 
     return render_template(
         "result.html",
@@ -143,52 +285,441 @@ def result():
         record=session.get("record", 0),
     )
 
+# ----- Метрики -----
+@app.route("/api/metrics")
+@login_required
+@teacher_required
+def api_metrics():
+    return jsonify({
+        "db_pool": db.pool_stats(),
+        "cache": db.cache_stats(),
+        "result_queue": result_writer.metrics(),
+        "sessions": session_interface.metrics(),
+        "partitions": partition_manager.metrics(),
+        "scheduler": scheduler.metrics(),
+        "leaderboard": leaderboard.metrics(),
+    })
+
+@app.route("/metrics")
+def prometheus_metrics():
+    # Текстовый формат Prometheus: гистограммы латентности маршрутов, время в БД, состояние пула/кеша/очереди
+    # Тайминги и маршруты наружу не отдаём: по умолчанию выключено, токен — для scrape через общую сеть
+    if not Config.METRICS_ENABLED:
+        abort(404)
+    if Config.METRICS_TOKEN and not hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(), f"Bearer {Config.METRICS_TOKEN}".encode()):
+        abort(401)
+    pool = db.pool_stats()
+    cache = db.cache_stats()
+    queue = result_writer.metrics()
+    sessions = session_interface.metrics()
+    gauges = {
+        "db_pool_connections": ("Соединения пула", {
+            (("state", "in_use"),): pool.get("in_use", 0),
+            (("state", "idle"),): pool.get("idle", 0),
+            (("state", "waiting"),): pool.get("waiting", 0),
+        }),
+        "db_pool_created_total": ("Открыто соединений за всё время", {None: pool.get("created", 0)}),
+        "cache_requests_total": ("Обращения к кешу запросов", {
+            (("result", "hit"),): cache["hits"],
+            (("result", "miss"),): cache["misses"],
+        }),
+        "cache_evictions_total": ("Вытеснено из кеша", {None: cache["evictions"]}),
+        "result_queue_depth": ("Результатов в очереди записи", {None: queue["queue_depth"]}),
+        "result_queue_spooled": ("Результатов в spool-файле", {None: queue["spooled_pending"]}),
+        "result_queue_last_flush_ms": ("Длительность последней записи пачки", {None: queue["last_flush_ms"]}),
+        "session_cache_requests_total": ("Чтения сессий через кеш", {
+            (("result", "hit"),): sessions["cache_hits"],
+            (("result", "miss"),): sessions["cache_misses"],
+        }),
+        "session_pending_touches": ("Продлений сессий в очереди на запись", {None: sessions["pending_touches"]}),
+        "session_swept_total": ("Удалено истёкших сессий", {None: sessions["swept"]}),
+    }
+    return Response(profiler.render_prometheus(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/queries")
+@login_required
+@teacher_required
+def debug_queries():
+    # Последние HTTP-запросы: маршрут, время, время в БД и каждый SQL (метод, мс, строки)
+    limit = request.args.get("limit", 20, type=int)
+    return jsonify({"slow_query_ms": profiler.slow_query_ms, "requests": profiler.recent(limit)})
+
+# ----- API: пакетная запись ответов -----
+@app.route("/api/attempts", methods=["POST"])
+@login_required
+def api_attempts():
+    user = session.get("user", {})
+    if not user.get("id"):
+        return jsonify({"ok": False, "error": "Нет пользователя в БД"}), 409
+
+    data = request.get_json(silent=True)
+    items = data.get("attempts") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({"ok": False, "error": "Ожидается массив attempts"}), 400
+    if len(items) > Config.ATTEMPTS_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"Не больше {Config.ATTEMPTS_BATCH_MAX} ответов за раз"}), 413
+
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            rows.append(validate_attempt(item))
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    try:
+        accepted = db.save_exercise_attempts(user["id"], rows)
+    except Exception as e:
+        print(f"Attempts saving error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось сохранить ответы"}), 503
+
+    scheduler.record(user["id"], rows)
+    return jsonify({"ok": True, "accepted": accepted, "errors": errors})
+
 # ----- Teacher area -----
+def course_filters():
+    """Фильтры страницы курса из query string: поиск, даты (YYYY-MM-DD, «до» — исключая) и сортировка"""
+    return {
+        "query": request.args.get("q", "").strip() or None,
+        "date_from": request.args.get("from") or None,
+        "date_to": request.args.get("to") or None,
+        "sort": request.args.get("sort") or "percent_desc",
+    }
+
+def page_limit():
+    limit = request.args.get("limit", Config.COURSE_PAGE_SIZE, type=int)
+    return max(1, min(limit, Config.COURSE_PAGE_MAX))
+
 @app.route("/teacher/courses/<int:course_id>")
 @login_required
 @teacher_required
 def teacher_course_students(course_id):
-    q = request.args.get("q", "").strip() or None
-    date_from = request.args.get("from") or None   # формат YYYY-MM-DD
-    date_to   = request.args.get("to") or None     # формат YYYY-MM-DD (исключающая верхняя граница)
-    sort      = request.args.get("sort") or "percent_desc"
+    filters = course_filters()
 
+    # Первая страница; остальные догружаются через /api/courses/<id>/stats по next_cursor
     try:
-        students = db.get_course_students_stats(course_id, q, date_from, date_to, sort)
+        page = db.get_course_students_stats_page(course_id, **filters, limit=Config.COURSE_PAGE_SIZE)
     except Exception as e:
         print(f"teacher_course_students error: {e}")
-        students = []
+        page = {"students": [], "next_cursor": None, "total": 0}
 
     return render_template(
         "teacher_course.html",
         course_id=course_id,
-        students=students,
-        q=(q or ""),
-        date_from=date_from or "",
-        date_to=date_to or "",
-        sort=sort
+        students=page["students"],
+        next_cursor=page["next_cursor"],
+        total=page["total"] or len(page["students"]),
+        q=(filters["query"] or ""),
+        date_from=filters["date_from"] or "",
+        date_to=filters["date_to"] or "",
+        sort=filters["sort"]
     )
 
+@app.route("/api/courses/<int:course_id>/stats")
+@login_required
+@teacher_required
+def api_course_stats(course_id):
+    try:
+        page = db.get_course_students_stats_page(
+            course_id, **course_filters(), after=request.args.get("cursor") or None, limit=page_limit())
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Course stats error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось загрузить статистику"}), 500
+    return jsonify({"ok": True, **page})
+
+@app.route("/api/courses/<int:course_id>/students")
+@login_required
+@teacher_required
+def api_course_students(course_id):
+    try:
+        page = db.get_course_students_page(
+            course_id, after=request.args.get("cursor") or None, limit=page_limit())
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Course students error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось загрузить учеников"}), 500
+    return jsonify({"ok": True, **page})
+
+@app.route("/api/courses/<int:course_id>/students/search")
+@login_required
+@teacher_required
+def api_course_students_search(course_id):
+    # Подсказки для строки поиска: только top-N совпадений, без статистики и пагинации
+    query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", Config.COURSE_SEARCH_LIMIT, type=int)
+    limit = max(1, min(limit, Config.COURSE_SEARCH_MAX))
+    try:
+        students = db.search_course_students(course_id, query, limit) if query else []
+    except Exception as e:
+        print(f"Course search error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось выполнить поиск"}), 500
+    return jsonify({"ok": True, "q": query, "students": students})
+
+EXPORT_COLUMNS = ["id", "email", "last_name", "first_name", "attempts",
+                  "total_correct", "total_wrong", "percent_correct", "avg_time"]
+
+@app.route("/teacher/courses/<int:course_id>/export")
+@login_required
+@teacher_required
+def teacher_course_export(course_id):
+    # Потоковая выгрузка (?format=csv|ndjson) с серверным курсором: память не растёт с размером курса
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        abort(400)
+    rows = db.stream_course_students_stats(course_id, **course_filters())
+
+    def generate_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow([row.get(c) if row.get(c) is not None else "" for c in EXPORT_COLUMNS])
+            if buf.tell() > 16384:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    def generate_ndjson():
+        for row in rows:
+            yield json.dumps({c: row.get(c) for c in EXPORT_COLUMNS}, ensure_ascii=False,
+                             default=lambda v: float(v) if isinstance(v, Decimal) else str(v)) + "\n"
+
+    if fmt == "csv":
+        body, mimetype = generate_csv(), "text/csv; charset=utf-8"
+    else:
+        body, mimetype = generate_ndjson(), "application/x-ndjson"
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="course_{course_id}.{fmt}"'
+    return response
+
 @app.route("/api/courses/<int:course_id>/students/<int:student_id>/delete", methods=["POST"])
 @login_required
 @teacher_required
 def api_delete_student(course_id, student_id):
     try:
         # порядок аргументов как в твоём database.py
-        db.remove_student_from_course(student_id, course_id)
-        students = db.get_course_students(course_id)  # обновлённый список
-        return jsonify({"ok": True, "students": students})
+        outcome = db.remove_student_from_course(student_id, course_id)
+        leaderboard.forget_course(course_id)
+        # Возвращаем только изменение, а не весь обновлённый список
+        return jsonify({"ok": True, "student_id": student_id, **outcome})
     except Exception as e:
         print(f"Delete student error: {e}")
         return jsonify({"ok": False, "error": "Не удалось удалить ученика"}), 500
 
-# ----- API: задачи умножения -----
+@app.route("/api/courses/<int:course_id>/students/<int:student_id>/invite", methods=["POST"])
+@login_required
+@teacher_required
+def api_issue_invite(course_id, student_id):
+    # Новый код первого входа (прежний перестаёт действовать) — ученику курса, ещё не задавшему пароль
+    code = new_invite_code()
+    try:
+        issued = db.issue_invite(course_id, student_id, invite_code_hash(code))
+    except Exception as e:
+        print(f"Issue invite error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось выдать код"}), 500
+    if not issued:
+        return jsonify({"ok": False, "error": "Ученик не найден на курсе или уже задал пароль"}), 404
+    return jsonify({"ok": True, "student_id": student_id, "invite": code})
+
+EMAIL_RE = re.compile(r"^[^@\s,;]+@[^@\s,;]+\.[^@\s,;]+$")
+
+def parse_student_ids(ids):
+    """
+    student_ids массовой операции со списком курса -> (целые id, ошибки по элементам).
+    Дробные (1.5) не усекаем, как и ответы в validate_attempt, — такой элемент получает статус invalid.
+    """
+    if not isinstance(ids, list) or not ids:
+        raise ValueError("Ожидается непустой список student_ids")
+    if len(ids) > Config.ROSTER_BULK_MAX:
+        raise ValueError(f"Не больше {Config.ROSTER_BULK_MAX} учеников за раз")
+    student_ids, errors = [], []
+    for index, raw in enumerate(ids):
+        try:
+            student_id = _int_or_none(raw)
+        except (TypeError, ValueError):
+            student_id = None
+        if student_id is None or student_id <= 0:
+            errors.append({"index": index, "student_id": raw, "status": "invalid"})
+        else:
+            student_ids.append(student_id)
+    return student_ids, errors
+
+def roster_student_ids():
+    """student_ids из JSON-тела массовой операции со списком курса: (id, ошибки)"""
+    return parse_student_ids((request.get_json(silent=True) or {}).get("student_ids"))
+
+def parse_roster_csv(text):
+    """
+    CSV со списком класса: email[,фамилия[,имя]], разделитель «,», «;» или табуляция,
+    строка заголовка необязательна. Возвращает (ученики, ошибки по строкам).
+    """
+    sample = text[:2048]
+    delimiter = max(",;\t", key=sample.count) if any(d in sample for d in ",;\t") else ","
+    students, errors = [], []
+    for line_no, row in enumerate(csv.reader(io.StringIO(text), delimiter=delimiter), start=1):
+        cells = [c.strip() for c in row]
+        if not any(cells):
+            continue
+        email = cells[0]
+        if line_no == 1 and "@" not in email:
+            continue   # заголовок
+        if not EMAIL_RE.match(email):
+            errors.append({"line": line_no, "email": email, "status": "invalid"})
+            continue
+        students.append({
+            "email": email,
+            "last_name": cells[1] if len(cells) > 1 else "",
+            "first_name": cells[2] if len(cells) > 2 else "",
+        })
+    return students, errors
+
+def issue_invites(students):
+    """
+    Коды первого входа для импортируемых учеников: в students[i]['invite_hash'] — хеш для БД,
+    возвращается {email: код} — коды показываются учителю один раз, в ответе импорта.
+    """
+    codes = {}
+    for student in students:
+        code = codes.setdefault(student["email"], new_invite_code())
+        student["invite_hash"] = invite_code_hash(code)
+    return codes
+
+def attach_invites(results, codes):
+    """Код — только тем, кого импорт создал: у остальных пароль уже есть или код выдан раньше"""
+    for item in results:
+        if item["status"] == "created":
+            item["invite"] = codes[item["email"]]
+    return results
+
+def roster_summary(results):
+    summary = {}
+    for item in results:
+        summary[item["status"]] = summary.get(item["status"], 0) + 1
+    return summary
+
+@app.route("/api/courses/<int:course_id>/students/assign", methods=["POST"])
+@login_required
+@teacher_required
+def api_assign_students(course_id):
+    # {"student_ids": [...]} — запись на курс одним запросом, итог по каждому id
+    try:
+        student_ids, errors = roster_student_ids()
+        results = db.assign_students_to_course(course_id, student_ids, session["user"].get("id"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Assign students error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось записать учеников"}), 500
+    leaderboard.forget_course(course_id)
+    return jsonify({"ok": True, "summary": roster_summary(results + errors), "results": results, "errors": errors})
+
+@app.route("/api/courses/<int:course_id>/students/remove", methods=["POST"])
+@login_required
+@teacher_required
+def api_remove_students(course_id):
+    # {"student_ids": [...]} — удаление с курса одним запросом
+    try:
+        student_ids, errors = roster_student_ids()
+        outcome = db.remove_students_from_course(course_id, student_ids)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Remove students error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось удалить учеников"}), 500
+    leaderboard.forget_course(course_id)
+    return jsonify({"ok": True, "summary": roster_summary(outcome["results"] + errors), **outcome, "errors": errors})
+
+@app.route("/api/courses/<int:course_id>/students/import", methods=["POST"])
+@login_required
+@teacher_required
+def api_import_students(course_id):
+    # CSV файлом (поле file) или телом запроса; недостающие ученики создаются в том же запросе
+    upload = request.files.get("file")
+    raw = upload.read() if upload else request.get_data()
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return jsonify({"ok": False, "error": "Файл должен быть в кодировке UTF-8"}), 400
+
+    students, errors = parse_roster_csv(text)
+    if len(students) > Config.ROSTER_BULK_MAX:
+        return jsonify({"ok": False, "error": f"Не больше {Config.ROSTER_BULK_MAX} учеников за раз"}), 400
+    results = []
+    if students:
+        codes = issue_invites(students)
+        try:
+            results = attach_invites(
+                db.import_students_to_course(course_id, students, session["user"].get("id")), codes)
+        except Exception as e:
+            print(f"Import students error: {e}")
+            return jsonify({"ok": False, "error": "Не удалось импортировать учеников"}), 500
+        leaderboard.forget_course(course_id)
+    return jsonify({"ok": True, "summary": roster_summary(results + errors), "results": results, "errors": errors})
+
+# ----- API: задачи -----
 @app.route("/api/task")
 @login_required
 def api_task():
-    a = random.randint(2, 9)
-    b = random.randint(2, 9)
-    return jsonify({"a": a, "b": b, "answer": a * b})
+    # ?type=<exercise_types.name>&n=<сколько задач>; без n — одна задача, как раньше
+    exercise_type = request.args.get("type") or "multiplication_basic"
+    n = request.args.get("n", type=int)
+    if n is not None and not 1 <= n <= Config.TASK_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"n должно быть от 1 до {Config.TASK_BATCH_MAX}"}), 400
+
+    user_id = session.get("user", {}).get("id")
+    try:
+        if Config.SCHEDULER_ENABLED and user_id:
+            # Чаще — факты, где ученик ошибается или отвечает медленно (scheduler.py)
+            tasks = scheduler.generate(user_id, exercise_type, n or 1)
+        else:
+            tasks = task_generator.generate(exercise_type, n or 1)
+    except UnknownExerciseType:
+        return jsonify({"ok": False, "error": "Неизвестный тип упражнения"}), 404
+
+    if n is None:
+        return jsonify(tasks[0])
+    return jsonify({"type": exercise_type, "tasks": tasks})
+
+# ----- API: рейтинги -----
+@app.route("/api/leaderboard")
+@login_required
+def api_leaderboard():
+    # ?type=<exercise_types.name>[&course=<id>][&limit=N]: первые N, своё место и процентиль
+    user = session.get("user", {})
+    exercise_type = request.args.get("type") or "multiplication_basic"
+    course_id = request.args.get("course", type=int)
+    limit = request.args.get("limit", Config.LEADERBOARD_TOP_LIMIT, type=int)
+    limit = max(1, min(limit, Config.LEADERBOARD_TOP_MAX))
+    try:
+        if course_id is not None and user.get("role") != "teacher" \
+                and not leaderboard.is_member(course_id, user.get("id")):
+            return jsonify({"ok": False, "error": "Нет доступа к рейтингу курса"}), 403
+        top = leaderboard.top(exercise_type, course_id, limit)
+        me = leaderboard.rank(user["id"], exercise_type, course_id) if user.get("id") else None
+        names = db.get_users_brief([row["user_id"] for row in top])
+    except Exception as e:
+        print(f"Leaderboard error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось загрузить рейтинг"}), 500
+    for row in top:
+        row["name"] = display_name(names.get(row["user_id"], {}))
+        row["me"] = row["user_id"] == user.get("id")
+    return jsonify({"ok": True, "type": exercise_type, "course": course_id, "top": top, "me": me})
+
+@app.route("/api/leaderboard/rebuild", methods=["POST"])
+@login_required
+@teacher_required
+def api_leaderboard_rebuild():
+    # Перечитать рейтинги этого процесса из user_exercise_stats, не дожидаясь LEADERBOARD_REFRESH_INTERVAL
+    try:
+        players = leaderboard.rebuild()
+    except Exception as e:
+        print(f"Leaderboard rebuild error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось перестроить рейтинг"}), 500
+    return jsonify({"ok": True, "players": players})
 
 # ----- Личный кабинет -----
 @app.route("/profile")
@@ -199,30 +730,19 @@ def profile():
     record = session.get("record", 0)
 
     user_stats = []
+    last_results = []
+    ranks = {}
     try:
-        raw = None
         if user.get("id"):
-            raw = db.get_user_stats(user["id"])
-        if isinstance(raw, dict):
-            user_stats = [raw]
-        elif isinstance(raw, list):
-            user_stats = [x for x in raw if isinstance(x, dict)]
-        else:
-            user_stats = []
+            # Итоги, график и последние результаты — одним запросом к БД
+            data = db.get_profile_data(user["id"], limit=10)
+            user_stats = [data["stats"]]
+            last_results = data["recent_results"]
+            ranks = leaderboard.user_ranks(user["id"])
     except Exception as e:
         print(f"Profile stats error: {e}")
         user_stats = []
-
-    # ↓↓↓ ДОБАВЬ ЭТО ↓↓↓
-    last_results = []
-    try:
-        if user.get("id"):
-            # ожидается метод в database.py; limit=10
-            last_results = db.get_last_results(user["id"], limit=10)
-    except Exception as e:
-        print(f"Profile last_results error: {e}")
         last_results = []
-    # ↑↑↑ ДОБАВЬ ЭТО ↑↑↑
 
     return render_template(
         "profile.html",
@@ -230,7 +750,69 @@ def profile():
         record=record,
         user_stats=user_stats,
         last_results=last_results,   # ← ВАЖНО: передаём в шаблон
+        ranks=ranks,
     )
 
+# -------------------- CLI --------------------
+@app.cli.command("rebuild-stats")
+@click.option("--user-id", type=int, default=None, help="Пересчитать только для одного пользователя")
+def rebuild_stats_command(user_id):
+    """Пересчитать user_exercise_stats и user_daily_stats из истории exercise_results."""
+    rows = db.rebuild_user_stats(user_id)
+    click.echo(f"user_exercise_stats: пересчитано строк — {rows}")
+    rows = db.rebuild_daily_stats(user_id)
+    click.echo(f"user_daily_stats: пересчитано строк — {rows}")
+
+@app.cli.command("partitions-migrate")
+@click.option("--keep-flat", is_flag=True, help="Не удалять старые таблицы (<таблица>_flat)")
+def partitions_migrate_command(keep_flat):
+    """Перевести exercise_results и exercise_attempts на месячные секции."""
+    moved = partition_manager.migrate(keep_flat=keep_flat)
+    if not moved:
+        click.echo("Таблицы уже секционированы")
+    for table, rows in moved.items():
+        click.echo(f"{table}: перенесено строк — {rows}")
+
+@app.cli.command("partitions-ensure")
+def partitions_ensure_command():
+    """Создать месячные секции на PARTITION_MONTHS_AHEAD месяцев вперёд."""
+    for table, created in partition_manager.ensure().items():
+        click.echo(f"{table}: создано секций — {created}")
+
+@app.cli.command("partitions-archive")
+@click.option("--keep-months", type=int, default=None,
+              help="Сколько месяцев хранить, считая текущий (по умолчанию PARTITION_RETENTION_MONTHS)")
+@click.option("--dry-run", is_flag=True, help="Только показать, какие секции будут архивированы")
+def partitions_archive_command(keep_months, dry_run):
+    """Отсоединить старые секции, выгрузить их в PARTITION_ARCHIVE_DIR (csv.gz) и удалить."""
+    if keep_months is None and Config.PARTITION_RETENTION_MONTHS < 1:
+        raise click.UsageError("Задайте --keep-months или PARTITION_RETENTION_MONTHS")
+    try:
+        archived = partition_manager.archive(keep_months, dry_run=dry_run)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for entry in archived:
+        if dry_run:
+            click.echo(f"{entry['partition']}: будет архивирована")
+        else:
+            click.echo(f"{entry['partition']}: {entry['rows']} строк → {entry['file']}")
+    if not archived:
+        click.echo("Архивировать нечего")
+
+@app.cli.command("rebuild-leaderboard")
+@click.option("--top", type=int, default=3, help="Сколько лучших показать по каждому типу")
+def rebuild_leaderboard_command(top):
+    """Построить рейтинги из user_exercise_stats и показать лидеров (проверка данных).
+
+    Работающие процессы приложения перечитывают рейтинги сами раз в LEADERBOARD_REFRESH_INTERVAL
+    или по POST /api/leaderboard/rebuild; исходные best_points пересчитывает rebuild-stats.
+    """
+    for exercise_type, players in leaderboard.rebuild().items():
+        leaders = leaderboard.top(exercise_type, limit=top)
+        names = db.get_users_brief([row["user_id"] for row in leaders])
+        shown = ", ".join(f"{row['rank']}. {display_name(names.get(row['user_id'], {}))} — {row['score']}"
+                          for row in leaders)
+        click.echo(f"{exercise_type}: участников — {players}; {shown}")
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,508 @@
+"""
+Асинхронный (ASGI) режим тренажёра: те же маршруты и шаблоны, что в app.py, на Quart
+и AsyncDatabaseManager. Ожидание БД не занимает поток, а независимые запросы
+(например, итоги и последние результаты профиля) выполняются параллельно.
+
+    hypercorn asgi_app:app --bind 0.0.0.0:8000 --workers 2
+
+Отличия от синхронного режима:
+  - сессия — подписанная cookie Quart (как SESSION_BACKEND=cookie);
+  - нет профилирования SQL (/metrics, /debug/queries, заголовки X-DB-*);
+  - результаты по-прежнему пишет фоновый result_writer, пароли проверяет пул passwords.py.
+"""
+import asyncio
+import csv
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal
+from functools import wraps
+
+from quart import Quart, render_template, request, redirect, url_for, session, jsonify, Response, abort
+
+from app import (
+    EXPORT_COLUMNS, validate_attempt, validate_result, result_key, parse_roster_csv, parse_student_ids, roster_summary,
+    issue_invites, attach_invites,
+)
+from async_database import async_db
+from config import Config
+from database import db
+from passwords import (
+    password_hasher, hash_password, check_password, PasswordHasherBusy,
+    new_invite_code, invite_code_hash, check_invite_code,
+)
+from result_queue import result_writer
+from scheduler import scheduler
+from leaderboard import leaderboard, display_name
+from tasks import task_generator, UnknownExerciseType
+
+app = Quart(__name__)
+app.secret_key = "dev-secret-change-me"
+app.permanent_session_lifetime = timedelta(days=7)
+
+
+@app.before_serving
+async def _open_pool():
+    await async_db.open()
+
+
+@app.after_serving
+async def _close_pool():
+    await async_db.close()
+
+
+# -------------------- Helpers --------------------
+def login_required(fn):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if not session.get("user"):
+            return redirect(url_for("login"))
+        return await fn(*args, **kwargs)
+    return wrapper
+
+def teacher_required(fn):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        user = session.get("user")
+        if not user or user.get("role") != "teacher":
+            return redirect(url_for("trainer"))
+        return await fn(*args, **kwargs)
+    return wrapper
+
+def course_filters():
+    return {
+        "query": request.args.get("q", "").strip() or None,
+        "date_from": request.args.get("from") or None,
+        "date_to": request.args.get("to") or None,
+        "sort": request.args.get("sort") or "percent_desc",
+    }
+
+def page_limit():
+    limit = request.args.get("limit", Config.COURSE_PAGE_SIZE, type=int)
+    return max(1, min(limit, Config.COURSE_PAGE_MAX))
+
+async def roster_student_ids():
+    return parse_student_ids((await request.get_json(silent=True) or {}).get("student_ids"))
+
+# -------------------- Routes --------------------
+@app.route("/", methods=["GET"])
+async def index():
+    if session.get("user"):
+        return redirect(url_for("trainer"))
+    return redirect(url_for("login"))
+
+@app.route("/login", methods=["GET", "POST"])
+async def login():
+    if request.method == "GET" and session.get("user"):
+        return redirect(url_for("trainer"))
+
+    if request.method == "POST":
+        form = await request.form
+        email = form.get("email", "").strip()
+        password = form.get("password", "").strip()
+
+        if email and password:
+            try:
+                user = await async_db.get_user_by_email(email)
+                if not user:
+                    user_id = await async_db.create_user(email, await asyncio.to_thread(hash_password, password))
+                    user = {'id': user_id, 'email': email}
+                elif not user.get('password_hash'):
+                    # Первый пароль ученика из импорта — только с кодом от учителя
+                    if not check_invite_code(form.get("invite", ""), user.get('invite_hash')):
+                        return await render_template("login.html", error="Для первого входа введите код от учителя",
+                                                     need_invite=True), 401
+                    new_hash = await asyncio.to_thread(hash_password, password)
+                    if not await async_db.accept_invite(user['id'], new_hash, user['invite_hash']):
+                        return await render_template("login.html", error="Неверный пароль"), 401
+                else:
+                    stored = user['password_hash']
+                    # KDF считается в пуле passwords.py, цикл событий в это время свободен
+                    if not await asyncio.to_thread(check_password, password, stored):
+                        return await render_template("login.html", error="Неверный пароль"), 401
+                    if password_hasher.needs_rehash(stored):
+                        try:
+                            new_hash = await asyncio.to_thread(hash_password, password)
+                            await async_db.update_password_hash(user['id'], new_hash, current=stored)
+                        except Exception as e:
+                            print(f"Password rehash error: {e}")
+
+                session.permanent = True
+                session["user"] = {
+                    "id": user['id'],
+                    "email": email,
+                    "role": user.get('role', 'student')
+                }
+                session["record"] = await async_db.get_user_best_score(user['id']) or 0
+                return redirect(url_for("trainer"))
+
+            except PasswordHasherBusy as e:
+                print(f"Login busy: {e}")
+                return await render_template("login.html", error="Слишком много входов, попробуйте через несколько секунд"), 503
+            except Exception as e:
+                # Без БД пароль не проверить — не впускаем
+                print(f"Login error: {e}")
+                return await render_template("login.html", error="Вход временно недоступен, попробуйте позже"), 503
+        else:
+            return await render_template("login.html", error="Заполните поля"), 400
+
+    return await render_template("login.html")
+
+@app.route("/logout")
+async def logout():
+    session.clear()
+    return redirect(url_for("login"))
+
+@app.route("/trainer")
+@login_required
+async def trainer():
+    return await render_template("trainer.html", record=session.get("record", 0))
+
+@app.route("/result", methods=["POST"])
+@login_required
+async def result():
+    data = await request.get_json(silent=True) or await request.form
+    try:
+        correct, wrong, points, avg_time = validate_result(data)
+    except ValueError:
+        abort(400)
+    total = correct + wrong
+    percent = round((correct / total) * 100, 2) if total else 0.0
+
+    if session.get("user") and session["user"].get("id"):
+        try:
+            result_writer.enqueue(session["user"]["id"], {
+                "correct": correct,
+                "wrong": wrong,
+                "points": points,
+                "avg_time": avg_time,
+                "exercise_type": "multiplication_basic"
+            }, key=result_key(data.get("result_id")))
+        except Exception as e:
+            print(f"Result saving error: {e}")
+
+    if points > session.get("record", 0):
+        session["record"] = points
+
+    return await render_template(
+        "result.html",
+        points=points,
+        correct=correct,
+        wrong=wrong,
+        avg_time=avg_time,
+        percent=percent,
+        record=session.get("record", 0),
+    )
+
+@app.route("/api/metrics")
+@login_required
+@teacher_required
+async def api_metrics():
+    return jsonify({
+        "db_pool": async_db.pool_stats(),
+        "cache": async_db.cache_stats(),
+        "result_queue": result_writer.metrics(),
+        "scheduler": scheduler.metrics(),
+        "leaderboard": leaderboard.metrics(),
+    })
+
+@app.route("/api/attempts", methods=["POST"])
+@login_required
+async def api_attempts():
+    user = session.get("user", {})
+    if not user.get("id"):
+        return jsonify({"ok": False, "error": "Нет пользователя в БД"}), 409
+
+    data = await request.get_json(silent=True)
+    items = data.get("attempts") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({"ok": False, "error": "Ожидается массив attempts"}), 400
+    if len(items) > Config.ATTEMPTS_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"Не больше {Config.ATTEMPTS_BATCH_MAX} ответов за раз"}), 413
+
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            rows.append(validate_attempt(item))
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    try:
+        accepted = await async_db.save_exercise_attempts(user["id"], rows)
+    except Exception as e:
+        print(f"Attempts saving error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось сохранить ответы"}), 503
+
+    scheduler.record(user["id"], rows)
+    return jsonify({"ok": True, "accepted": accepted, "errors": errors})
+
+# ----- Teacher area -----
+@app.route("/teacher/courses/<int:course_id>")
+@login_required
+@teacher_required
+async def teacher_course_students(course_id):
+    filters = course_filters()
+    try:
+        page = await async_db.get_course_students_stats_page(course_id, **filters, limit=Config.COURSE_PAGE_SIZE)
+    except Exception as e:
+        print(f"teacher_course_students error: {e}")
+        page = {"students": [], "next_cursor": None, "total": 0}
+
+    return await render_template(
+        "teacher_course.html",
+        course_id=course_id,
+        students=page["students"],
+        next_cursor=page["next_cursor"],
+        total=page["total"] or len(page["students"]),
+        q=(filters["query"] or ""),
+        date_from=filters["date_from"] or "",
+        date_to=filters["date_to"] or "",
+        sort=filters["sort"]
+    )
+
+@app.route("/api/courses/<int:course_id>/stats")
+@login_required
+@teacher_required
+async def api_course_stats(course_id):
+    try:
+        page = await async_db.get_course_students_stats_page(
+            course_id, **course_filters(), after=request.args.get("cursor") or None, limit=page_limit())
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Course stats error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось загрузить статистику"}), 500
+    return jsonify({"ok": True, **page})
+
+@app.route("/api/courses/<int:course_id>/students")
+@login_required
+@teacher_required
+async def api_course_students(course_id):
+    try:
+        page = await async_db.get_course_students_page(
+            course_id, after=request.args.get("cursor") or None, limit=page_limit())
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Course students error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось загрузить учеников"}), 500
+    return jsonify({"ok": True, **page})
+
+@app.route("/api/courses/<int:course_id>/students/search")
+@login_required
+@teacher_required
+async def api_course_students_search(course_id):
+    query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", Config.COURSE_SEARCH_LIMIT, type=int)
+    limit = max(1, min(limit, Config.COURSE_SEARCH_MAX))
+    try:
+        students = await async_db.search_course_students(course_id, query, limit) if query else []
+    except Exception as e:
+        print(f"Course search error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось выполнить поиск"}), 500
+    return jsonify({"ok": True, "q": query, "students": students})
+
+@app.route("/teacher/courses/<int:course_id>/export")
+@login_required
+@teacher_required
+async def teacher_course_export(course_id):
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        abort(400)
+    rows = async_db.stream_course_students_stats(course_id, **course_filters())
+
+    async def generate_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_COLUMNS)
+        async for row in rows:
+            writer.writerow([row.get(c) if row.get(c) is not None else "" for c in EXPORT_COLUMNS])
+            if buf.tell() > 16384:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    async def generate_ndjson():
+        async for row in rows:
+            yield json.dumps({c: row.get(c) for c in EXPORT_COLUMNS}, ensure_ascii=False,
+                             default=lambda v: float(v) if isinstance(v, Decimal) else str(v)) + "\n"
+
+    if fmt == "csv":
+        body, mimetype = generate_csv(), "text/csv; charset=utf-8"
+    else:
+        body, mimetype = generate_ndjson(), "application/x-ndjson"
+    response = Response(body, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="course_{course_id}.{fmt}"'
+    return response
+
+@app.route("/api/courses/<int:course_id>/students/<int:student_id>/delete", methods=["POST"])
+@login_required
+@teacher_required
+async def api_delete_student(course_id, student_id):
+    try:
+        outcome = await async_db.remove_student_from_course(student_id, course_id)
+        leaderboard.forget_course(course_id)
+        return jsonify({"ok": True, "student_id": student_id, **outcome})
+    except Exception as e:
+        print(f"Delete student error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось удалить ученика"}), 500
+
+@app.route("/api/courses/<int:course_id>/students/<int:student_id>/invite", methods=["POST"])
+@login_required
+@teacher_required
+async def api_issue_invite(course_id, student_id):
+    code = new_invite_code()
+    try:
+        issued = await async_db.issue_invite(course_id, student_id, invite_code_hash(code))
+    except Exception as e:
+        print(f"Issue invite error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось выдать код"}), 500
+    if not issued:
+        return jsonify({"ok": False, "error": "Ученик не найден на курсе или уже задал пароль"}), 404
+    return jsonify({"ok": True, "student_id": student_id, "invite": code})
+
+@app.route("/api/courses/<int:course_id>/students/assign", methods=["POST"])
+@login_required
+@teacher_required
+async def api_assign_students(course_id):
+    try:
+        student_ids, errors = await roster_student_ids()
+        results = await async_db.assign_students_to_course(course_id, student_ids, session["user"].get("id"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Assign students error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось записать учеников"}), 500
+    leaderboard.forget_course(course_id)
+    return jsonify({"ok": True, "summary": roster_summary(results + errors), "results": results, "errors": errors})
+
+@app.route("/api/courses/<int:course_id>/students/remove", methods=["POST"])
+@login_required
+@teacher_required
+async def api_remove_students(course_id):
+    try:
+        student_ids, errors = await roster_student_ids()
+        outcome = await async_db.remove_students_from_course(course_id, student_ids)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Remove students error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось удалить учеников"}), 500
+    leaderboard.forget_course(course_id)
+    return jsonify({"ok": True, "summary": roster_summary(outcome["results"] + errors), **outcome, "errors": errors})
+
+@app.route("/api/courses/<int:course_id>/students/import", methods=["POST"])
+@login_required
+@teacher_required
+async def api_import_students(course_id):
+    upload = (await request.files).get("file")
+    raw = upload.read() if upload else await request.get_data()
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return jsonify({"ok": False, "error": "Файл должен быть в кодировке UTF-8"}), 400
+
+    students, errors = parse_roster_csv(text)
+    if len(students) > Config.ROSTER_BULK_MAX:
+        return jsonify({"ok": False, "error": f"Не больше {Config.ROSTER_BULK_MAX} учеников за раз"}), 400
+    results = []
+    if students:
+        codes = issue_invites(students)
+        try:
+            results = attach_invites(
+                await async_db.import_students_to_course(course_id, students, session["user"].get("id")), codes)
+        except Exception as e:
+            print(f"Import students error: {e}")
+            return jsonify({"ok": False, "error": "Не удалось импортировать учеников"}), 500
+        leaderboard.forget_course(course_id)
+    return jsonify({"ok": True, "summary": roster_summary(results + errors), "results": results, "errors": errors})
+
+# ----- API: задачи -----
+@app.route("/api/task")
+@login_required
+async def api_task():
+    exercise_type = request.args.get("type") or "multiplication_basic"
+    n = request.args.get("n", type=int)
+    if n is not None and not 1 <= n <= Config.TASK_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"n должно быть от 1 до {Config.TASK_BATCH_MAX}"}), 400
+
+    # exercise_types кешируются в task_generator на EXERCISE_TYPES_TTL; устаревший кеш
+    # перечитываем через async_db — синхронный запрос остановил бы весь цикл событий
+    await task_generator.refresh_async(async_db.get_exercise_types)
+    user_id = session.get("user", {}).get("id")
+    try:
+        if Config.SCHEDULER_ENABLED and user_id:
+            # Историю ответов планировщик читает синхронным драйвером — в потоке, не в цикле событий
+            tasks = await asyncio.to_thread(scheduler.generate, user_id, exercise_type, n or 1)
+        else:
+            tasks = task_generator.generate(exercise_type, n or 1)
+    except UnknownExerciseType:
+        return jsonify({"ok": False, "error": "Неизвестный тип упражнения"}), 404
+
+    if n is None:
+        return jsonify(tasks[0])
+    return jsonify({"type": exercise_type, "tasks": tasks})
+
+# ----- API: рейтинги -----
+def _leaderboard_view(user, exercise_type, course_id, limit):
+    # Рейтинги строятся синхронным драйвером — вызывается через to_thread
+    if course_id is not None and user.get("role") != "teacher" \
+            and not leaderboard.is_member(course_id, user.get("id")):
+        return None
+    top = leaderboard.top(exercise_type, course_id, limit)
+    me = leaderboard.rank(user["id"], exercise_type, course_id) if user.get("id") else None
+    names = db.get_users_brief([row["user_id"] for row in top])
+    for row in top:
+        row["name"] = display_name(names.get(row["user_id"], {}))
+        row["me"] = row["user_id"] == user.get("id")
+    return top, me
+
+@app.route("/api/leaderboard")
+@login_required
+async def api_leaderboard():
+    user = session.get("user", {})
+    exercise_type = request.args.get("type") or "multiplication_basic"
+    course_id = request.args.get("course", type=int)
+    limit = request.args.get("limit", Config.LEADERBOARD_TOP_LIMIT, type=int)
+    limit = max(1, min(limit, Config.LEADERBOARD_TOP_MAX))
+    try:
+        view = await asyncio.to_thread(_leaderboard_view, user, exercise_type, course_id, limit)
+    except Exception as e:
+        print(f"Leaderboard error: {e}")
+        return jsonify({"ok": False, "error": "Не удалось загрузить рейтинг"}), 500
+    if view is None:
+        return jsonify({"ok": False, "error": "Нет доступа к рейтингу курса"}), 403
+    top, me = view
+    return jsonify({"ok": True, "type": exercise_type, "course": course_id, "top": top, "me": me})
+
+# ----- Личный кабинет -----
+@app.route("/profile")
+@login_required
+async def profile():
+    user = session.get("user", {})
+    user_stats = []
+    last_results = []
+    ranks = {}
+    try:
+        if user.get("id"):
+            # Итоги, график и последние результаты — три параллельных запроса
+            data = await async_db.get_profile_data(user["id"], limit=10)
+            user_stats = [data["stats"]]
+            last_results = data["recent_results"]
+            ranks = await asyncio.to_thread(leaderboard.user_ranks, user["id"])
+    except Exception as e:
+        print(f"Profile stats error: {e}")
+
+    return await render_template(
+        "profile.html",
+        email=user.get("email", ""),
+        record=session.get("record", 0),
+        user_stats=user_stats,
+        last_results=last_results,
+        ranks=ranks,
+    )
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
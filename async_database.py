@@ -0,0 +1,287 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+from config import Config
+from cache import cached
+from database import db
+from queries import (
+    ROSTER_SORT_KEYS, STATS_SORT_KEYS,
+    CREATE_USER_SQL, USER_BY_EMAIL_SQL, UPDATE_PASSWORD_HASH_SQL, ACCEPT_INVITE_SQL, ISSUE_INVITE_SQL,
+    EXERCISE_TYPES_SQL,
+    SAVE_RESULT_SQL, SAVE_RESULTS_BATCH_SQL, results_batch_params, attempts_insert_sql,
+    BEST_SCORE_SQL, TOTALS_SQL, LAST_ATTEMPTS_SQL, RECENT_RESULTS_SQL, LAST_RESULTS_SQL,
+    user_stats_row, profile_row,
+    course_students_sql, course_stats_sql, course_search_sql, keyset_page, strip_service_columns,
+    REMOVE_STUDENT_SQL, ASSIGN_STUDENTS_SQL, REMOVE_STUDENTS_SQL, IMPORT_STUDENTS_SQL, import_students_params,
+)
+
+
+class AsyncDatabaseManager:
+    """
+    Асинхронный двойник DatabaseManager для ASGI-режима (asgi_app.py): те же методы,
+    но на psycopg 3 (async) с пулом psycopg_pool — ожидание БД не держит поток.
+
+    Плейсхолдеры у psycopg 3 те же, что у psycopg2, поэтому весь SQL общий с DatabaseManager
+    (queries.py); здесь — только выполнение запросов.
+    Кеш чтений общий с синхронным db: его инвалидирует и фоновая запись результатов.
+    Unit of work на запрос здесь нет — каждый вызов работает в своей короткой транзакции,
+    зато независимые запросы можно выполнять параллельно (asyncio.gather).
+    """
+
+    ROSTER_SORT_KEYS = ROSTER_SORT_KEYS
+    STATS_SORT_KEYS = STATS_SORT_KEYS
+
+    def __init__(self, cache):
+        self._pool = None
+        self.cache = cache
+
+    @property
+    def pool(self):
+        """Пул создаётся лениво: в цикле событий сервера, а не при импорте"""
+        if self._pool is None:
+            self._pool = AsyncConnectionPool(
+                Config.DATABASE_URL,
+                min_size=Config.DB_POOL_MIN_SIZE,
+                max_size=Config.DB_POOL_MAX_SIZE,
+                timeout=Config.DB_POOL_TIMEOUT,
+                max_lifetime=Config.DB_POOL_MAX_LIFETIME,
+                max_idle=Config.DB_POOL_HEALTHCHECK_AFTER * 10,
+                check=AsyncConnectionPool.check_connection,
+                open=False,
+            )
+        return self._pool
+
+    async def open(self):
+        await self.pool.open()
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    def pool_stats(self):
+        if self._pool is None:
+            return {}
+        stats = self._pool.get_stats()
+        return {
+            'in_use': stats.get('pool_size', 0) - stats.get('pool_available', 0),
+            'idle': stats.get('pool_available', 0),
+            'waiting': stats.get('requests_waiting', 0),
+            'created': stats.get('connections_num', 0),
+            'timeouts': stats.get('requests_errors', 0),
+            'checkouts': stats.get('requests_num', 0),
+            'min_size': self._pool.min_size,
+            'max_size': self._pool.max_size,
+        }
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def _invalidate(self, *tags):
+        self.cache.invalidate(*tags)
+
+    @asynccontextmanager
+    async def get_connection(self):
+        """Соединение из пула; COMMIT при выходе, ROLLBACK при ошибке"""
+        async with self.pool.connection() as conn:
+            try:
+                yield conn
+            except Exception as e:
+                print(f"Database error: {e}")
+                raise
+
+    async def _fetchone(self, sql, params=None):
+        async with self.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params)
+                return await cur.fetchone()
+
+    async def _scalar(self, sql, params=None):
+        return (await self._fetchone(sql, params))[0]
+
+    async def _fetchall(self, sql, params=None):
+        async with self.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(sql, params)
+                cols = [d.name for d in cur.description]
+                return [dict(zip(cols, row)) for row in await cur.fetchall()]
+
+    # ---------- пользователи ----------
+    async def create_user(self, email, password_hash, role='student', first_name='', last_name=''):
+        row = await self._fetchone(CREATE_USER_SQL, (email, password_hash, role, first_name, last_name))
+        return row[0]
+
+    async def get_user_by_email(self, email):
+        rows = await self._fetchall(USER_BY_EMAIL_SQL, (email,))
+        return rows[0] if rows else None
+
+    async def update_password_hash(self, user_id, password_hash, current):
+        async with self.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(UPDATE_PASSWORD_HASH_SQL, (password_hash, user_id, current))
+                return cur.rowcount == 1
+
+    async def accept_invite(self, user_id, password_hash, invite_hash):
+        async with self.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(ACCEPT_INVITE_SQL, (password_hash, user_id, invite_hash))
+                return cur.rowcount == 1
+
+    async def issue_invite(self, course_id, student_id, invite_hash):
+        async with self.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(ISSUE_INVITE_SQL,
+                                  {'course_id': course_id, 'student_id': student_id, 'invite_hash': invite_hash})
+                return cur.rowcount == 1
+
+    async def get_exercise_types(self):
+        rows = await self._fetchall(EXERCISE_TYPES_SQL)
+        return {r['name']: r['parameters'] or {} for r in rows}
+
+    # ---------- результаты и ответы ----------
+    async def save_exercise_result(self, user_id: int, payload: dict):
+        _, course_ids = await self._fetchone(SAVE_RESULT_SQL, (
+            user_id,
+            payload.get("exercise_type", "multiplication_basic"),
+            int(payload.get("correct", 0)),
+            int(payload.get("wrong", 0)),
+            int(payload.get("points", 0)),
+            float(payload.get("avg_time", 0.0)),
+        ))
+        self._invalidate(f"user:{user_id}", *(f"course:{cid}" for cid in course_ids))
+
+    async def save_exercise_results_batch(self, items: list[dict]):
+        """Идемпотентная пакетная запись (как в DatabaseManager)"""
+        if not items:
+            return 0
+        inserted, course_ids = await self._fetchone(SAVE_RESULTS_BATCH_SQL, results_batch_params(items))
+        self._invalidate(*{f"user:{item['user_id']}" for item in items},
+                         *(f"course:{cid}" for cid in course_ids))
+        return inserted
+
+    async def save_exercise_attempts(self, user_id: int, attempts: list[dict]):
+        """Пакет ответов одним многострочным INSERT (как execute_values в DatabaseManager)"""
+        if not attempts:
+            return 0
+        params = []
+        for a in attempts:
+            params.extend((
+                user_id,
+                a.get("exercise_type", "multiplication_basic"),
+                Jsonb(a["task_data"]),
+                a.get("user_answer"),
+                a.get("is_correct"),
+                a.get("time_spent"),
+            ))
+        async with self.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(attempts_insert_sql(len(attempts)), params)
+        return len(attempts)
+
+    # ---------- статистика ученика ----------
+    @cached("best_score", tags=lambda user_id, **_: ["stats", f"user:{user_id}"])
+    async def get_user_best_score(self, user_id, exercise_type='multiplication_basic'):
+        row = await self._fetchone(BEST_SCORE_SQL, (user_id, exercise_type))
+        return (row[0] if row else 0) or 0
+
+    @cached("user_stats", tags=lambda user_id, **_: ["stats", f"user:{user_id}"])
+    async def get_user_stats(self, user_id, exercise_type='multiplication_basic'):
+        # Итоги и последние попытки — независимые запросы, выполняются параллельно
+        params = {'user_id': user_id, 'exercise_type': exercise_type, 'limit': 10}
+        totals, last_attempts = await asyncio.gather(
+            self._fetchone(TOTALS_SQL, params),
+            self._scalar(LAST_ATTEMPTS_SQL, params),
+        )
+        return user_stats_row(totals, last_attempts)
+
+    @cached("profile", tags=lambda user_id, **_: ["stats", f"user:{user_id}"])
+    async def get_profile_data(self, user_id, exercise_type='multiplication_basic', limit: int = 10):
+        """Данные профиля как в DatabaseManager, но три части PROFILE_SQL идут параллельно"""
+        params = {'user_id': user_id, 'exercise_type': exercise_type, 'limit': limit}
+        totals, last_attempts, recent = await asyncio.gather(
+            self._fetchone(TOTALS_SQL, params),
+            self._scalar(LAST_ATTEMPTS_SQL, params),
+            self._scalar(RECENT_RESULTS_SQL, params),
+        )
+        return profile_row(exercise_type, totals, last_attempts, recent)
+
+    async def get_last_results(self, user_id: int, limit: int = 10):
+        return await self._fetchall(LAST_RESULTS_SQL, (user_id, limit))
+
+    # ---------- курсы ----------
+    async def get_course_students(self, course_id: int):
+        return (await self.get_course_students_page(course_id, limit=None))["students"]
+
+    async def get_course_students_page(self, course_id: int, after: str | None = None, limit: int | None = 50):
+        sql, params, key_count = course_students_sql(course_id, after, limit)
+        return keyset_page(await self._fetchall(sql, params), limit, key_count)
+
+    @cached("course_stats_page", tags=lambda course_id, **_: ["stats", f"course:{course_id}"])
+    async def get_course_students_stats_page(self, course_id: int, query: str | None = None,
+                                             date_from: str | None = None, date_to: str | None = None,
+                                             sort: str | None = None, after: str | None = None,
+                                             limit: int | None = 50):
+        sql, params, key_count = course_stats_sql(course_id, query, date_from, date_to, sort, after, limit)
+        return keyset_page(await self._fetchall(sql, params), limit, key_count)
+
+    async def get_course_students_stats(self, course_id: int, query: str | None = None,
+                                        date_from: str | None = None, date_to: str | None = None,
+                                        sort: str | None = None):
+        page = await self.get_course_students_stats_page(course_id, query, date_from, date_to, sort, limit=None)
+        return page["students"]
+
+    async def stream_course_students_stats(self, course_id: int, query: str | None = None,
+                                           date_from: str | None = None, date_to: str | None = None,
+                                           sort: str | None = None, itersize: int = 500):
+        """Построчная выгрузка через серверный курсор (асинхронный генератор)"""
+        sql, params, key_count = course_stats_sql(course_id, query, date_from, date_to, sort)
+        async with self.pool.connection() as conn:
+            try:
+                async with conn.cursor(name="course_export") as cur:
+                    cur.itersize = itersize
+                    await cur.execute(sql, params)
+                    cols = None
+                    async for row in cur:
+                        if cols is None:
+                            cols = [d.name for d in cur.description]
+                        yield strip_service_columns(dict(zip(cols, row)), key_count)
+            finally:
+                await conn.rollback()
+
+    @cached("course_search", tags=lambda course_id, **_: [f"course:{course_id}"])
+    async def search_course_students(self, course_id: int, query: str, limit: int = 10):
+        search = course_search_sql(course_id, query, limit)
+        if search is None:
+            return []
+        return await self._fetchall(*search)
+
+    async def remove_student_from_course(self, student_id, course_id):
+        removed, before = await self._fetchone(REMOVE_STUDENT_SQL, (student_id, course_id, course_id))
+        self._invalidate(f"course:{course_id}")
+        return {'removed': bool(removed), 'remaining': before - removed}
+
+    async def assign_students_to_course(self, course_id, student_ids, assigned_by=None):
+        rows = await self._fetchall(ASSIGN_STUDENTS_SQL,
+                                    {'ids': list(student_ids), 'course_id': course_id, 'assigned_by': assigned_by})
+        self._invalidate(f"course:{course_id}")
+        return rows
+
+    async def remove_students_from_course(self, course_id, student_ids):
+        rows = await self._fetchall(REMOVE_STUDENTS_SQL, {'ids': list(student_ids), 'course_id': course_id})
+        self._invalidate(f"course:{course_id}")
+        return {
+            'results': [{'student_id': r['student_id'], 'status': r['status']} for r in rows],
+            'remaining': rows[0]['remaining'] if rows else None,
+        }
+
+    async def import_students_to_course(self, course_id, students, assigned_by=None):
+        rows = await self._fetchall(IMPORT_STUDENTS_SQL, import_students_params(course_id, students, assigned_by))
+        self._invalidate(f"course:{course_id}")
+        return rows
+
+
+# Глобальный экземпляр (кеш общий с синхронным db)
+async_db = AsyncDatabaseManager(db.cache)
@@ -0,0 +1,61 @@
+"""
+Сравнение синхронного (Flask, app.py) и асинхронного (Quart, asgi_app.py) режимов
+одним и тем же сценарием bench.loadtest при одинаковой нагрузке.
+
+    flask --app app run --port 5000 --with-threads
+    hypercorn asgi_app:app --bind 127.0.0.1:8000
+    python -m bench.compare_modes --sync-url http://127.0.0.1:5000 --async-url http://127.0.0.1:8000 \\
+        --concurrency 50 --duration 30 --courses 1,2,3 --json compare_modes.json
+
+Остальные параметры — как у bench.loadtest. Для честного сравнения оба режима должны
+смотреть в одну БД и иметь одинаковый DB_POOL_MAX_SIZE.
+"""
+import json
+
+from bench.loadtest import build_parser, run
+
+
+def ratio(sync_value, async_value):
+    return round(async_value / sync_value, 2) if sync_value else None
+
+
+def main():
+    parser = build_parser()
+    parser.description = __doc__
+    parser.add_argument("--sync-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--async-url", default="http://127.0.0.1:8000")
+    args = parser.parse_args()
+
+    reports = {}
+    for mode, url in (("sync", args.sync_url), ("async", args.async_url)):
+        args.base_url = url
+        print(f"Режим {mode}: {url}, {args.concurrency} пользователей, {args.duration:.0f} сек")
+        reports[mode], _ = run(args)
+
+    print(f"\n{'эндпоинт':<24}{'p50 sync':>10}{'p50 async':>11}{'p95 sync':>10}{'p95 async':>11}"
+          f"{'rps sync':>10}{'rps async':>11}{'×rps':>7}{'ошибок s/a':>12}")
+    comparison = {}
+    for endpoint in sorted(set(reports["sync"]) | set(reports["async"])):
+        s = reports["sync"].get(endpoint)
+        a = reports["async"].get(endpoint)
+        if not s or not a:
+            continue
+        comparison[endpoint] = {
+            "sync": s,
+            "async": a,
+            "p50_ratio": ratio(s["p50_ms"], a["p50_ms"]),
+            "p95_ratio": ratio(s["p95_ms"], a["p95_ms"]),
+            "rps_ratio": ratio(s["rps"], a["rps"]),
+        }
+        x = "—" if comparison[endpoint]["rps_ratio"] is None else comparison[endpoint]["rps_ratio"]
+        print(f"{endpoint:<24}{s['p50_ms']:>10}{a['p50_ms']:>11}{s['p95_ms']:>10}{a['p95_ms']:>11}"
+              f"{s['rps']:>10}{a['rps']:>11}{x:>7}{s['errors']:>6}/{a['errors']:<5}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"concurrency": args.concurrency, "duration": args.duration, "endpoints": comparison},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
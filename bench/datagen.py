@@ -0,0 +1,128 @@
+"""
+Генератор тестовых данных для бенчмарков по схеме init_db.sql.
+
+Создаёт учителя, M курсов, N учеников (распределены по курсам по кругу) и по K результатов
+на ученика за последние --days дней, затем пересчитывает накопительную статистику.
+Все созданные записи помечены доменом @bench.local и удаляются флагом --reset.
+
+Запуск из корня проекта (DATABASE_URL берётся из .env):
+    python -m bench.datagen --students 300 --courses 10 --results 200 --reset
+"""
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+from passwords import hash_password
+from database import db
+from partitions import partition_manager
+
+BENCH_DOMAIN = "bench.local"
+TEACHER_EMAIL = f"teacher@{BENCH_DOMAIN}"
+EXERCISE_TYPES = ["multiplication_basic", "multiplication_advanced", "arithmetic_basic", "arithmetic_advanced"]
+FIRST_NAMES = ["Аня", "Борис", "Вера", "Глеб", "Даша", "Егор", "Женя", "Захар", "Ира", "Кирилл"]
+LAST_NAMES = ["Иванов", "Петрова", "Сидоров", "Кузнецова", "Смирнов", "Попова", "Волков", "Зайцева"]
+
+
+def student_email(i):
+    return f"student{i}@{BENCH_DOMAIN}"
+
+
+def reset(cur):
+    # exercise_results, assigned_courses и статистика удаляются каскадно вместе с пользователями
+    cur.execute("DELETE FROM courses WHERE created_by IN (SELECT id FROM users WHERE email LIKE %s)",
+                (f"%@{BENCH_DOMAIN}",))
+    cur.execute("DELETE FROM users WHERE email LIKE %s", (f"%@{BENCH_DOMAIN}",))
+
+
+def copy_rows(cur, table, columns, rows):
+    """Быстрая загрузка через COPY FROM STDIN"""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join("\\N" if v is None else str(v) for v in row) + "\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def generate(students, courses, results, days, password, seed):
+    rng = random.Random(seed)
+    password_hash = hash_password(password)
+    now = datetime.now()
+    # Месячные секции под весь диапазон дат, иначе история ляжет в DEFAULT-секцию
+    partition_manager.ensure(from_month=(now - timedelta(days=days)).date())
+
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO users (email, password_hash, role, first_name, last_name)
+                VALUES (%s, %s, 'teacher', 'Бенч', 'Учитель') RETURNING id
+            """, (TEACHER_EMAIL, password_hash))
+            teacher_id = cur.fetchone()[0]
+
+            copy_rows(cur, "users", ["email", "password_hash", "role", "first_name", "last_name"], (
+                (student_email(i), password_hash, "student", rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+                for i in range(students)
+            ))
+            cur.execute("SELECT id FROM users WHERE email LIKE %s AND role = 'student' ORDER BY id",
+                        (f"student%@{BENCH_DOMAIN}",))
+            student_ids = [r[0] for r in cur.fetchall()]
+
+            course_ids = []
+            for c in range(courses):
+                cur.execute("""
+                    INSERT INTO courses (title, subject, created_by)
+                    VALUES (%s, %s, %s) RETURNING id
+                """, (f"Бенч-курс {c + 1}", rng.choice(["arithmetic", "multiplication"]), teacher_id))
+                course_ids.append(cur.fetchone()[0])
+
+            if course_ids:
+                copy_rows(cur, "assigned_courses", ["student_id", "course_id", "assigned_by"], (
+                    (sid, course_ids[i % len(course_ids)], teacher_id)
+                    for i, sid in enumerate(student_ids)
+                ))
+
+            def result_rows():
+                for sid in student_ids:
+                    for _ in range(results):
+                        correct = rng.randint(0, 20)
+                        wrong = rng.randint(0, 8)
+                        completed_at = now - timedelta(seconds=rng.randint(0, days * 86400))
+                        yield (sid, rng.choice(EXERCISE_TYPES), correct, wrong,
+                               max(0, correct * 10 - wrong * 5),
+                               round(rng.uniform(0.5, 5.0), 3), completed_at.isoformat(sep=" "))
+
+            copy_rows(cur, "exercise_results",
+                      ["user_id", "exercise_type", "correct_count", "wrong_count",
+                       "total_points", "average_time", "completed_at"],
+                      result_rows())
+
+    db.rebuild_user_stats()
+    db.rebuild_daily_stats()
+    return course_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=300, help="N учеников")
+    parser.add_argument("--courses", type=int, default=10, help="M курсов")
+    parser.add_argument("--results", type=int, default=100, help="K результатов на ученика")
+    parser.add_argument("--days", type=int, default=90, help="за сколько дней разбросать результаты")
+    parser.add_argument("--password", default="bench", help="пароль всех созданных пользователей")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="сначала удалить данные прошлого прогона")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.reset:
+        with db.get_connection() as conn:
+            with conn.cursor() as cur:
+                reset(cur)
+    course_ids = generate(args.students, args.courses, args.results, args.days, args.password, args.seed)
+    print(f"Создано: {args.students} учеников, курсы {course_ids}, "
+          f"{args.students * args.results} результатов за {time.perf_counter() - started:.1f} сек")
+    print(f"Учитель: {TEACHER_EMAIL} / {args.password}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Нагрузочный тест горячих эндпоинтов тренажёра: /login, /api/task, /result, /profile,
+/teacher/courses/<id>. Сценарии пользователей выполняются параллельно в --concurrency потоках
+против запущенного приложения (данные — из bench.datagen).
+
+Отчёт по каждому эндпоинту: число запросов, ошибки, p50/p95/p99 латентности, пропускная
+способность и среднее число SQL-запросов (заголовок X-DB-Queries — запустите приложение
+с DB_STATS_HEADERS=1).
+
+    DB_STATS_HEADERS=1 flask --app app run --port 5000 --with-threads
+    python -m bench.loadtest --base-url http://127.0.0.1:5000 --concurrency 30 --duration 60 \\
+        --courses 1,2,3 --json bench_output.json
+
+Сравнение с прошлым прогоном (ненулевой код выхода при регрессии p95 больше порога):
+    python -m bench.loadtest ... --baseline bench_baseline.json --max-regression 20
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from http.cookiejar import CookieJar
+
+from bench.datagen import TEACHER_EMAIL, student_email
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Редиректы не выполняем: меряем сам эндпоинт, а не страницу, куда он отправляет
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.db_queries = defaultdict(list)
+
+    def add(self, endpoint, seconds, ok, db_queries):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+            if db_queries is not None:
+                self.db_queries[endpoint].append(db_queries)
+
+
+class Client:
+    """Один «пользователь» со своими cookie"""
+
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect())
+
+    def request(self, endpoint, path, data=None, json_body=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers)
+
+        started = time.perf_counter()
+        status, db_queries, payload = 0, None, b""
+        try:
+            with self.opener.open(req, timeout=30) as resp:
+                payload = resp.read()
+                status = resp.status
+                db_queries = resp.headers.get("X-DB-Queries")
+        except urllib.error.HTTPError as e:
+            status = e.code
+            db_queries = e.headers.get("X-DB-Queries")
+            payload = e.read()
+        except (urllib.error.URLError, OSError):
+            status = 0
+        elapsed = time.perf_counter() - started
+
+        self.recorder.add(endpoint, elapsed, 200 <= status < 400,
+                          int(db_queries) if db_queries is not None else None)
+        return status, payload
+
+
+def student_journey(client, rng, students, password):
+    client.request("/login", "/login", data={"email": student_email(rng.randrange(students)), "password": password})
+    status, payload = client.request("/api/task", "/api/task?type=multiplication_basic&n=50")
+    tasks = json.loads(payload).get("tasks", []) if status == 200 else []
+    answered = rng.randint(5, min(25, len(tasks))) if len(tasks) >= 5 else 0
+    correct = sum(1 for _ in range(answered) if rng.random() < 0.8)
+    wrong = answered - correct
+    client.request("/result", "/result", json_body={
+        "correct": correct, "wrong": wrong,
+        "points": max(0, correct * 10 - wrong * 5),
+        "avg_time": round(rng.uniform(0.5, 4.0), 2),
+    })
+    client.request("/profile", "/profile")
+
+
+def teacher_journey(client, rng, courses, password):
+    client.request("/login", "/login", data={"email": TEACHER_EMAIL, "password": password})
+    course_id = rng.choice(courses)
+    variants = [
+        "",
+        "?sort=attempts_desc",
+        "?q=" + urllib.parse.quote("ов"),
+        "?from=2000-01-01&to=2100-01-01&sort=avg_time_asc",
+    ]
+    for query in rng.sample(variants, 2):
+        client.request("/teacher/courses/<id>", f"/teacher/courses/{course_id}{query}")
+
+
+def worker(args, recorder, deadline, rng):
+    courses = [int(c) for c in args.courses.split(",") if c] if args.courses else []
+    while time.monotonic() < deadline:
+        client = Client(args.base_url, recorder)
+        if courses and rng.random() < args.teacher_share:
+            teacher_journey(client, rng, courses, args.password)
+        else:
+            student_journey(client, rng, args.students, args.password)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    # метод ближайшего ранга
+    k = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[k - 1]
+
+
+def build_report(recorder, wall_seconds):
+    report = {}
+    for endpoint, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        queries = recorder.db_queries.get(endpoint) or []
+        report[endpoint] = {
+            "count": len(values),
+            "errors": recorder.errors.get(endpoint, 0),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "rps": round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+            "db_queries_avg": round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    return report
+
+
+def print_report(report, wall_seconds, concurrency):
+    print(f"\nДлительность {wall_seconds:.1f} сек, параллельных пользователей: {concurrency}\n")
+    print(f"{'эндпоинт':<24}{'запросов':>9}{'ошибок':>8}{'p50 мс':>10}{'p95 мс':>10}"
+          f"{'p99 мс':>10}{'rps':>9}{'SQL/запр':>10}")
+    for endpoint, r in report.items():
+        q = "—" if r["db_queries_avg"] is None else r["db_queries_avg"]
+        print(f"{endpoint:<24}{r['count']:>9}{r['errors']:>8}{r['p50_ms']:>10}{r['p95_ms']:>10}"
+              f"{r['p99_ms']:>10}{r['rps']:>9}{q:>10}")
+
+
+def compare(report, baseline, max_regression):
+    """Сравнить p95 и число SQL-запросов с прошлым прогоном; вернуть список регрессий."""
+    problems = []
+    for endpoint, base in baseline.items():
+        cur = report.get(endpoint)
+        if not cur:
+            continue
+        if base["p95_ms"] and cur["p95_ms"] > base["p95_ms"] * (1 + max_regression / 100.0):
+            problems.append(f"{endpoint}: p95 {base['p95_ms']} → {cur['p95_ms']} мс")
+        if base.get("db_queries_avg") is not None and cur.get("db_queries_avg") is not None \
+                and cur["db_queries_avg"] > base["db_queries_avg"]:
+            problems.append(f"{endpoint}: SQL-запросов {base['db_queries_avg']} → {cur['db_queries_avg']}")
+    return problems
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--duration", type=float, default=30.0, help="сек")
+    parser.add_argument("--students", type=int, default=300, help="сколько учеников создал bench.datagen")
+    parser.add_argument("--courses", default="", help="id курсов через запятую (для сценария учителя)")
+    parser.add_argument("--teacher-share", type=float, default=0.1, help="доля сценариев учителя")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    parser.add_argument("--baseline", help="отчёт прошлого прогона для сравнения")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="допустимый рост p95, %%")
+    return parser
+
+
+def run(args):
+    """Прогнать сценарии против args.base_url; вернуть (отчёт, длительность в сек)"""
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(target=worker, args=(args, recorder, deadline, random.Random(args.seed + i)), daemon=True)
+        for i in range(args.concurrency)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.monotonic() - started
+
+    return build_report(recorder, wall), wall
+
+
+def main():
+    args = build_parser().parse_args()
+    report, wall = run(args)
+    print_report(report, wall, args.concurrency)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"concurrency": args.concurrency, "duration": wall, "endpoints": report},
+                      f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["endpoints"]
+        problems = compare(report, baseline, args.max_regression)
+        if problems:
+            print("\nРегрессии относительно", args.baseline)
+            for p in problems:
+                print("  -", p)
+            sys.exit(1)
+        print("\nРегрессий нет")
+
+
+if __name__ == "__main__":
+    main()
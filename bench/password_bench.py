@@ -0,0 +1,108 @@
+"""
+Пропускная способность проверки паролей (то есть входов) для разных параметров стоимости KDF.
+
+Для каждой настройки меряется:
+  - время одной проверки и проверок в секунду на одно ядро (один поток);
+  - проверок в секунду через пул PasswordHasher из --workers потоков — так видно,
+    масштабируется ли KDF по ядрам (scrypt и argon2 отпускают GIL).
+Кеш успешных проверок отключён: меряем сам KDF.
+
+    python -m bench.password_bench --scrypt-n 4096,16384,65536 --duration 3
+    python -m bench.password_bench --argon2 "1:19456,2:19456,3:65536" --json password_bench.json
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+from passwords import PasswordHasher
+
+PASSWORD = "correct horse battery staple"
+
+
+def measure_single(hasher, stored, duration):
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        hasher.verify_sync(PASSWORD, stored)
+        count += 1
+    elapsed = time.perf_counter() - started
+    return count, elapsed
+
+
+def measure_pool(hasher, stored, duration, clients):
+    # clients потоков-«запросов» одновременно проверяют пароль через пул хешера
+    count = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            hasher.check(PASSWORD, stored)
+            with lock:
+                count[0] += 1
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return count[0], time.perf_counter() - started
+
+
+def settings_from_args(args):
+    settings = []
+    for n in filter(None, args.scrypt_n.split(",")):
+        settings.append((f"scrypt n={n} r={args.scrypt_r} p=1",
+                         dict(scheme="scrypt", scrypt_n=int(n), scrypt_r=args.scrypt_r)))
+    for item in filter(None, args.argon2.split(",")):
+        time_cost, memory_cost = item.split(":")
+        settings.append((f"argon2id t={time_cost} m={memory_cost}KiB",
+                         dict(scheme="argon2", argon2_time_cost=int(time_cost), argon2_memory_cost=int(memory_cost))))
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scrypt-n", default="4096,16384,32768", help="значения N через запятую")
+    parser.add_argument("--scrypt-r", type=int, default=8)
+    parser.add_argument("--argon2", default="", help="time_cost:memory_cost(КиБ) через запятую, нужен argon2-cffi")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="потоков в пуле хешера")
+    parser.add_argument("--duration", type=float, default=3.0, help="сек на каждый замер")
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    args = parser.parse_args()
+
+    report = []
+    print(f"Ядер: {os.cpu_count()}, потоков пула: {args.workers}\n")
+    print(f"{'настройка':<34}{'мс/проверка':>13}{'входов/с на ядро':>18}{'входов/с пул':>14}{'ускорение':>11}")
+    for name, params in settings_from_args(args):
+        hasher = PasswordHasher(workers=args.workers, max_pending=args.workers * 4,
+                                wait_timeout=60.0, verify_cache_ttl=0, **params)
+        if hasher.scheme != params["scheme"]:
+            continue   # argon2-cffi не установлен
+        stored = hasher.hash_sync(PASSWORD)
+        single, single_time = measure_single(hasher, stored, args.duration)
+        pooled, pooled_time = measure_pool(hasher, stored, args.duration, args.workers * 2)
+        per_core = single / single_time
+        pool_rate = pooled / pooled_time
+        row = {
+            "setting": name,
+            "ms_per_verify": round(single_time / single * 1000, 2),
+            "logins_per_sec_per_core": round(per_core, 1),
+            "logins_per_sec_pool": round(pool_rate, 1),
+            "speedup": round(pool_rate / per_core, 2) if per_core else 0.0,
+        }
+        report.append(row)
+        print(f"{name:<34}{row['ms_per_verify']:>13}{row['logins_per_sec_per_core']:>18}"
+              f"{row['logins_per_sec_pool']:>14}{row['speedup']:>11}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"cpu_count": os.cpu_count(), "workers": args.workers, "settings": report},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
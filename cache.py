@@ -0,0 +1,254 @@
+import inspect
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+try:
+    import redis
+except ImportError:  # общий кеш необязателен
+    redis = None
+
+
+MISSING = object()
+
+
+class MemoryCache:
+    """In-process LRU-кеш с TTL на запись. Счётчики версий тегов хранятся отдельно и не вытесняются."""
+
+    def __init__(self, maxsize=10000, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get_versions(self, names):
+        with self._lock:
+            return [self._versions.get(name, 0) for name in names]
+
+    def bump_version(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Общий кеш для нескольких процессов. client — redis.Redis или любой объект
+    с методами get/set/delete/mget/incr (например, заглушка в тестах).
+    """
+
+    def __init__(self, url=None, ttl=60.0, client=None, prefix='agile:'):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("Для CACHE_BACKEND=redis нужен пакет redis")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        # вытеснение в Redis считает сам сервер (evicted_keys в INFO)
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return MISSING if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def get_versions(self, names):
+        if not names:
+            return []
+        raw = self.client.mget([self.prefix + 'v:' + name for name in names])
+        return [int(v) if v is not None else 0 for v in raw]
+
+    def bump_version(self, name):
+        self.client.incr(self.prefix + 'v:' + name)
+
+    def clear(self):
+        # Общий кеш целиком не чистим — устаревшие записи отсекаются версиями тегов и TTL
+        pass
+
+
+class QueryCache:
+    """
+    Кеш результатов запросов с инвалидацией по тегам.
+    Ключ записи включает текущие версии её тегов (например, user:5, course:2);
+    invalidate(tag) увеличивает версию — старые записи больше не находятся и уходят по LRU/TTL.
+    """
+
+    def __init__(self, backend, enabled=True):
+        self.backend = backend
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def _key(self, name, params, tags):
+        versions = self.backend.get_versions(tags)
+        tag_part = ','.join(f"{t}={v}" for t, v in zip(tags, versions))
+        return f"{name}:{params!r}:{tag_part}"
+
+    def _lookup(self, name, params, tags):
+        """(ключ, значение или MISSING); ключ None — кеш недоступен, идём в БД без записи"""
+        try:
+            key = self._key(name, params, tags)
+            value = self.backend.get(key)
+        except Exception as e:
+            # Кеш не должен ронять запрос — идём в БД
+            print(f"Cache error: {e}")
+            with self._lock:
+                self.errors += 1
+            return None, MISSING
+        with self._lock:
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return key, value
+
+    def _store(self, key, value, ttl):
+        if key is None:
+            return
+        try:
+            self.backend.set(key, value, ttl)
+        except Exception as e:
+            print(f"Cache error: {e}")
+            with self._lock:
+                self.errors += 1
+
+    def get_or_load(self, name, params, tags, loader, ttl=None):
+        if not self.enabled:
+            return loader()
+        key, value = self._lookup(name, params, tags)
+        if value is MISSING:
+            value = loader()
+            self._store(key, value, ttl)
+        return value
+
+    async def get_or_load_async(self, name, params, tags, loader, ttl=None):
+        """То же для асинхронного loader (AsyncDatabaseManager)"""
+        if not self.enabled:
+            return await loader()
+        key, value = self._lookup(name, params, tags)
+        if value is MISSING:
+            value = await loader()
+            self._store(key, value, ttl)
+        return value
+
+    def invalidate(self, *tags):
+        if not self.enabled:
+            return
+        for tag in tags:
+            try:
+                self.backend.bump_version(tag)
+            except Exception as e:
+                print(f"Cache error: {e}")
+                with self._lock:
+                    self.errors += 1
+        with self._lock:
+            self.invalidations += len(tags)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': type(self.backend).__name__,
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.backend.evictions,
+                'expirations': self.backend.expirations,
+                'invalidations': self.invalidations,
+                'errors': self.errors,
+            }
+
+
+def cached(name, tags, ttl=None):
+    """
+    Декоратор метода DatabaseManager (или async-метода AsyncDatabaseManager):
+    результат кешируется в self.cache. Синхронный менеджер должен уметь has_uncommitted(tags).
+    tags — функция от аргументов метода (по именам), возвращающая список тегов.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def cache_args(self, args, kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(list(bound.arguments.items())[1:])   # без self
+            return tuple(arguments.values()), tags(**arguments)
+
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(self, *args, **kwargs):
+                params, tag_list = cache_args(self, args, kwargs)
+                return await self.cache.get_or_load_async(
+                    name, params, tag_list, lambda: fn(self, *args, **kwargs), ttl,
+                )
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            params, tag_list = cache_args(self, args, kwargs)
+            if self.has_uncommitted(tag_list):
+                # Транзакция запроса уже писала по этим тегам: читаем мимо кеша,
+                # иначе ROLLBACK оставил бы в кеше незафиксированные строки
+                return fn(self, *args, **kwargs)
+            return self.cache.get_or_load(
+                name, params, tag_list, lambda: fn(self, *args, **kwargs), ttl,
+            )
+        return wrapper
+    return decorator
+
+
+def make_cache(config):
+    """Кеш по настройкам Config.CACHE_*: memory (по умолчанию), redis или none."""
+    backend_name = (config.CACHE_BACKEND or 'memory').lower()
+    if backend_name == 'redis':
+        backend = RedisCache(config.CACHE_URL, ttl=config.CACHE_TTL)
+    else:
+        backend = MemoryCache(maxsize=config.CACHE_MAXSIZE, ttl=config.CACHE_TTL)
+    return QueryCache(backend, enabled=backend_name != 'none')
@@ -6,7 +6,98 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY')
     DATABASE_URL = os.getenv('DATABASE_URL')
-    
+
+    # Пул соединений с БД
+    DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 20))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5.0))              # ожидание свободного соединения, сек
+    DB_POOL_HEALTHCHECK_AFTER = float(os.getenv('DB_POOL_HEALTHCHECK_AFTER', 30.0))  # проверять SELECT 1 после простоя, сек
+    DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 1800.0))  # пересоздавать соединение после, сек
+
+    # Пакетная запись ответов тренажёра в exercise_attempts
+    ATTEMPTS_BATCH_MAX = int(os.getenv('ATTEMPTS_BATCH_MAX', 500))
+
+    # Отложенная запись результатов (result_queue.py)
+    RESULT_SPOOL_PATH = os.getenv('RESULT_SPOOL_PATH', 'results_spool.jsonl')
+    RESULT_DEAD_LETTER_PATH = os.getenv('RESULT_DEAD_LETTER_PATH', 'results_dead.jsonl')  # отвергнутые БД результаты
+    RESULT_QUEUE_BATCH_SIZE = int(os.getenv('RESULT_QUEUE_BATCH_SIZE', 100))
+    RESULT_QUEUE_FLUSH_INTERVAL = float(os.getenv('RESULT_QUEUE_FLUSH_INTERVAL', 1.0))
+    RESULT_QUEUE_MAX_RETRIES = int(os.getenv('RESULT_QUEUE_MAX_RETRIES', 3))
+    RESULT_QUEUE_MAX_SIZE = int(os.getenv('RESULT_QUEUE_MAX_SIZE', 10000))
+    RESULT_KEY_TTL_DAYS = int(os.getenv('RESULT_KEY_TTL_DAYS', 30))   # хранить ключи идемпотентности; 0 — вечно
+    RESULT_MAX_ANSWERS = int(os.getenv('RESULT_MAX_ANSWERS', 500))   # ответов за раунд в /result, не больше
+
+    # Генерация задач (tasks.py)
+    TASK_BATCH_MAX = int(os.getenv('TASK_BATCH_MAX', 100))
+    EXERCISE_TYPES_TTL = float(os.getenv('EXERCISE_TYPES_TTL', 300.0))  # кеш exercise_types, сек
+
+    # Адаптивный подбор задач по истории ответов (scheduler.py)
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1') == '1'
+    SCHEDULER_MAX_STATES = int(os.getenv('SCHEDULER_MAX_STATES', 2000))   # (ученик, тип) в памяти процесса
+    SCHEDULER_MAX_MEMORY_MB = int(os.getenv('SCHEDULER_MAX_MEMORY_MB', 64))  # на процесс; ~250 полных историй
+    SCHEDULER_HISTORY = int(os.getenv('SCHEDULER_HISTORY', 2000))         # ответов читается при загрузке
+    SCHEDULER_TARGET_TIME = float(os.getenv('SCHEDULER_TARGET_TIME', 3.0))  # «беглый» ответ, сек
+
+    # Рейтинги лучших результатов (leaderboard.py)
+    LEADERBOARD_REFRESH_INTERVAL = float(os.getenv('LEADERBOARD_REFRESH_INTERVAL', 600.0))  # перечитать из БД, сек
+    LEADERBOARD_MAX_COURSES = int(os.getenv('LEADERBOARD_MAX_COURSES', 500))   # рейтингов курсов в памяти
+    LEADERBOARD_TOP_LIMIT = int(os.getenv('LEADERBOARD_TOP_LIMIT', 10))
+    LEADERBOARD_TOP_MAX = int(os.getenv('LEADERBOARD_TOP_MAX', 100))
+
+    # Кеш чтений DatabaseManager (cache.py): memory | redis | none
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+    CACHE_URL = os.getenv('CACHE_URL', 'redis://localhost:6379/0')
+    CACHE_TTL = float(os.getenv('CACHE_TTL', 60.0))
+    CACHE_MAXSIZE = int(os.getenv('CACHE_MAXSIZE', 10000))
+
+    # Профилирование SQL (instrumentation.py)
+    # Заголовки X-DB-Queries / X-DB-Time-ms / Server-Timing в ответах (нужны бенчмаркам из bench/)
+    DB_STATS_HEADERS = os.getenv('DB_STATS_HEADERS', '0') == '1'
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200.0))
+    SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', '1') == '1'   # план EXPLAIN (без ANALYZE) для медленных SELECT
+    SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', '')                    # файл; пусто — общий лог
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'          # /metrics для Prometheus
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')                      # если задан — Authorization: Bearer <token>
+
+    # Страницы списков учеников курса (keyset-пагинация)
+    COURSE_PAGE_SIZE = int(os.getenv('COURSE_PAGE_SIZE', 50))
+    COURSE_PAGE_MAX = int(os.getenv('COURSE_PAGE_MAX', 500))
+
+    # Поиск учеников курса (подсказки на странице учителя): сколько совпадений отдавать
+    COURSE_SEARCH_LIMIT = int(os.getenv('COURSE_SEARCH_LIMIT', 10))
+    COURSE_SEARCH_MAX = int(os.getenv('COURSE_SEARCH_MAX', 50))
+
+    # Массовые операции со списком курса: максимум учеников в одном запросе
+    ROSTER_BULK_MAX = int(os.getenv('ROSTER_BULK_MAX', 1000))
+
+    # Серверные сессии в user_sessions (sessions.py): database | cookie (подписанная cookie Flask)
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'database')
+    SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 30.0))           # кеш сессий в процессе, сек
+    SESSION_CACHE_MAXSIZE = int(os.getenv('SESSION_CACHE_MAXSIZE', 10000))
+    SESSION_TOUCH_INTERVAL = float(os.getenv('SESSION_TOUCH_INTERVAL', 300.0))  # продлевать срок не чаще, сек
+    SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 5.0))    # запись продлений пачкой, сек
+    SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 300.0))  # удаление истёкших, сек
+    SESSION_SWEEP_BATCH = int(os.getenv('SESSION_SWEEP_BATCH', 1000))
+
+    # Хеши паролей (passwords.py): scrypt | argon2 (нужен argon2-cffi); стоимость — см. bench/password_bench.py
+    PASSWORD_SCHEME = os.getenv('PASSWORD_SCHEME', 'scrypt')
+    PASSWORD_SCRYPT_N = int(os.getenv('PASSWORD_SCRYPT_N', 2 ** 14))
+    PASSWORD_SCRYPT_R = int(os.getenv('PASSWORD_SCRYPT_R', 8))
+    PASSWORD_SCRYPT_P = int(os.getenv('PASSWORD_SCRYPT_P', 1))
+    PASSWORD_ARGON2_TIME_COST = int(os.getenv('PASSWORD_ARGON2_TIME_COST', 2))
+    PASSWORD_ARGON2_MEMORY_COST = int(os.getenv('PASSWORD_ARGON2_MEMORY_COST', 19456))  # КиБ
+    PASSWORD_ARGON2_PARALLELISM = int(os.getenv('PASSWORD_ARGON2_PARALLELISM', 1))
+    PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', 0)) or None        # потоков KDF; 0 — по числу ядер
+    PASSWORD_MAX_PENDING = int(os.getenv('PASSWORD_MAX_PENDING', 64))       # очередь сверх занятых потоков
+    PASSWORD_WAIT_TIMEOUT = float(os.getenv('PASSWORD_WAIT_TIMEOUT', 10.0))
+    PASSWORD_VERIFY_CACHE_TTL = float(os.getenv('PASSWORD_VERIFY_CACHE_TTL', 300.0))  # 0 — не кешировать
+
+    # Месячные секции exercise_results/exercise_attempts (partitions.py)
+    PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 3))            # секций на будущее
+    PARTITION_CHECK_INTERVAL = float(os.getenv('PARTITION_CHECK_INTERVAL', 21600.0))  # досоздание, сек
+    PARTITION_RETENTION_MONTHS = int(os.getenv('PARTITION_RETENTION_MONTHS', 0))    # 0 — не архивировать
+    PARTITION_ARCHIVE_DIR = os.getenv('PARTITION_ARCHIVE_DIR', 'archive')
+
     @staticmethod
     def init_app(app):
-        pass
\ No newline at end of file
+        pass
@@ -1,42 +1,171 @@
 import psycopg2
 import os
+from psycopg2.extras import execute_values, Json
+import threading
 from contextlib import contextmanager
 from config import Config
+from pool import ConnectionPool
+from cache import cached, make_cache
+from instrumentation import CALLER_FILES, InstrumentedCursor, profiler, configure_slow_query_log
+from queries import (
+    ROSTER_SORT_KEYS, STATS_SORT_KEYS,
+    CREATE_USER_SQL, USER_BY_EMAIL_SQL, UPDATE_PASSWORD_HASH_SQL, ACCEPT_INVITE_SQL, ISSUE_INVITE_SQL,
+    EXERCISE_TYPES_SQL,
+    SAVE_RESULT_SQL, SAVE_RESULTS_BATCH_SQL, results_batch_params, attempts_insert_sql,
+    BEST_SCORE_SQL, USER_STATS_SQL, PROFILE_SQL, LAST_RESULTS_SQL, user_stats_row, profile_row,
+    course_students_sql, course_stats_sql, course_search_sql, keyset_page, strip_service_columns,
+    REMOVE_STUDENT_SQL, ASSIGN_STUDENTS_SQL, REMOVE_STUDENTS_SQL, IMPORT_STUDENTS_SQL, import_students_params,
+)
+
+
+# Все запросы проходят через профилирующий курсор (instrumentation.py)
+CALLER_FILES.add(__file__)
+profiler.slow_query_ms = Config.SLOW_QUERY_MS
+profiler.explain_slow = Config.SLOW_QUERY_EXPLAIN
+configure_slow_query_log(Config.SLOW_QUERY_LOG)
+
+
+def _connect(dsn):
+    return psycopg2.connect(dsn, cursor_factory=InstrumentedCursor)
 
 
 class DatabaseManager:
+    def __init__(self):
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+        self.cache = make_cache(Config)
+
+    @property
+    def pool(self):
+        """Пул соединений создаётся лениво — при первом запросе, а не при импорте"""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(
+                        Config.DATABASE_URL,
+                        min_size=Config.DB_POOL_MIN_SIZE,
+                        max_size=Config.DB_POOL_MAX_SIZE,
+                        timeout=Config.DB_POOL_TIMEOUT,
+                        healthcheck_after=Config.DB_POOL_HEALTHCHECK_AFTER,
+                        max_lifetime=Config.DB_POOL_MAX_LIFETIME,
+                        connect=_connect,
+                    )
+        return self._pool
+
+    def pool_stats(self):
+        """Метрики пула соединений (пустой словарь, если пул ещё не создан)"""
+        return self._pool.stats() if self._pool is not None else {}
+
+    # ---------- Unit of work в рамках HTTP-запроса ----------
+    def begin_request(self):
+        """
+        Открыть unit of work: все вызовы DatabaseManager в этом потоке до end_request
+        используют одно соединение и одну транзакцию. Соединение берётся лениво —
+        запросы, которые не ходят в БД (статика, редиректы), пул не трогают.
+        """
+        self._local.scope = {'conn': None, 'failed': False, 'invalidate': set()}
+
+    def end_request(self, commit=True):
+        """Закрыть unit of work: один COMMIT (или ROLLBACK) и возврат соединения в пул."""
+        scope = getattr(self._local, 'scope', None)
+        self._local.scope = None
+        if not scope or scope['conn'] is None:
+            return
+        conn = scope['conn']
+        if commit and not scope['failed']:
+            broken = False
+            try:
+                conn.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                self.pool.putconn(conn, discard=broken)
+            # Повторная инвалидация после COMMIT: то, что успели закешировать
+            # между записью и фиксацией транзакции, тоже становится недействительным
+            self.cache.invalidate(*scope['invalidate'])
+        else:
+            # putconn сам откатит незавершённую транзакцию или выбросит сломанное соединение
+            self.pool.putconn(conn)
+
+    def release_connection(self):
+        """
+        Досрочно закрыть транзакцию unit of work (COMMIT) и вернуть соединение в пул;
+        следующий вызов в этом запросе возьмёт соединение заново. Нужно перед долгой работой
+        без БД (проверка пароля), чтобы соединение не простаивало idle in transaction.
+        """
+        if getattr(self._local, 'scope', None) is None:
+            return
+        self.end_request()
+        self.begin_request()
+
+    def _scoped_connection(self):
+        scope = getattr(self._local, 'scope', None)
+        if scope is None:
+            return None
+        if scope['conn'] is None:
+            scope['conn'] = self.pool.getconn()
+        return scope
+
+    def _invalidate(self, *tags):
+        """Сбросить закешированные чтения по тегам (сразу и ещё раз после COMMIT запроса)"""
+        self.cache.invalidate(*tags)
+        scope = getattr(self._local, 'scope', None)
+        if scope is not None:
+            scope['invalidate'].update(tags)
+
+    def has_uncommitted(self, tags):
+        """Писал ли открытый unit of work по этим тегам (его данные ещё могут откатиться)"""
+        scope = getattr(self._local, 'scope', None)
+        return bool(scope and not scope['invalidate'].isdisjoint(tags))
+
+    def cache_stats(self):
+        """Счётчики кеша запросов"""
+        return self.cache.stats()
+
     @contextmanager
     def get_connection(self):
-        """Контекстный менеджер для подключения к БД"""
-        conn = psycopg2.connect(Config.DATABASE_URL)
-        try:
-            yield conn
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            print(f"Database error: {e}")
-            raise e
-        finally:
-            conn.close()
+        """
+        Контекстный менеджер для подключения к БД.
+        Внутри unit of work отдаёт общее соединение запроса без COMMIT,
+        иначе — берёт соединение из пула и коммитит сразу.
+        """
+        scope = self._scoped_connection()
+        if scope is not None:
+            conn = scope['conn']
+            try:
+                yield conn
+            except Exception as e:
+                # Ошибка откатывает всю транзакцию запроса; следующие вызовы начнут новую,
+                # но в конце запроса её уже не закоммитим
+                conn.rollback()
+                scope['failed'] = True
+                print(f"Database error: {e}")
+                raise e
+            return
+
+        with self.pool.connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"Database error: {e}")
+                raise e
 
     def create_user(self, email, password_hash, role='student', first_name='', last_name=''):
         """Создание нового пользователя"""
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO users (email, password_hash, role, first_name, last_name)
-                    VALUES (%s, %s, %s, %s, %s) RETURNING id
-                """, (email, password_hash, role, first_name, last_name))
+                cur.execute(CREATE_USER_SQL, (email, password_hash, role, first_name, last_name))
                 return cur.fetchone()[0]
 
     def get_user_by_email(self, email):
         """Получение пользователя по email"""
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, email, password_hash, role, first_name, last_name 
-                    FROM users WHERE email = %s
-                """, (email,))
+                cur.execute(USER_BY_EMAIL_SQL, (email,))
                 result = cur.fetchone()
                 if result:
                     return {
@@ -45,10 +174,102 @@ class DatabaseManager:
                         'password_hash': result[2],
                         'role': result[3],
                         'first_name': result[4],
-                        'last_name': result[5]
+                        'last_name': result[5],
+                        'invite_hash': result[6],
                     }
                 return None
 
+    def update_password_hash(self, user_id, password_hash, current):
+        """
+        Заменить хеш пароля, только если он всё ещё равен current (пересчёт устаревшего формата
+        при входе). Возвращает False, если хеш уже успели поменять.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(UPDATE_PASSWORD_HASH_SQL, (password_hash, user_id, current))
+                return cur.rowcount == 1
+
+    def accept_invite(self, user_id, password_hash, invite_hash):
+        """
+        Первый пароль ученика из импорта списка класса — по коду от учителя (invite_hash).
+        Код одноразовый; False, если пароль уже задан или код сменили.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(ACCEPT_INVITE_SQL, (password_hash, user_id, invite_hash))
+                return cur.rowcount == 1
+
+    def issue_invite(self, course_id, student_id, invite_hash):
+        """Новый код первого входа ученику курса без пароля; False — нет такого ученика или пароль уже задан"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(ISSUE_INVITE_SQL,
+                            {'course_id': course_id, 'student_id': student_id, 'invite_hash': invite_hash})
+                return cur.rowcount == 1
+
+    # ---------- серверные сессии (sessions.py) ----------
+    def load_session(self, token_hash):
+        """(data, expires_at) сессии по хешу токена или None"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT data, expires_at FROM user_sessions WHERE session_token = %s
+                """, (token_hash,))
+                return cur.fetchone()
+
+    def save_session(self, token_hash, user_id, data, expires_at):
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO user_sessions (user_id, session_token, expires_at, data)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (session_token) DO UPDATE
+                    SET user_id = EXCLUDED.user_id,
+                        expires_at = EXCLUDED.expires_at,
+                        data = EXCLUDED.data
+                """, (user_id, token_hash, expires_at, Json(data)))
+
+    def delete_session(self, token_hash):
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM user_sessions WHERE session_token = %s", (token_hash,))
+
+    def touch_sessions(self, items):
+        """Продлить сроки сессий одним UPDATE; items — [(token_hash, expires_at)]"""
+        if not items:
+            return 0
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    UPDATE user_sessions AS s
+                    SET expires_at = v.expires_at
+                    FROM (VALUES %s) AS v(session_token, expires_at)
+                    WHERE s.session_token = v.session_token AND s.expires_at < v.expires_at
+                """, items, template="(%s, %s::timestamp)", page_size=len(items))
+                return cur.rowcount
+
+    def delete_expired_sessions(self, before, limit=1000):
+        """Удалить не больше limit истёкших сессий (по idx_sessions_expires); возвращает число удалённых"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM user_sessions
+                    WHERE id IN (
+                        SELECT id FROM user_sessions
+                        WHERE expires_at < %s
+                        ORDER BY expires_at
+                        LIMIT %s
+                    )
+                """, (before, limit))
+                return cur.rowcount
+
+    def get_exercise_types(self):
+        """Параметры всех типов упражнений: {name: parameters}"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(EXERCISE_TYPES_SQL)
+                return {name: parameters or {} for name, parameters in cur.fetchall()}
+
     def save_exercise_result(self, user_id: int, payload: dict):
         """
         payload = {
@@ -58,14 +279,11 @@ class DatabaseManager:
             avg_time: float,   # -> average_time
             exercise_type: str
         }
+        Результат и накопительная статистика (user_exercise_stats, user_daily_stats) пишутся одним запросом.
         """
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO exercise_results
-                        (user_id, exercise_type, correct_count, wrong_count, total_points, average_time, completed_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, NOW())
-                """, (
+                cur.execute(SAVE_RESULT_SQL, (
                     user_id,
                     payload.get("exercise_type", "multiplication_basic"),
                     int(payload.get("correct", 0)),
@@ -73,183 +291,342 @@ class DatabaseManager:
                     int(payload.get("points", 0)),         # <-- total_points
                     float(payload.get("avg_time", 0.0)),   # <-- average_time
                 ))
+                _, course_ids = cur.fetchone()
+        self._invalidate(f"user:{user_id}", *(f"course:{cid}" for cid in course_ids))
 
-    def get_user_best_score(self, user_id, exercise_type='multiplication_basic'):
-        """Получение лучшего результата пользователя (максимум очков)"""
+    def save_exercise_results_batch(self, items: list[dict]):
+        """
+        Пакетное идемпотентное сохранение результатов из очереди отложенной записи.
+        items = [{key, user_id, completed_at, payload: {correct, wrong, points, avg_time, exercise_type}}, ...]
+        Результаты с уже встречавшимся ключом пропускаются; возвращает число реально вставленных.
+        """
+        if not items:
+            return 0
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT COALESCE(MAX(total_points), 0)
-                    FROM exercise_results 
-                    WHERE user_id = %s AND exercise_type = %s
-                """, (user_id, exercise_type))
-                result = cur.fetchone()
-                return result[0] or 0
+                cur.execute(SAVE_RESULTS_BATCH_SQL, results_batch_params(items))
+                inserted, course_ids = cur.fetchone()
+        self._invalidate(*{f"user:{item['user_id']}" for item in items},
+                         *(f"course:{cid}" for cid in course_ids))
+        return inserted
 
-    def get_user_stats(self, user_id, exercise_type='multiplication_basic'):
+    def save_exercise_attempts(self, user_id: int, attempts: list[dict]):
         """
-        Получение общей статистики (и последние 10 попыток — будет удобно, если понадобятся).
+        Пакетная запись ответов одним многострочным INSERT.
+        attempts = [{exercise_type, task_data, user_answer, is_correct, time_spent}, ...]
         """
+        if not attempts:
+            return 0
+        rows = [(
+            user_id,
+            a.get("exercise_type", "multiplication_basic"),
+            Json(a["task_data"]),
+            a.get("user_answer"),
+            a.get("is_correct"),
+            a.get("time_spent"),
+        ) for a in attempts]
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT 
-                        COUNT(*) AS total_sessions,
-                        COALESCE(SUM(correct_count), 0) AS total_correct,
-                        COALESCE(SUM(wrong_count), 0) AS total_wrong,
-                        COALESCE(MAX(total_points), 0) AS overall_best
-                    FROM exercise_results 
-                    WHERE user_id = %s AND exercise_type = %s
-                """, (user_id, exercise_type))
-                row = cur.fetchone()
-                total_sessions = row[0] or 0
-                total_correct = row[1] or 0
-                total_wrong = row[2] or 0
-                overall_best = row[3] or 0
+                execute_values(cur, attempts_insert_sql(), rows, page_size=len(rows))
+                return len(rows)
 
-                cur.execute("""
-                    SELECT 
-                        completed_at,
-                        correct_count,
-                        wrong_count,
-                        total_points,
-                        average_time
-                    FROM exercise_results
-                    WHERE user_id = %s AND exercise_type = %s
-                    ORDER BY completed_at DESC
-                    LIMIT 10
-                """, (user_id, exercise_type))
-                rows = cur.fetchall()
-
-        rows = list(reversed(rows))
-        last_attempts = []
-        for completed_at, correct, wrong, points, avg_time in rows:
-            total = (correct or 0) + (wrong or 0)
-            percent = (correct / total * 100.0) if total else 0.0
-            last_attempts.append({
-                'label': completed_at.strftime('%d.%m'),
-                'points': int(points or 0),
-                'correct': int(correct or 0),
-                'wrong': int(wrong or 0),
-                'percent': round(percent, 1),
-                'avg_time': float(avg_time or 0.0),
-            })
-
-        return {
-            'total_sessions': total_sessions,
-            'total_correct': total_correct,
-            'total_wrong': total_wrong,
-            'overall_best': overall_best,
-            'last_attempts': last_attempts,
-        }
+    def get_best_scores(self):
+        """Лучшие результаты всех учеников по всем типам: [(exercise_type, user_id, best_points)] — для leaderboard.py."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT exercise_type, user_id, best_points FROM user_exercise_stats")
+                return cur.fetchall()
 
-    def get_course_students(self, course_id: int):
-        """Возвращает список студентов, прикрепленных к курсу."""
+    def get_course_best_scores(self, course_id: int):
+        """
+        Ученики курса и их лучшие результаты: [(student_id, exercise_type, best_points)].
+        Ученик без результатов попадает одной строкой с exercise_type = NULL.
+        """
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    SELECT 
-                        u.id,
-                        u.email,
-                        COALESCE(u.first_name, '') AS first_name,
-                        COALESCE(u.last_name, '')  AS last_name,
-                        ac.assigned_at
+                    SELECT ac.student_id, s.exercise_type, s.best_points
                     FROM assigned_courses ac
-                    JOIN users u ON u.id = ac.student_id
+                    LEFT JOIN user_exercise_stats s ON s.user_id = ac.student_id
                     WHERE ac.course_id = %s
-                    ORDER BY u.last_name NULLS LAST, u.first_name NULLS LAST, u.email;
                 """, (course_id,))
-                cols = [desc[0] for desc in cur.description]
-                return [dict(zip(cols, row)) for row in cur.fetchall()]
+                return cur.fetchall()
 
-    def remove_student_from_course(self, student_id, course_id):
-        """Удалить ученика с курса (запись в assigned_courses)"""
+    def get_users_brief(self, user_ids: list[int]):
+        """Имена и e-mail пользователей по id: {id: {first_name, last_name, email}}."""
+        if not user_ids:
+            return {}
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    DELETE FROM assigned_courses
-                    WHERE student_id = %s AND course_id = %s
-                """, (student_id, course_id))
+                    SELECT id, first_name, last_name, email
+                    FROM users
+                    WHERE id = ANY(%s)
+                """, (list(user_ids),))
+                return {r[0]: {'first_name': r[1], 'last_name': r[2], 'email': r[3]} for r in cur.fetchall()}
 
-    def get_course_students_stats(self, course_id: int, query: str | None = None,
-                                  date_from: str | None = None, date_to: str | None = None,
-                                  sort: str | None = None):
+    def get_recent_attempts(self, user_id: int, exercise_type: str, limit: int = 2000):
+        """Последние limit ответов ученика по типу упражнения, от старых к новым (история для scheduler.py)."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT task_data, is_correct, time_spent
+                    FROM (
+                        SELECT task_data, is_correct, time_spent, created_at
+                        FROM exercise_attempts
+                        WHERE user_id = %s AND exercise_type = %s
+                        ORDER BY created_at DESC
+                        LIMIT %s
+                    ) recent
+                    ORDER BY created_at
+                """, (user_id, exercise_type, limit))
+                cols = [d[0] for d in cur.description]
+                return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+    def rebuild_user_stats(self, user_id: int | None = None):
         """
-        Агрегированная статистика учеников курса с поиском/датами/сортировкой.
-        Даты фильтруем по exercise_results.completed_at.
+        Пересчитать user_exercise_stats из истории exercise_results (для всех или одного пользователя).
+        Таблица блокируется на время пересчёта, параллельные сохранения результатов подождут.
         """
+        where = "WHERE user_id = %s" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else ()
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                params = [course_id]
-                date_sql = []
-                if date_from:
-                    date_sql.append("er.completed_at >= %s")  # <-- fixed
-                    params.append(date_from)
-                if date_to:
-                    date_sql.append("er.completed_at < %s")   # <-- fixed
-                    params.append(date_to)
-
-                search_sql = ""
-                if query:
-                    params.extend([f"%{query}%", f"%{query}%"])
-                    search_sql = "AND ((COALESCE(u.first_name,'') || ' ' || COALESCE(u.last_name,'')) ILIKE %s OR u.email ILIKE %s)"
-
-                sort_map = {
-                    "percent_desc": "percent_correct DESC NULLS LAST",
-                    "percent_asc":  "percent_correct ASC NULLS LAST",
-                    "avg_time_desc":"avg_time DESC NULLS LAST",
-                    "avg_time_asc": "avg_time ASC NULLS LAST",
-                    "attempts_desc":"attempts DESC, percent_correct DESC",
-                    "attempts_asc": "attempts ASC, percent_correct DESC",
-                }
-                order_by = sort_map.get(sort or "percent_desc", "percent_correct DESC NULLS LAST")
+                cur.execute("LOCK TABLE user_exercise_stats IN EXCLUSIVE MODE")
+                cur.execute(f"DELETE FROM user_exercise_stats {where}", params)
+                cur.execute(f"""
+                    INSERT INTO user_exercise_stats
+                        (user_id, exercise_type, sessions_count, correct_total, wrong_total,
+                         best_points, points_total, time_total, timed_sessions, last_completed_at)
+                    SELECT
+                        user_id,
+                        exercise_type,
+                        COUNT(*),
+                        COALESCE(SUM(correct_count), 0),
+                        COALESCE(SUM(wrong_count), 0),
+                        COALESCE(MAX(total_points), 0),
+                        COALESCE(SUM(total_points), 0),
+                        COALESCE(SUM(average_time), 0),
+                        COUNT(NULLIF(average_time, 0)),
+                        MAX(completed_at)
+                    FROM exercise_results
+                    {where}
+                    GROUP BY user_id, exercise_type
+                """, params)
+                rows = cur.rowcount
+        self._invalidate(f"user:{user_id}" if user_id is not None else "stats")
+        return rows
 
+    def rebuild_daily_stats(self, user_id: int | None = None):
+        """Пересчитать user_daily_stats из истории exercise_results (для всех или одного пользователя)."""
+        where = "WHERE user_id = %s" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else ()
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("LOCK TABLE user_daily_stats IN EXCLUSIVE MODE")
+                cur.execute(f"DELETE FROM user_daily_stats {where}", params)
                 cur.execute(f"""
+                    INSERT INTO user_daily_stats
+                        (user_id, exercise_type, day, attempts, correct_total, wrong_total, time_total, timed_sessions)
                     SELECT
-                        u.id,
-                        u.email,
-                        COALESCE(u.first_name,'') AS first_name,
-                        COALESCE(u.last_name,'')  AS last_name,
-                        COUNT(er.id)                              AS attempts,
-                        COALESCE(SUM(er.correct_count),0)         AS total_correct,
-                        COALESCE(SUM(er.wrong_count),0)           AS total_wrong,
-                        CASE
-                          WHEN COALESCE(SUM(er.correct_count)+SUM(er.wrong_count),0) > 0
-                          THEN ROUND( (SUM(er.correct_count)::decimal * 100.0) /
-                                     (SUM(er.correct_count)+SUM(er.wrong_count)), 2)
-                          ELSE 0
-                        END AS percent_correct,
-                        ROUND(AVG(NULLIF(er.average_time,0))::numeric, 2) AS avg_time
-                    FROM assigned_courses ac
-                    JOIN users u ON u.id = ac.student_id
-                    LEFT JOIN exercise_results er
-                      ON er.user_id = u.id
-                     {('AND ' + ' AND '.join(date_sql)) if date_sql else ''}
-                    WHERE ac.course_id = %s
-                    {search_sql}
-                    GROUP BY u.id, u.email, u.first_name, u.last_name
-                    ORDER BY {order_by};
+                        user_id,
+                        exercise_type,
+                        completed_at::date,
+                        COUNT(*),
+                        COALESCE(SUM(correct_count), 0),
+                        COALESCE(SUM(wrong_count), 0),
+                        COALESCE(SUM(average_time), 0),
+                        COUNT(NULLIF(average_time, 0))
+                    FROM exercise_results
+                    {where}
+                    GROUP BY user_id, exercise_type, completed_at::date
                 """, params)
+                rows = cur.rowcount
+        self._invalidate("stats")
+        return rows
 
+    @cached("best_score", tags=lambda user_id, **_: ["stats", f"user:{user_id}"])
+    def get_user_best_score(self, user_id, exercise_type='multiplication_basic'):
+        """Получение лучшего результата пользователя (максимум очков) — поиск по первичному ключу"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(BEST_SCORE_SQL, (user_id, exercise_type))
+                result = cur.fetchone()
+                return (result[0] if result else 0) or 0
+
+    @cached("user_stats", tags=lambda user_id, **_: ["stats", f"user:{user_id}"])
+    def get_user_stats(self, user_id, exercise_type='multiplication_basic'):
+        """
+        Получение общей статистики (и последние 10 попыток — будет удобно, если понадобятся).
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(USER_STATS_SQL, {'user_id': user_id, 'exercise_type': exercise_type, 'limit': 10})
+                row = cur.fetchone()
+        return user_stats_row(row[:5], row[5])
+
+    @cached("profile", tags=lambda user_id, **_: ["stats", f"user:{user_id}"])
+    def get_profile_data(self, user_id, exercise_type='multiplication_basic', limit: int = 10):
+        """
+        Всё для страницы профиля за один запрос к БД: итоги и рекорд по типу упражнения,
+        последние попытки этого типа для графика и последние результаты любых типов.
+        Итоги берутся из user_exercise_stats по первичному ключу, попытки этого типа —
+        по индексу (user_id, exercise_type, completed_at DESC), результаты любых типов —
+        по (user_id, completed_at DESC).
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(PROFILE_SQL, {'user_id': user_id, 'exercise_type': exercise_type, 'limit': limit})
+                row = cur.fetchone()
+        return profile_row(exercise_type, row[:5], row[5], row[6])
+
+    ROSTER_SORT_KEYS = ROSTER_SORT_KEYS
+    STATS_SORT_KEYS = STATS_SORT_KEYS
+
+    def get_course_students(self, course_id: int):
+        """Возвращает список студентов, прикрепленных к курсу."""
+        return self.get_course_students_page(course_id, limit=None)["students"]
+
+    def get_course_students_page(self, course_id: int, after: str | None = None, limit: int | None = 50):
+        """
+        Страница списка студентов курса (keyset-пагинация).
+        after — курсор из next_cursor предыдущей страницы; limit=None — весь список.
+        """
+        sql, params, key_count = course_students_sql(course_id, after, limit)
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return self._page(cur, limit, key_count)
+
+    @cached("course_search", tags=lambda course_id, **_: [f"course:{course_id}"])
+    def search_course_students(self, course_id: int, query: str, limit: int = 10):
+        """
+        Быстрый поиск учеников курса для подсказок: не больше limit лучших совпадений
+        по ФИО или e-mail, самые похожие (триграммная similarity) — первыми.
+        """
+        search = course_search_sql(course_id, query, limit)
+        if search is None:
+            return []
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(*search)
                 cols = [d[0] for d in cur.description]
                 return [dict(zip(cols, row)) for row in cur.fetchall()]
 
+    def remove_student_from_course(self, student_id, course_id):
+        """
+        Удалить ученика с курса (запись в assigned_courses).
+        Возвращает {'removed': bool, 'remaining': сколько учеников осталось на курсе}.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(REMOVE_STUDENT_SQL, (student_id, course_id, course_id))
+                removed, before = cur.fetchone()
+        self._invalidate(f"course:{course_id}")
+        return {'removed': bool(removed), 'remaining': before - removed}
+
+    def assign_students_to_course(self, course_id, student_ids, assigned_by=None):
+        """
+        Записать на курс сразу много учеников — одним запросом (unnest + ON CONFLICT).
+        Возвращает [{'student_id', 'status'}], status: assigned | already_assigned | not_found
+        (нет такого пользователя или он не ученик).
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(ASSIGN_STUDENTS_SQL,
+                            {'ids': list(student_ids), 'course_id': course_id, 'assigned_by': assigned_by})
+                rows = cur.fetchall()
+        self._invalidate(f"course:{course_id}")
+        return [{'student_id': sid, 'status': status} for sid, status in rows]
+
+    def remove_students_from_course(self, course_id, student_ids):
+        """
+        Удалить с курса сразу много учеников одним запросом.
+        Возвращает {'results': [{'student_id', 'status'}], 'remaining': сколько осталось на курсе},
+        status: removed | not_assigned.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(REMOVE_STUDENTS_SQL, {'ids': list(student_ids), 'course_id': course_id})
+                rows = cur.fetchall()
+        self._invalidate(f"course:{course_id}")
+        return {
+            'results': [{'student_id': sid, 'status': status} for sid, status, _ in rows],
+            'remaining': rows[0][2] if rows else None,
+        }
+
+    def import_students_to_course(self, course_id, students, assigned_by=None):
+        """
+        Импорт списка класса: students — [{'email', 'first_name', 'last_name'}].
+        Одним запросом создаёт недостающих учеников (без пароля — он задаётся при первом входе
+        по коду, хеш которого передан в students[i]['invite_hash'])
+        и записывает всех на курс. Возвращает [{'email', 'student_id', 'status'}], status:
+        created (новый ученик записан) | assigned | already_assigned | not_student | not_found.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(IMPORT_STUDENTS_SQL, import_students_params(course_id, students, assigned_by))
+                rows = cur.fetchall()
+        self._invalidate(f"course:{course_id}")
+        return [{'email': email, 'student_id': sid, 'status': status} for email, sid, status in rows]
+
+    @cached("course_stats_page", tags=lambda course_id, **_: ["stats", f"course:{course_id}"])
+    def get_course_students_stats_page(self, course_id: int, query: str | None = None,
+                                       date_from: str | None = None, date_to: str | None = None,
+                                       sort: str | None = None, after: str | None = None,
+                                       limit: int | None = 50):
+        """
+        Страница статистики учеников курса: {'students': [...], 'next_cursor': str | None, 'total': int}.
+        after — курсор из next_cursor предыдущей страницы; limit=None — все строки.
+        """
+        sql, params, key_count = course_stats_sql(course_id, query, date_from, date_to, sort, after, limit)
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return self._page(cur, limit, key_count)
+
+    def stream_course_students_stats(self, course_id: int, query: str | None = None,
+                                     date_from: str | None = None, date_to: str | None = None,
+                                     sort: str | None = None, itersize: int = 500):
+        """
+        Построчная выгрузка статистики курса через серверный (именованный) курсор:
+        в памяти одновременно не больше itersize строк. Соединение берётся из пула
+        отдельно от unit of work запроса — ответ стримится уже после его COMMIT.
+        """
+        sql, params, key_count = course_stats_sql(course_id, query, date_from, date_to, sort)
+        with self.pool.connection() as conn:
+            try:
+                with conn.cursor(name="course_export") as cur:
+                    cur.itersize = itersize
+                    cur.execute(sql, params)
+                    cols = None
+                    for row in cur:
+                        if cols is None:
+                            cols = [d[0] for d in cur.description]
+                        yield strip_service_columns(dict(zip(cols, row)), key_count)
+            finally:
+                conn.rollback()
+
+    @staticmethod
+    def _page(cur, limit, key_count):
+        cols = [d[0] for d in cur.description]
+        return keyset_page([dict(zip(cols, row)) for row in cur.fetchall()], limit, key_count)
+
+    def get_course_students_stats(self, course_id: int, query: str | None = None,
+                                  date_from: str | None = None, date_to: str | None = None,
+                                  sort: str | None = None):
+        """
+        Агрегированная статистика учеников курса с поиском/датами/сортировкой.
+        Суммы берутся из дневных корзин user_daily_stats, а не из сырых exercise_results,
+        поэтому время ответа не растёт с историей. Даты — YYYY-MM-DD, верхняя граница исключается.
+        """
+        return self.get_course_students_stats_page(course_id, query, date_from, date_to, sort, limit=None)["students"]
+
     def get_last_results(self, user_id: int, limit: int = 10):
         """Последние попытки для графиков в профиле ученика."""
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT
-                        completed_at AS created_at,          -- <-- fixed alias
-                        COALESCE(total_points, 0)  AS points,  -- <-- fixed alias
-                        COALESCE(correct_count, 0) AS correct,
-                        COALESCE(wrong_count, 0)   AS wrong,
-                        COALESCE(average_time, 0)  AS avg_time
-                    FROM exercise_results
-                    WHERE user_id = %s
-                    ORDER BY completed_at DESC
-                    LIMIT %s
-                """, (user_id, limit))
+                cur.execute(LAST_RESULTS_SQL, (user_id, limit))
                 cols = [d[0] for d in cur.description]
                 return [dict(zip(cols, r)) for r in cur.fetchall()]
 
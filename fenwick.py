@@ -0,0 +1,81 @@
+from array import array
+
+REBUILD_EVERY = 10000  # пересобрать дерево, чтобы не копилась ошибка округления
+
+
+class FenwickTree:
+    """Дерево Фенвика над неотрицательными весами: изменение веса и выбор по префиксной сумме за O(log n)"""
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.weights = array('d', weights)
+        self._top = 1 << max(self.size.bit_length() - 1, 0)
+        self.rebuild()
+
+    def rebuild(self):
+        tree = array('d', [0.0]) * (self.size + 1)
+        for i, w in enumerate(self.weights, 1):
+            tree[i] += w
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.updates = 0
+
+    def append(self, weight):
+        """Добавить элемент в конец за O(log n)"""
+        self.weights.append(weight)
+        self.size += 1
+        self._top = 1 << max(self.size.bit_length() - 1, 0)
+        # Узел i хранит сумму элементов (i - lowbit(i), i]: новый вес плюс уже лежащие в дереве
+        i = self.size
+        self.tree.append(weight + self.prefix(i - 2) - self.prefix(i - (i & -i) - 1))
+
+    def set(self, index, weight):
+        delta = weight - self.weights[index]
+        if not delta:
+            return
+        self.weights[index] = weight
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+        self.updates += 1
+        if self.updates >= REBUILD_EVERY:
+            self.rebuild()
+
+    def prefix(self, index):
+        """Сумма весов элементов 0..index включительно"""
+        result, i = 0.0, min(index + 1, self.size)
+        while i > 0:
+            result += self.tree[i]
+            i -= i & -i
+        return result
+
+    def total(self):
+        return self.prefix(self.size - 1)
+
+    def find(self, value):
+        """
+        Индекс элемента, на который приходится value в [0, total()).
+        Для целых весов-счётчиков find(k - 1) — элемент, на который приходится k-я единица.
+        """
+        pos = 0
+        step = self._top
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= value:
+                pos = nxt
+                value -= self.tree[nxt]
+            step >>= 1
+        return min(pos, self.size - 1)
+
+    def sample(self, rng):
+        total = self.total()
+        if total <= 0:
+            return None
+        index = self.find(rng.random() * total)
+        # Погрешность округления может указать на нулевой вес — берём ближайший ненулевой слева
+        while index > 0 and self.weights[index] <= 0:
+            index -= 1
+        return index
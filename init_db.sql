@@ -1,5 +1,8 @@
 -- Полная схема БД для математического тренажера
 
+-- Триграммные индексы для поиска учеников (contrib-модуль, есть в стандартной поставке PostgreSQL)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- 1. Пользователи системы
 CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
@@ -8,9 +11,21 @@ CREATE TABLE IF NOT EXISTS users (
     role VARCHAR(20) DEFAULT 'student' CHECK (role IN ('student', 'teacher', 'parent')),
     first_name VARCHAR(100),
     last_name VARCHAR(100),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Ученик из импорта списка класса: SHA-256 кода от учителя, без него первый пароль не задать
+    invite_hash VARCHAR(64),
+    -- Нормализованная строка для поиска: ФИО и e-mail в нижнем регистре
+    search_text TEXT GENERATED ALWAYS AS (
+        lower(COALESCE(first_name, '') || ' ' || COALESCE(last_name, '') || ' ' || email)
+    ) STORED
 );
 
+-- Для баз, созданных до появления invite_hash и search_text
+ALTER TABLE users ADD COLUMN IF NOT EXISTS invite_hash VARCHAR(64);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS search_text TEXT GENERATED ALWAYS AS (
+    lower(COALESCE(first_name, '') || ' ' || COALESCE(last_name, '') || ' ' || email)
+) STORED;
+
 -- 2. Связь ученик-родитель
 CREATE TABLE IF NOT EXISTS student_parents (
     student_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
@@ -29,11 +44,15 @@ CREATE TABLE IF NOT EXISTS student_teachers (
 CREATE TABLE IF NOT EXISTS user_sessions (
     id SERIAL PRIMARY KEY,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-    session_token VARCHAR(255) UNIQUE NOT NULL,
+    session_token VARCHAR(255) UNIQUE NOT NULL,   -- SHA-256 токена из cookie, сам токен не храним
     expires_at TIMESTAMP NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    data JSONB NOT NULL DEFAULT '{}'               -- содержимое Flask session (sessions.py)
 );
 
+-- Для баз, созданных до появления серверных сессий
+ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS data JSONB NOT NULL DEFAULT '{}';
+
 -- 5. Типы упражнений
 CREATE TABLE IF NOT EXISTS exercise_types (
     id SERIAL PRIMARY KEY,
@@ -64,8 +83,11 @@ CREATE TABLE IF NOT EXISTS assigned_courses (
 );
 
 -- 8. Результаты выполнения упражнений (сводка по сессии)
+-- Секционирована по месяцам: exercise_results_pYYYYMM + exercise_results_default
+-- (секции создаёт ensure_monthly_partitions ниже; старые архивирует partitions.py).
+-- Переход со старой несекционированной таблицы: flask --app app partitions-migrate
 CREATE TABLE IF NOT EXISTS exercise_results (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     exercise_type VARCHAR(100) NOT NULL,
     correct_count INTEGER DEFAULT 0,
@@ -73,34 +95,137 @@ CREATE TABLE IF NOT EXISTS exercise_results (
     total_points INTEGER DEFAULT 0,
     average_time FLOAT DEFAULT 0.0,
     best_score INTEGER DEFAULT 0,
-    completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    completed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, completed_at)
+) PARTITION BY RANGE (completed_at);
 
--- 9. Детализация по каждому заданию
+-- 9. Детализация по каждому заданию (секционирована по месяцам так же, по created_at)
 CREATE TABLE IF NOT EXISTS exercise_attempts (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     exercise_type VARCHAR(100) NOT NULL,
     task_data JSONB NOT NULL, -- {a: 5, b: 3, answer: 15}
     user_answer INTEGER,
     is_correct BOOLEAN,
     time_spent FLOAT, -- seconds
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- 10. Накопительная статистика по пользователю и типу упражнения
+-- Обновляется в той же транзакции, что и вставка в exercise_results;
+-- пересчитать из истории: flask --app app rebuild-stats
+CREATE TABLE IF NOT EXISTS user_exercise_stats (
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    exercise_type VARCHAR(100) NOT NULL,
+    sessions_count INTEGER NOT NULL DEFAULT 0,
+    correct_total BIGINT NOT NULL DEFAULT 0,
+    wrong_total BIGINT NOT NULL DEFAULT 0,
+    best_points INTEGER NOT NULL DEFAULT 0,
+    points_total BIGINT NOT NULL DEFAULT 0,
+    time_total FLOAT NOT NULL DEFAULT 0.0,     -- сумма average_time по сессиям
+    timed_sessions INTEGER NOT NULL DEFAULT 0, -- сессии с average_time > 0
+    last_completed_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, exercise_type)
+);
+
+-- 11. Дневная статистика ученика (для панели учителя с фильтром по датам)
+-- Заполняется вместе с user_exercise_stats; пересчитывается той же командой rebuild-stats
+CREATE TABLE IF NOT EXISTS user_daily_stats (
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    exercise_type VARCHAR(100) NOT NULL,
+    day DATE NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    correct_total BIGINT NOT NULL DEFAULT 0,
+    wrong_total BIGINT NOT NULL DEFAULT 0,
+    time_total FLOAT NOT NULL DEFAULT 0.0,     -- сумма average_time по сессиям
+    timed_sessions INTEGER NOT NULL DEFAULT 0, -- сессии с average_time > 0
+    PRIMARY KEY (user_id, exercise_type, day)
+);
+
+-- 12. Ключи идемпотентности отложенной записи результатов (result_queue.py):
+-- повтор пачки после сбоя не создаёт дублей в exercise_results
+CREATE TABLE IF NOT EXISTS result_idempotency_keys (
+    idempotency_key VARCHAR(100) PRIMARY KEY,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+-- Старые ключи удаляет partitions.py (RESULT_KEY_TTL_DAYS)
+CREATE INDEX IF NOT EXISTS idx_result_idempotency_keys_created_at ON result_idempotency_keys(created_at);
 
 -- Создаем индексы для ускорения запросов
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
+-- Поиск учеников по подстроке ФИО/e-mail (LIKE '%...%') и сортировка по similarity
+CREATE INDEX IF NOT EXISTS idx_users_search_trgm ON users USING GIN (search_text gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_sessions_token ON user_sessions(session_token);
 CREATE INDEX IF NOT EXISTS idx_sessions_expires ON user_sessions(expires_at);
 CREATE INDEX IF NOT EXISTS idx_exercise_results_user_id ON exercise_results(user_id);
 CREATE INDEX IF NOT EXISTS idx_exercise_results_completed_at ON exercise_results(completed_at);
+-- Профиль: последние результаты одного типа — диапазонный скан (user_id, exercise_type, ...),
+-- последние результаты любых типов — по (user_id, completed_at DESC), без сортировки всей истории
+CREATE INDEX IF NOT EXISTS idx_exercise_results_user_type_completed
+    ON exercise_results(user_id, exercise_type, completed_at DESC);
+CREATE INDEX IF NOT EXISTS idx_exercise_results_user_completed
+    ON exercise_results(user_id, completed_at DESC);
 CREATE INDEX IF NOT EXISTS idx_exercise_attempts_user_id ON exercise_attempts(user_id);
 CREATE INDEX IF NOT EXISTS idx_exercise_attempts_created_at ON exercise_attempts(created_at);
+-- История ответов ученика по типу упражнения для адаптивного подбора задач (scheduler.py)
+CREATE INDEX IF NOT EXISTS idx_exercise_attempts_user_type_created
+    ON exercise_attempts(user_id, exercise_type, created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_student_parents_student ON student_parents(student_id);
 CREATE INDEX IF NOT EXISTS idx_student_parents_parent ON student_parents(parent_id);
 CREATE INDEX IF NOT EXISTS idx_student_teachers_student ON student_teachers(student_id);
 CREATE INDEX IF NOT EXISTS idx_student_teachers_teacher ON student_teachers(teacher_id);
+CREATE INDEX IF NOT EXISTS idx_assigned_courses_course ON assigned_courses(course_id, student_id);
+
+-- Месячные секции таблицы parent с месяца from_month по текущий + months_ahead (и DEFAULT-секция).
+-- Идемпотентна; для ещё не секционированной таблицы ничего не делает. Строки месяца,
+-- успевшие попасть в DEFAULT, переносятся в новую секцию. Возвращает число созданных секций.
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(parent TEXT, from_month DATE, months_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    col TEXT;
+    month DATE;
+    part TEXT;
+    created INTEGER := 0;
+BEGIN
+    SELECT a.attname INTO col
+    FROM pg_partitioned_table p
+    JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0]
+    WHERE p.partrelid = to_regclass(parent);
+    IF col IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    -- Несколько процессов приложения могут вызвать функцию одновременно
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_monthly_partitions'));
+
+    IF to_regclass(parent || '_default') IS NULL THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', parent || '_default', parent);
+    END IF;
+
+    month := date_trunc('month', from_month)::date;
+    WHILE month <= (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date LOOP
+        part := format('%s_p%s', parent, to_char(month, 'YYYYMM'));
+        IF to_regclass(part) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', part, parent);
+            EXECUTE format('WITH moved AS (DELETE FROM %I WHERE %I >= $1 AND %I < $2 RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved', parent || '_default', col, col, part)
+                USING month::timestamp, (month + interval '1 month')::timestamp;
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           parent, part, month::timestamp, (month + interval '1 month')::timestamp);
+            created := created + 1;
+        END IF;
+        month := (month + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции на текущий и три следующих месяца; дальше их досоздаёт приложение (partitions.py)
+SELECT ensure_monthly_partitions('exercise_results', CURRENT_DATE, 3);
+SELECT ensure_monthly_partitions('exercise_attempts', CURRENT_DATE, 3);
 
 -- Заполняем базовые типы упражнений
 INSERT INTO exercise_types (name, description, parameters) VALUES
@@ -0,0 +1,289 @@
+import logging
+import re
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+
+from psycopg2.extensions import cursor as BaseCursor
+
+
+slow_query_log = logging.getLogger("slow_query")
+
+# Файлы, в которых ищем «вызывающий метод» запроса (database.py регистрирует себя сам)
+CALLER_FILES = set()
+_SKIP_CALLERS = {'get_connection', '_scoped_connection', 'wrapper', '<lambda>', 'get_or_load'}
+
+# Границы корзин гистограмм, сек
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Строковые литералы в готовом SQL (execute_values собирает запрос со значениями сам)
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+# Плейсхолдеры psycopg2 в шаблоне запроса
+_PLACEHOLDER_RE = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def _statement_text(query, cur):
+    """
+    Текст запроса для журналов без значений параметров: шаблон, как его передали в execute.
+    В /debug/queries и журнал медленных запросов не должны попадать хеши паролей и токены сессий.
+    """
+    if hasattr(query, 'as_string'):
+        query = query.as_string(cur)
+    if isinstance(query, bytes):
+        # Запрос уже со значениями — вычищаем литералы
+        return _LITERAL_RE.sub("'?'", query.decode(errors='replace'))
+    return str(query)
+
+
+def _generic_statement(statement):
+    """Шаблон psycopg2 (%s, %(name)s) -> (запрос с $1, $2... для PREPARE, число параметров)"""
+    numbers = {}
+
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1) or len(numbers)
+        if name not in numbers:
+            numbers[name] = len(numbers) + 1
+        return f"${numbers[name]}"
+
+    return _PLACEHOLDER_RE.sub(replace, statement), len(numbers)
+
+
+def _caller_name():
+    frame = sys._getframe(2)
+    for _ in range(15):
+        if frame is None:
+            break
+        code = frame.f_code
+        if code.co_filename in CALLER_FILES and code.co_name not in _SKIP_CALLERS:
+            return code.co_name
+        frame = frame.f_back
+    return '?'
+
+
+class QueryProfiler:
+    """
+    Профилирование SQL на горячем пути: длительность, число строк и вызывающий метод
+    DatabaseManager для каждого запроса, сводка по HTTP-запросу, журнал медленных запросов
+    с планом EXPLAIN и гистограммы латентности маршрутов в формате Prometheus.
+    SQL хранится шаблоном, без значений параметров.
+    """
+
+    def __init__(self, slow_query_ms=200.0, explain_slow=True, explain_interval=60.0, recent_requests=50):
+        self.slow_query_ms = slow_query_ms
+        self.explain_slow = explain_slow
+        self.explain_interval = explain_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=recent_requests)
+        self._explained_at = {}      # текст запроса -> когда последний раз делали EXPLAIN
+        self._slow_total = 0
+        # (route, method, status) -> [bucket counts..., +Inf], sum, count
+        self._route_hist = {}
+        self._route_db = defaultdict(lambda: [0, 0.0])   # route -> [queries, db seconds]
+
+    # ---------- HTTP-запрос ----------
+    def start_request(self):
+        self._local.queries = []
+        self._local.started = time.perf_counter()
+
+    def request_summary(self):
+        queries = getattr(self._local, 'queries', None) or []
+        return len(queries), sum(q['ms'] for q in queries)
+
+    def finish_request(self, route, method, status):
+        queries = getattr(self._local, 'queries', None)
+        started = getattr(self._local, 'started', None)
+        self._local.queries = None
+        self._local.started = None
+        if queries is None or started is None:
+            return
+        elapsed = time.perf_counter() - started
+        db_ms = sum(q['ms'] for q in queries)
+        with self._lock:
+            key = (route, method, str(status))
+            hist = self._route_hist.get(key)
+            if hist is None:
+                hist = self._route_hist[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    hist[0][i] += 1
+            hist[0][-1] += 1
+            hist[1] += elapsed
+            hist[2] += 1
+            agg = self._route_db[route]
+            agg[0] += len(queries)
+            agg[1] += db_ms / 1000.0
+            self._recent.append({
+                'route': route,
+                'method': method,
+                'status': status,
+                'ms': round(elapsed * 1000, 2),
+                'db_ms': round(db_ms, 2),
+                'queries': queries,
+            })
+
+    # ---------- SQL-запрос ----------
+    def record(self, cur, query, elapsed, caller, failed=False):
+        ms = elapsed * 1000
+        queries = getattr(self._local, 'queries', None)
+        statement = _statement_text(query, cur)
+        rows = cur.rowcount
+        if queries is not None:
+            queries.append({
+                'caller': caller,
+                'ms': round(ms, 3),
+                'rows': rows,
+                'sql': ' '.join(statement.split())[:300],
+                **({'failed': True} if failed else {}),
+            })
+        if ms >= self.slow_query_ms and not failed:
+            self._log_slow(cur, statement, ms, rows, caller, template=not isinstance(query, bytes))
+
+    def _log_slow(self, cur, statement, ms, rows, caller, template=True):
+        with self._lock:
+            self._slow_total += 1
+        plan = None
+        if self.explain_slow and template and self._explainable(statement):
+            plan = self._explain(cur.connection, statement)
+        slow_query_log.warning(
+            "slow query %.1f ms, rows=%s, caller=%s\n%s%s",
+            ms, rows, caller, statement.strip(),
+            ("\n--- EXPLAIN ---\n" + plan) if plan else "",
+        )
+
+    def _explainable(self, statement):
+        # План нужен только для чтений; запрос при этом не выполняется (EXPLAIN без ANALYZE),
+        # так что побочные эффекты функций вроде ensure_monthly_partitions не повторятся
+        head = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+        if head not in ('SELECT', 'WITH'):
+            return False
+        upper = statement.upper()
+        if any(word in upper for word in ('INSERT ', 'UPDATE ', 'DELETE ', 'FOR UPDATE', 'LOCK ')):
+            return False
+        now = time.monotonic()
+        key = ' '.join(statement.split())[:500]
+        with self._lock:
+            last = self._explained_at.get(key)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            self._explained_at[key] = now
+            if len(self._explained_at) > 1000:
+                self._explained_at.clear()
+        return True
+
+    def _explain(self, conn, statement):
+        # Обычный курсор — чтобы сам EXPLAIN не попал в профилирование;
+        # SAVEPOINT — чтобы ошибка EXPLAIN не сломала транзакцию запроса.
+        # Значений параметров у нас нет — строим общий план: PREPARE и EXPLAIN EXECUTE с NULL
+        # при plan_cache_mode = force_generic_plan (PostgreSQL 12+; EXPLAIN (GENERIC_PLAN) — только с 16)
+        try:
+            generic, param_count = _generic_statement(statement)
+            args = f"({', '.join(['NULL'] * param_count)})" if param_count else ""
+            with conn.cursor(cursor_factory=BaseCursor) as cur:
+                cur.execute("SAVEPOINT slow_query_explain")
+                prepared = False
+                try:
+                    cur.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+                    # Без параметров psycopg2 не трогает %, так что $1... уходят как есть
+                    cur.execute("PREPARE slow_query_explain AS " + generic)
+                    prepared = True
+                    cur.execute("EXPLAIN EXECUTE slow_query_explain" + args)
+                    plan = "\n".join(row[0] for row in cur.fetchall())
+                except Exception as e:
+                    plan = f"(EXPLAIN не выполнен: {e})"
+                # Откат к точке сохранения возвращает plan_cache_mode запроса;
+                # подготовленный запрос транзакции не подчиняется — удаляем его явно
+                cur.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                cur.execute("RELEASE SAVEPOINT slow_query_explain")
+                if prepared:
+                    cur.execute("DEALLOCATE slow_query_explain")
+                return plan
+        except Exception as e:
+            return f"(EXPLAIN не выполнен: {e})"
+
+    # ---------- вывод ----------
+    def recent(self, limit=20):
+        with self._lock:
+            return list(self._recent)[-limit:][::-1]
+
+    def render_prometheus(self, gauges=None):
+        """
+        Метрики в текстовом формате Prometheus.
+        gauges — {имя: (help, {labels-tuple или None: value})} для состояния пула, кеша и очереди.
+        """
+        lines = [
+            "# HELP http_request_duration_seconds Латентность HTTP-запросов по маршрутам",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (route, method, status), (buckets, total, count) in sorted(self._route_hist.items()):
+                labels = f'route="{_escape(route)}",method="{method}",status="{status}"'
+                for bound, value in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {value}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {buckets[-1]}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {total:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {count}')
+
+            lines.append("# HELP db_queries_total SQL-запросы по маршрутам")
+            lines.append("# TYPE db_queries_total counter")
+            for route, (queries, _) in sorted(self._route_db.items()):
+                lines.append(f'db_queries_total{{route="{_escape(route)}"}} {queries}')
+            lines.append("# HELP db_query_seconds_total Время в БД по маршрутам")
+            lines.append("# TYPE db_query_seconds_total counter")
+            for route, (_, seconds) in sorted(self._route_db.items()):
+                lines.append(f'db_query_seconds_total{{route="{_escape(route)}"}} {seconds:.6f}')
+            lines.append("# HELP db_slow_queries_total Запросы медленнее порога SLOW_QUERY_MS")
+            lines.append("# TYPE db_slow_queries_total counter")
+            lines.append(f"db_slow_queries_total {self._slow_total}")
+
+        for name, (help_text, values) in (gauges or {}).items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in values.items():
+                label_str = "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels) + "}" if labels else ""
+                lines.append(f"{name}{label_str} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class InstrumentedCursor(BaseCursor):
+    """Курсор, который сообщает профилировщику о каждом выполненном запросе"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            profiler.record(self, query, time.perf_counter() - started, _caller_name(), failed=True)
+            raise
+        profiler.record(self, query, time.perf_counter() - started, _caller_name())
+        return result
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except Exception:
+            profiler.record(self, query, time.perf_counter() - started, _caller_name(), failed=True)
+            raise
+        profiler.record(self, query, time.perf_counter() - started, _caller_name())
+        return result
+
+
+def configure_slow_query_log(path):
+    """Писать медленные запросы в отдельный файл (по умолчанию — в общий лог)"""
+    if path and not slow_query_log.handlers:
+        handler = logging.FileHandler(path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_query_log.addHandler(handler)
+        slow_query_log.propagate = False
+
+
+# Глобальный экземпляр (настраивается из Config в database.py)
+profiler = QueryProfiler()
@@ -0,0 +1,280 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+
+from config import Config
+from database import db
+from fenwick import FenwickTree
+
+
+def display_name(user):
+    """Имя в рейтинге: «Имя Ф.» или начало e-mail — адреса других учеников не показываем"""
+    first = (user.get('first_name') or '').strip()
+    last = (user.get('last_name') or '').strip()
+    if first:
+        return f"{first} {last[0]}." if last else first
+    return (user.get('email') or '').split('@')[0][:3] + '…'
+
+
+class ScoreBoard:
+    """
+    Рейтинг по лучшему счёту: дерево Фенвика над счётчиками «сколько участников с таким счётом».
+    Дерево строится по сжатым координатам — отсортированному списку различных счётов (values),
+    так что память зависит от числа различных счётов, а не от их величины.
+    Место, процентиль и изменение счёта — O(log D), первые N — O(N log D); новый, ещё не
+    встречавшийся счёт пересобирает дерево за O(D). Участники с равным счётом делят место (1, 2, 2, 4).
+    """
+
+    def __init__(self, scores=None):
+        self.scores = dict(scores or {})          # user_id -> счёт
+        self.members = defaultdict(set)           # счёт -> user_id
+        for user_id, score in self.scores.items():
+            self.members[score].add(user_id)
+        self._rebuild()
+
+    def __len__(self):
+        return len(self.scores)
+
+    def _rebuild(self):
+        # Счёты без участников при пересборке выбрасываем
+        self.values = sorted(self.members)
+        self.counts = FenwickTree([len(self.members[v]) for v in self.values])
+
+    def _position(self, score):
+        """Индекс счёта в values или None, если такого счёта ещё не было"""
+        i = bisect_left(self.values, score)
+        return i if i < len(self.values) and self.values[i] == score else None
+
+    def _count_upto(self, score):
+        """Сколько участников со счётом не выше score"""
+        i = bisect_right(self.values, score)
+        return int(self.counts.prefix(i - 1)) if i else 0
+
+    def set(self, user_id, score):
+        score = max(int(score), 0)
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self.members[old].discard(user_id)
+            if not self.members[old]:
+                del self.members[old]
+            i = self._position(old)
+            self.counts.set(i, self.counts.weights[i] - 1)
+        self.scores[user_id] = score
+        self.members[score].add(user_id)
+        i = self._position(score)
+        if i is None:
+            self._rebuild()
+        else:
+            self.counts.set(i, self.counts.weights[i] + 1)
+
+    def offer(self, user_id, score):
+        """Новый результат: лучший счёт только растёт (как best_points в user_exercise_stats)"""
+        if score > self.scores.get(user_id, -1):
+            self.set(user_id, score)
+
+    def rank(self, user_id):
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        total = len(self.scores)
+        higher = total - self._count_upto(score)
+        lower = self._count_upto(score - 1)
+        return {
+            'rank': higher + 1,
+            'score': score,
+            'total': total,
+            # доля остальных участников с меньшим счётом
+            'percentile': round(100.0 * lower / (total - 1), 1) if total > 1 else 100.0,
+        }
+
+    def top(self, n):
+        result = []
+        total = len(self.scores)
+        k = total   # сколько участников со счётом не выше текущего
+        while k > 0 and len(result) < n:
+            score = self.values[self.counts.find(k - 1)]
+            users = sorted(self.members[score])
+            rank = total - k + 1
+            result.extend({'rank': rank, 'user_id': u, 'score': score} for u in users[:n - len(result)])
+            k -= len(users)
+        return result
+
+
+class Leaderboard:
+    """
+    Рейтинги лучших результатов: по типу упражнения (все ученики) и по курсу и типу.
+
+    Рейтинги по типам строятся из user_exercise_stats.best_points при первом обращении,
+    рейтинги курса — лениво для каждого курса (не больше max_courses в памяти). Новые
+    результаты учитываются сразу после записи пачки result_writer (record_results).
+    Процессы приложения не видят результатов друг друга, поэтому всё перечитывается из БД
+    не реже раза в refresh_interval; rebuild() — немедленно.
+    """
+
+    def __init__(self, store, refresh_interval=600.0, max_courses=500):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.max_courses = max_courses
+
+        self._types = None                 # exercise_type -> ScoreBoard
+        self._types_loaded_at = 0.0
+        self._courses = OrderedDict()      # course_id -> {'members', 'boards', 'loaded_at'}
+        self._user_courses = defaultdict(set)
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+        # Метрики
+        self._builds = 0
+        self._course_loads = 0
+        self._updates = 0
+
+    # ---------- загрузка ----------
+    def _stale(self, loaded_at):
+        return time.monotonic() - loaded_at >= self.refresh_interval
+
+    def _type_boards(self):
+        if self._types is not None and not self._stale(self._types_loaded_at):
+            return self._types
+        # Строим вне общей блокировки: остальные запросы пока читают прежние рейтинги
+        with self._build_lock:
+            if self._types is None or self._stale(self._types_loaded_at):
+                self.rebuild_types()
+        return self._types
+
+    def rebuild_types(self):
+        scores = defaultdict(dict)
+        for exercise_type, user_id, best_points in self.store.get_best_scores():
+            scores[exercise_type][user_id] = best_points or 0
+        boards = {t: ScoreBoard(s) for t, s in scores.items()}
+        with self._lock:
+            self._types = boards
+            self._types_loaded_at = time.monotonic()
+            self._builds += 1
+        return boards
+
+    def _course(self, course_id):
+        with self._lock:
+            entry = self._courses.get(course_id)
+            if entry is not None and not self._stale(entry['loaded_at']):
+                self._courses.move_to_end(course_id)
+                return entry
+
+        members = set()
+        scores = defaultdict(dict)
+        for student_id, exercise_type, best_points in self.store.get_course_best_scores(course_id):
+            members.add(student_id)
+            if exercise_type is not None:
+                scores[exercise_type][student_id] = best_points or 0
+        entry = {
+            'members': members,
+            'boards': {t: ScoreBoard(s) for t, s in scores.items()},
+            'loaded_at': time.monotonic(),
+        }
+        with self._lock:
+            self._drop_course(course_id)
+            self._courses[course_id] = entry
+            for student_id in members:
+                self._user_courses[student_id].add(course_id)
+            while len(self._courses) > self.max_courses:
+                self._drop_course(next(iter(self._courses)))
+            self._course_loads += 1
+        return entry
+
+    def _drop_course(self, course_id):
+        entry = self._courses.pop(course_id, None)
+        if entry is None:
+            return
+        for student_id in entry['members']:
+            courses = self._user_courses.get(student_id)
+            if courses is not None:
+                courses.discard(course_id)
+                if not courses:
+                    del self._user_courses[student_id]
+
+    def board(self, exercise_type, course_id=None):
+        """ScoreBoard по типу (course_id=None) или по курсу и типу; None — пока нет участников"""
+        if course_id is None:
+            return self._type_boards().get(exercise_type)
+        return self._course(course_id)['boards'].get(exercise_type)
+
+    def is_member(self, course_id, user_id):
+        return user_id in self._course(course_id)['members']
+
+    # ---------- обновления ----------
+    def record_results(self, items):
+        """Учесть записанные результаты (пачка result_writer: [{user_id, payload: {points, exercise_type}}])"""
+        with self._lock:
+            for item in items:
+                user_id = item['user_id']
+                exercise_type = item['payload'].get('exercise_type', 'multiplication_basic')
+                points = int(item['payload'].get('points', 0))
+                if self._types is not None:
+                    board = self._types.get(exercise_type)
+                    if board is None:
+                        board = self._types[exercise_type] = ScoreBoard()
+                    board.offer(user_id, points)
+                for course_id in self._user_courses.get(user_id, ()):
+                    boards = self._courses[course_id]['boards']
+                    if exercise_type not in boards:
+                        boards[exercise_type] = ScoreBoard()
+                    boards[exercise_type].offer(user_id, points)
+                self._updates += 1
+
+    def forget_course(self, course_id):
+        """Состав курса изменился — рейтинг курса перечитается при следующем обращении"""
+        with self._lock:
+            self._drop_course(course_id)
+
+    def rebuild(self):
+        """Перечитать рейтинги по типам из БД и сбросить рейтинги курсов"""
+        with self._build_lock:
+            boards = self.rebuild_types()
+        with self._lock:
+            for course_id in list(self._courses):
+                self._drop_course(course_id)
+        return {t: len(b) for t, b in boards.items()}
+
+    # ---------- чтение ----------
+    def top(self, exercise_type, course_id=None, limit=10):
+        board = self.board(exercise_type, course_id)
+        if board is None:
+            return []
+        with self._lock:
+            return board.top(limit)
+
+    def rank(self, user_id, exercise_type, course_id=None):
+        """{rank, score, total, percentile} или None, если у ученика нет результатов этого типа"""
+        board = self.board(exercise_type, course_id)
+        if board is None:
+            return None
+        with self._lock:
+            return board.rank(user_id)
+
+    def user_ranks(self, user_id):
+        """Места ученика во всех рейтингах по типам: {exercise_type: rank}"""
+        boards = self._type_boards()
+        with self._lock:
+            ranks = {t: board.rank(user_id) for t, board in sorted(boards.items())}
+        return {t: r for t, r in ranks.items() if r is not None}
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'type_boards': len(self._types or {}),
+                'players': sum(len(b) for b in (self._types or {}).values()),
+                'courses': len(self._courses),
+                'builds': self._builds,
+                'course_loads': self._course_loads,
+                'updates': self._updates,
+            }
+
+
+# Глобальный экземпляр
+leaderboard = Leaderboard(
+    db,
+    refresh_interval=Config.LEADERBOARD_REFRESH_INTERVAL,
+    max_courses=Config.LEADERBOARD_MAX_COURSES,
+)
@@ -0,0 +1,305 @@
+import atexit
+import gzip
+import os
+import re
+import threading
+import time
+from datetime import date
+
+from config import Config
+from database import db
+
+# Секционированные таблицы и их ключ секционирования
+PARTITIONED_TABLES = {
+    'exercise_results': 'completed_at',
+    'exercise_attempts': 'created_at',
+}
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'init_db.sql')
+
+PARTITION_NAME_RE = re.compile(r'^(?P<table>\w+)_p(?P<year>\d{4})(?P<month>\d{2})$')
+
+
+def month_start(months_back: int, today: date | None = None) -> date:
+    """Первое число месяца, отстоящего от текущего на months_back назад"""
+    today = today or date.today()
+    index = today.year * 12 + today.month - 1 - months_back
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class PartitionManager:
+    """
+    Месячные секции exercise_results и exercise_attempts.
+
+    ensure() досоздаёт секции на months_ahead месяцев вперёд (SQL-функция
+    ensure_monthly_partitions из init_db.sql); фоновый поток вызывает её раз в check_interval.
+    archive() отсоединяет секции старше retention_months, выгружает каждую в
+    <archive_dir>/<таблица>/<секция>.csv.gz (COPY) и удаляет. Накопительная статистика
+    (user_exercise_stats, user_daily_stats) при этом сохраняется, но rebuild-stats после
+    архивации пересчитает её только по оставшейся истории.
+    Там же удаляются ключи идемпотентности result_queue.py старше key_ttl_days: повтор
+    пачки из spool-файла приходит самое позднее через часы, а не недели.
+
+    Вернуть секцию из архива:
+        SELECT ensure_monthly_partitions('exercise_results', '2024-01-01', 0);
+        gunzip -c archive/exercise_results/exercise_results_p202401.csv.gz \\
+            | psql -c "\\copy exercise_results FROM STDIN (FORMAT csv, HEADER)"
+    """
+
+    def __init__(self, store, months_ahead=3, check_interval=21600.0, retention_months=0, archive_dir='archive',
+                 key_ttl_days=30, prune_batch=10000):
+        self.store = store
+        self.months_ahead = months_ahead
+        self.check_interval = check_interval
+        self.retention_months = retention_months
+        self.archive_dir = archive_dir
+        self.key_ttl_days = key_ttl_days
+        self.prune_batch = prune_batch
+
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Метрики
+        self._created = 0
+        self._archived = 0
+        self._pruned_keys = 0
+        self._last_check = None
+        self._last_error = None
+
+    # ---------- секции ----------
+    def ensure(self, from_month: date | None = None):
+        """Создать недостающие секции с from_month (по умолчанию — текущий месяц) и на будущее"""
+        created = {}
+        with self.store.get_connection() as conn:
+            with conn.cursor() as cur:
+                for table in PARTITIONED_TABLES:
+                    cur.execute("SELECT ensure_monthly_partitions(%s, %s::date, %s)",
+                                (table, from_month or date.today(), self.months_ahead))
+                    created[table] = cur.fetchone()[0]
+        with self._lock:
+            self._created += sum(created.values())
+            self._last_check = time.time()
+        return created
+
+    def list_partitions(self, cur, table):
+        """Месячные секции таблицы (в том числе уже отсоединённые): [(имя, месяц, подключена ли)]"""
+        cur.execute("""
+            SELECT c.relname, i.inhparent IS NOT NULL
+            FROM pg_class c
+            LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = to_regclass(%s)
+            WHERE c.relkind = 'r'
+              AND c.relnamespace = current_schema()::regnamespace
+              AND c.relname LIKE %s
+            ORDER BY c.relname
+        """, (table, table.replace('_', r'\_') + r'\_p%'))
+        partitions = []
+        for name, attached in cur.fetchall():
+            match = PARTITION_NAME_RE.match(name)
+            if match and match['table'] == table:
+                partitions.append((name, date(int(match['year']), int(match['month']), 1), attached))
+        return partitions
+
+    # ---------- переход со старой схемы ----------
+    def migrate(self, keep_flat=False):
+        """
+        Перевести несекционированные exercise_results/exercise_attempts на секции в одной транзакции:
+        старая таблица переименовывается в <таблица>_flat (вместе с индексами и последовательностью id),
+        init_db.sql создаёт секционированную, строки копируются, счётчик id продолжается.
+        Таблицы блокируются на время копирования. Возвращает {таблица: перенесено строк}.
+        """
+        with open(SCHEMA_PATH, encoding='utf-8') as f:
+            schema_sql = f.read()
+
+        moved = {}
+        with self.store.get_connection() as conn:
+            with conn.cursor() as cur:
+                flat_tables = []
+                for table in PARTITIONED_TABLES:
+                    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+                    row = cur.fetchone()
+                    if row is None or row[0] == 'p':
+                        continue
+                    flat = f"{table}_flat"
+                    cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+                    cur.execute(f"ALTER TABLE {table} RENAME TO {flat}")
+                    # Освобождаем имена индексов и последовательности для новой таблицы
+                    cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+                                (flat,))
+                    for (index,) in cur.fetchall():
+                        cur.execute(f'ALTER INDEX "{index}" RENAME TO "{index[:58]}_flat"')
+                    cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (flat,))
+                    sequence = cur.fetchone()[0]
+                    if sequence:
+                        cur.execute(f"ALTER SEQUENCE {sequence} RENAME TO {table}_id_seq_flat")
+                    flat_tables.append(table)
+
+                if not flat_tables:
+                    return moved
+
+                cur.execute(schema_sql)
+
+                for table in flat_tables:
+                    column = PARTITIONED_TABLES[table]
+                    flat = f"{table}_flat"
+                    cur.execute(f"SELECT MIN({column}) FROM {flat}")
+                    first = cur.fetchone()[0]
+                    cur.execute("SELECT ensure_monthly_partitions(%s, %s::date, %s)",
+                                (table, first or date.today(), self.months_ahead))
+
+                    cur.execute("""
+                        SELECT column_name FROM information_schema.columns
+                        WHERE table_schema = current_schema() AND table_name = %s
+                          AND column_name IN (SELECT column_name FROM information_schema.columns
+                                              WHERE table_schema = current_schema() AND table_name = %s)
+                        ORDER BY ordinal_position
+                    """, (flat, table))
+                    columns = [c for (c,) in cur.fetchall()]
+                    # Ключ секционирования теперь NOT NULL
+                    values = [f"COALESCE({c}, CURRENT_TIMESTAMP)" if c == column else c for c in columns]
+                    cur.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+                                f"SELECT {', '.join(values)} FROM {flat}")
+                    moved[table] = cur.rowcount
+
+                    cur.execute(f"""
+                        SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL)
+                        FROM {flat}
+                    """, (table,))
+                    if not keep_flat:
+                        cur.execute(f"DROP TABLE {flat}")
+        return moved
+
+    # ---------- архивация ----------
+    def archive(self, keep_months: int | None = None, dry_run=False):
+        """
+        Отсоединить, выгрузить в gzip и удалить секции старше keep_months месяцев
+        (считая текущий). Каждая секция — отдельные короткие транзакции; прерванный запуск
+        доделывается следующим (отсоединённые секции тоже подхватываются).
+        Возвращает список [{table, partition, month, rows, file}].
+        """
+        keep_months = keep_months if keep_months is not None else self.retention_months
+        if keep_months < 1:
+            raise ValueError("Нужно хранить хотя бы текущий месяц (keep_months >= 1)")
+        cutoff = month_start(keep_months - 1)
+
+        archived = []
+        with self.store.get_connection() as conn:
+            with conn.cursor() as cur:
+                # Один архиватор на базу, даже если процессов приложения несколько
+                cur.execute("SELECT pg_try_advisory_lock(hashtext('partitions-archive'))")
+                if not cur.fetchone()[0]:
+                    return archived
+                try:
+                    for table in PARTITIONED_TABLES:
+                        for name, month, attached in self.list_partitions(cur, table):
+                            if month >= cutoff:
+                                continue
+                            entry = {'table': table, 'partition': name, 'month': month.isoformat(),
+                                     'rows': None, 'file': None}
+                            if not dry_run:
+                                if attached:
+                                    cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                                    conn.commit()
+                                entry['file'], entry['rows'] = self._dump(cur, table, name)
+                                cur.execute(f"DROP TABLE {name}")
+                                conn.commit()
+                                with self._lock:
+                                    self._archived += 1
+                            archived.append(entry)
+                finally:
+                    conn.rollback()
+                    cur.execute("SELECT pg_advisory_unlock(hashtext('partitions-archive'))")
+        return archived
+
+    def _dump(self, cur, table, name):
+        directory = os.path.join(self.archive_dir, table)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}.csv.gz")
+        tmp_path = path + '.part'
+        with open(tmp_path, 'wb') as raw:
+            with gzip.open(raw, 'wt', encoding='utf-8', newline='') as f:
+                cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+            raw.flush()
+            os.fsync(raw.fileno())
+        rows = cur.rowcount
+        # Файл появляется под итоговым именем только целиком — до DROP секции
+        os.replace(tmp_path, path)
+        return path, rows
+
+    # ---------- ключи идемпотентности ----------
+    def prune_result_keys(self, ttl_days: int | None = None):
+        """Удалить ключи идемпотентности результатов старше ttl_days; пачками, каждая — своя транзакция"""
+        ttl_days = ttl_days if ttl_days is not None else self.key_ttl_days
+        deleted = 0
+        with self.store.get_connection() as conn:
+            with conn.cursor() as cur:
+                while True:
+                    cur.execute("""
+                        DELETE FROM result_idempotency_keys
+                        WHERE ctid IN (
+                            SELECT ctid FROM result_idempotency_keys
+                            WHERE created_at < NOW() - make_interval(days => %s)
+                            LIMIT %s
+                        )
+                    """, (ttl_days, self.prune_batch))
+                    conn.commit()
+                    deleted += cur.rowcount
+                    if cur.rowcount < self.prune_batch:
+                        break
+        with self._lock:
+            self._pruned_keys += deleted
+        return deleted
+
+    # ---------- фоновый поток ----------
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="partition-maintenance", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.ensure()
+                if self.retention_months > 0:
+                    self.archive()
+                if self.key_ttl_days > 0:
+                    self.prune_result_keys()
+            except Exception as e:
+                print(f"Partition maintenance error: {e}")
+                with self._lock:
+                    self._last_error = str(e)
+            if self._stop.wait(self.check_interval):
+                break
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'created': self._created,
+                'archived': self._archived,
+                'pruned_keys': self._pruned_keys,
+                'last_check': self._last_check,
+                'last_error': self._last_error,
+            }
+
+
+# Глобальный экземпляр
+partition_manager = PartitionManager(
+    db,
+    months_ahead=Config.PARTITION_MONTHS_AHEAD,
+    check_interval=Config.PARTITION_CHECK_INTERVAL,
+    retention_months=Config.PARTITION_RETENTION_MONTHS,
+    archive_dir=Config.PARTITION_ARCHIVE_DIR,
+    key_ttl_days=Config.RESULT_KEY_TTL_DAYS,
+)
+atexit.register(partition_manager.stop)
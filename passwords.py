@@ -0,0 +1,183 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import MISSING, MemoryCache
+from config import Config
+
+try:
+    import argon2
+except ImportError:  # argon2id необязателен, по умолчанию scrypt из hashlib
+    argon2 = None
+
+
+class PasswordHasherBusy(Exception):
+    """Слишком много проверок паролей в очереди — запрос лучше повторить позже"""
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+class PasswordHasher:
+    """
+    Хеши паролей с версией в самой строке:
+      - <64 hex>                         — старый SHA-256 без соли (только проверка);
+      - scrypt$<n>$<r>$<p>$<salt>$<hash>  — scrypt из hashlib;
+      - $argon2id$...                    — argon2id, если установлен argon2-cffi.
+    needs_rehash() говорит, что хеш устарел (другая схема или параметры) — его пересчитывают при входе.
+
+    Сам KDF выполняется в ограниченном пуле из workers потоков (scrypt и argon2 отпускают GIL),
+    так что всплеск входов занимает не больше workers ядер. Если в очереди больше max_pending
+    задач, check/hash сразу выбрасывают PasswordHasherBusy. Успешные проверки кешируются
+    на verify_cache_ttl секунд по ключу HMAC(случайный ключ процесса, хеш + пароль).
+    """
+
+    def __init__(self, scheme='scrypt', scrypt_n=2 ** 14, scrypt_r=8, scrypt_p=1,
+                 argon2_time_cost=2, argon2_memory_cost=19456, argon2_parallelism=1,
+                 workers=None, max_pending=64, wait_timeout=10.0, verify_cache_ttl=300.0):
+        if scheme == 'argon2' and argon2 is None:
+            print("Password hasher: argon2-cffi не установлен, используется scrypt")
+            scheme = 'scrypt'
+        self.scheme = scheme
+        self.scrypt_n = scrypt_n
+        self.scrypt_r = scrypt_r
+        self.scrypt_p = scrypt_p
+        self._argon2 = argon2.PasswordHasher(
+            time_cost=argon2_time_cost, memory_cost=argon2_memory_cost, parallelism=argon2_parallelism,
+        ) if argon2 is not None else None
+
+        self.workers = workers or os.cpu_count() or 1
+        self.wait_timeout = wait_timeout
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers + max_pending)
+
+        self._cache_key = secrets.token_bytes(32)
+        self._verified = MemoryCache(maxsize=10000, ttl=verify_cache_ttl) if verify_cache_ttl > 0 else None
+
+    # ---------- синхронные примитивы (выполняются в пуле) ----------
+    def _scrypt(self, password, salt, n, r, p):
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r * p + 2 ** 20, dklen=32)
+
+    def hash_sync(self, password):
+        if self.scheme == 'argon2':
+            return self._argon2.hash(password)
+        salt = secrets.token_bytes(16)
+        digest = self._scrypt(password, salt, self.scrypt_n, self.scrypt_r, self.scrypt_p)
+        return f"scrypt${self.scrypt_n}${self.scrypt_r}${self.scrypt_p}${_b64(salt)}${_b64(digest)}"
+
+    def verify_sync(self, password, stored):
+        if not stored:
+            return False
+        if stored.startswith('$argon2'):
+            if self._argon2 is None:
+                print("Password hasher: хеш argon2, но argon2-cffi не установлен")
+                return False
+            try:
+                return self._argon2.verify(stored, password)
+            except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+                return False
+        if stored.startswith('scrypt$'):
+            try:
+                _, n, r, p, salt, digest = stored.split('$')
+                expected = _unb64(digest)
+                actual = self._scrypt(password, _unb64(salt), int(n), int(r), int(p))
+            except ValueError:
+                return False
+            return hmac.compare_digest(actual, expected)
+        # Старый формат: SHA-256 hex без соли
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+    def needs_rehash(self, stored):
+        if self.scheme == 'argon2':
+            if not stored.startswith('$argon2'):
+                return True
+            return self._argon2.check_needs_rehash(stored)
+        return not stored.startswith(f"scrypt${self.scrypt_n}${self.scrypt_r}${self.scrypt_p}$")
+
+    # ---------- через пул ----------
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Слишком много одновременных входов")
+        try:
+            if self._executor is None:
+                with self._executor_lock:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except TimeoutError:
+            raise PasswordHasherBusy("Проверка пароля не уложилась в PASSWORD_WAIT_TIMEOUT")
+
+    def hash(self, password):
+        """Хеш пароля текущей схемой (KDF — в пуле)"""
+        return self._submit(self.hash_sync, password)
+
+    def check(self, password, stored):
+        """Проверка пароля против сохранённого хеша любой поддерживаемой версии"""
+        key = None
+        if self._verified is not None and stored:
+            key = hmac.new(self._cache_key, f"{stored}\0{password}".encode(), hashlib.sha256).hexdigest()
+            if self._verified.get(key) is not MISSING:
+                return True
+        ok = self._submit(self.verify_sync, password, stored)
+        if ok and key is not None:
+            self._verified.set(key, True)
+        return ok
+
+
+# Глобальный экземпляр
+password_hasher = PasswordHasher(
+    scheme=Config.PASSWORD_SCHEME,
+    scrypt_n=Config.PASSWORD_SCRYPT_N,
+    scrypt_r=Config.PASSWORD_SCRYPT_R,
+    scrypt_p=Config.PASSWORD_SCRYPT_P,
+    argon2_time_cost=Config.PASSWORD_ARGON2_TIME_COST,
+    argon2_memory_cost=Config.PASSWORD_ARGON2_MEMORY_COST,
+    argon2_parallelism=Config.PASSWORD_ARGON2_PARALLELISM,
+    workers=Config.PASSWORD_WORKERS,
+    max_pending=Config.PASSWORD_MAX_PENDING,
+    wait_timeout=Config.PASSWORD_WAIT_TIMEOUT,
+    verify_cache_ttl=Config.PASSWORD_VERIFY_CACHE_TTL,
+)
+
+
+def hash_password(password):
+    return password_hasher.hash(password)
+
+
+def check_password(password, stored):
+    return password_hasher.check(password, stored)
+
+
+# Без похожих символов (0/O, 1/I): код диктуют и вводят дети
+INVITE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+
+
+def new_invite_code(length=8):
+    """Одноразовый код первого входа ученика из импорта списка класса; учитель передаёт его ученику"""
+    return "".join(secrets.choice(INVITE_ALPHABET) for _ in range(length))
+
+
+def invite_code_hash(code):
+    """В users.invite_hash хранится только SHA-256 кода (код случайный — соль и KDF не нужны)"""
+    return hashlib.sha256(code.strip().upper().encode()).hexdigest()
+
+
+def check_invite_code(code, stored):
+    return bool(code and stored) and hmac.compare_digest(invite_code_hash(code), stored)
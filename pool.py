@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class ConnectionPool:
+    """
+    Ограниченный потокобезопасный пул соединений psycopg2.
+
+    - не больше max_size открытых соединений, min_size держим «тёплыми»;
+    - если все заняты — ждём освобождения не дольше timeout;
+    - простаивавшее дольше healthcheck_after соединение проверяется SELECT 1;
+    - соединение старше max_lifetime закрывается и создаётся заново.
+    """
+
+    def __init__(self, dsn, min_size=2, max_size=20, timeout=5.0,
+                 healthcheck_after=30.0, max_lifetime=1800.0, connect=psycopg2.connect):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("Некорректные размеры пула")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self.max_lifetime = max_lifetime
+        self._connect = connect
+
+        self._cond = threading.Condition()
+        self._idle = deque()          # (conn, created_at, last_used)
+        self._in_use = {}             # id(conn) -> created_at
+        self._opening = 0             # соединения, которые сейчас создаются
+        self._waiting = 0
+        self._closed = False
+        self._prefilled = False
+
+        # Метрики
+        self._created = 0
+        self._recycled = 0
+        self._failed_checks = 0
+        self._timeouts = 0
+        self._checkouts = 0
+
+    # ---------- служебное ----------
+    def _total(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _open(self):
+        conn = self._connect(self.dsn)
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_alive(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _prefill(self):
+        """Открываем min_size соединений при первом обращении (а не при импорте модуля)."""
+        with self._cond:
+            if self._prefilled:
+                return
+            self._prefilled = True
+            need = max(0, self.min_size - self._total())
+            self._opening += need
+        for _ in range(need):
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                continue
+            now = time.monotonic()
+            with self._cond:
+                self._opening -= 1
+                self._idle.append((conn, now, now))
+                self._cond.notify()
+
+    # ---------- публичное API ----------
+    def getconn(self):
+        """Взять соединение из пула (или создать новое, если лимит позволяет)."""
+        if not self._prefilled:
+            self._prefill()
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Пул соединений закрыт")
+                while not self._idle and self._total() >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Нет свободных соединений за {self.timeout} сек "
+                            f"(занято {len(self._in_use)} из {self.max_size})"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    # LIFO: самое «свежее» соединение реже оказывается протухшим
+                    conn, created_at, last_used = self._idle.pop()
+                    self._opening += 1
+                    fresh = False
+                else:
+                    conn, created_at, last_used = None, None, None
+                    self._opening += 1
+                    fresh = True
+
+            now = time.monotonic()
+            try:
+                if fresh:
+                    conn = self._open()
+                    created_at = now
+                elif conn.closed or now - created_at > self.max_lifetime:
+                    self._close_quietly(conn)
+                    with self._cond:
+                        self._recycled += 1
+                    conn = self._open()
+                    created_at = now
+                elif now - last_used > self.healthcheck_after and not self._is_alive(conn):
+                    self._close_quietly(conn)
+                    with self._cond:
+                        self._failed_checks += 1
+                        self._recycled += 1
+                    conn = self._open()
+                    created_at = now
+            except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                raise
+
+            with self._cond:
+                self._opening -= 1
+                self._in_use[id(conn)] = created_at
+                self._checkouts += 1
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """Вернуть соединение в пул. discard=True — закрыть его вместо возврата."""
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+        if created_at is None:
+            # Чужое соединение — просто закрываем
+            self._close_quietly(conn)
+            return
+
+        if not discard and not conn.closed:
+            try:
+                # Незавершённую транзакцию в пул не возвращаем
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._recycled += 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: взять соединение и гарантированно вернуть его."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def close(self):
+        """Закрыть все простаивающие соединения; занятые закроются при возврате."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Метрики пула"""
+        with self._cond:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'created': self._created,
+                'recycled': self._recycled,
+                'failed_checks': self._failed_checks,
+                'timeouts': self._timeouts,
+                'checkouts': self._checkouts,
+            }
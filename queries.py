@@ -0,0 +1,653 @@
+"""
+SQL, общий для DatabaseManager (psycopg2, database.py) и AsyncDatabaseManager (psycopg 3,
+async_database.py). Плейсхолдеры у обоих драйверов одинаковые (%s и %(name)s), поэтому
+менеджеры отличаются только способом выполнения запроса, а сами запросы живут здесь.
+"""
+import base64
+import json
+import math
+
+
+# ---------- накопительная статистика ----------
+
+# Обновление user_exercise_stats по строкам CTE new_results (INSERT ... RETURNING в exercise_results).
+# Строки группируются, поэтому подходит и для пакетной вставки нескольких результатов.
+USER_STATS_UPSERT_SQL = """
+    INSERT INTO user_exercise_stats AS s
+        (user_id, exercise_type, sessions_count, correct_total, wrong_total,
+         best_points, points_total, time_total, timed_sessions, last_completed_at, updated_at)
+    SELECT
+        user_id,
+        exercise_type,
+        COUNT(*),
+        COALESCE(SUM(correct_count), 0),
+        COALESCE(SUM(wrong_count), 0),
+        COALESCE(MAX(total_points), 0),
+        COALESCE(SUM(total_points), 0),
+        COALESCE(SUM(average_time), 0),
+        COUNT(NULLIF(average_time, 0)),
+        MAX(completed_at),
+        NOW()
+    FROM new_results
+    GROUP BY user_id, exercise_type
+    ON CONFLICT (user_id, exercise_type) DO UPDATE SET
+        sessions_count    = s.sessions_count + EXCLUDED.sessions_count,
+        correct_total     = s.correct_total + EXCLUDED.correct_total,
+        wrong_total       = s.wrong_total + EXCLUDED.wrong_total,
+        best_points       = GREATEST(s.best_points, EXCLUDED.best_points),
+        points_total      = s.points_total + EXCLUDED.points_total,
+        time_total        = s.time_total + EXCLUDED.time_total,
+        timed_sessions    = s.timed_sessions + EXCLUDED.timed_sessions,
+        last_completed_at = GREATEST(s.last_completed_at, EXCLUDED.last_completed_at),
+        updated_at        = NOW()
+"""
+
+# Обновление user_daily_stats по тем же строкам new_results: суммы по (пользователь, тип, день).
+DAILY_STATS_UPSERT_SQL = """
+    INSERT INTO user_daily_stats AS d
+        (user_id, exercise_type, day, attempts, correct_total, wrong_total, time_total, timed_sessions)
+    SELECT
+        user_id,
+        exercise_type,
+        completed_at::date,
+        COUNT(*),
+        COALESCE(SUM(correct_count), 0),
+        COALESCE(SUM(wrong_count), 0),
+        COALESCE(SUM(average_time), 0),
+        COUNT(NULLIF(average_time, 0))
+    FROM new_results
+    GROUP BY user_id, exercise_type, completed_at::date
+    ON CONFLICT (user_id, exercise_type, day) DO UPDATE SET
+        attempts       = d.attempts + EXCLUDED.attempts,
+        correct_total  = d.correct_total + EXCLUDED.correct_total,
+        wrong_total    = d.wrong_total + EXCLUDED.wrong_total,
+        time_total     = d.time_total + EXCLUDED.time_total,
+        timed_sessions = d.timed_sessions + EXCLUDED.timed_sessions
+"""
+
+
+def results_insert_sql(insert_sql, with_sql=""):
+    """
+    Полный запрос сохранения результатов: insert_sql — INSERT INTO exercise_results ... RETURNING
+    (user_id, exercise_type, correct_count, wrong_count, total_points, average_time, completed_at),
+    вместе с ним в одном запросе обновляются обе таблицы накопительной статистики.
+    Запрос возвращает число вставленных результатов и курсы их авторов (для инвалидации кеша).
+    with_sql — дополнительные CTE перед new_results (без WITH, с завершающей запятой).
+    """
+    return (
+        "WITH " + with_sql + " new_results AS (" + insert_sql + "), "
+        "user_rollup AS (" + USER_STATS_UPSERT_SQL + "), "
+        "daily_rollup AS (" + DAILY_STATS_UPSERT_SQL + ") "
+        "SELECT "
+        "  (SELECT COUNT(*) FROM new_results), "
+        "  ARRAY(SELECT DISTINCT ac.course_id FROM assigned_courses ac "
+        "        WHERE ac.student_id IN (SELECT user_id FROM new_results))"
+    )
+
+
+# ---------- пользователи ----------
+
+CREATE_USER_SQL = """
+    INSERT INTO users (email, password_hash, role, first_name, last_name)
+    VALUES (%s, %s, %s, %s, %s) RETURNING id
+"""
+
+USER_BY_EMAIL_SQL = """
+    SELECT id, email, password_hash, role, first_name, last_name, invite_hash
+    FROM users WHERE email = %s
+"""
+
+UPDATE_PASSWORD_HASH_SQL = """
+    UPDATE users SET password_hash = %s
+    WHERE id = %s AND password_hash = %s
+"""
+
+# Первый пароль ученика из импорта: только пока пароля нет и с действующим кодом; код одноразовый
+ACCEPT_INVITE_SQL = """
+    UPDATE users SET password_hash = %s, invite_hash = NULL
+    WHERE id = %s AND password_hash = '' AND invite_hash = %s
+"""
+
+# Новый код первого входа (прежний перестаёт действовать) — ученику этого курса, ещё без пароля
+ISSUE_INVITE_SQL = """
+    UPDATE users u SET invite_hash = %(invite_hash)s
+    WHERE u.id = %(student_id)s AND u.role = 'student' AND u.password_hash = ''
+      AND EXISTS (SELECT 1 FROM assigned_courses a
+                  WHERE a.student_id = u.id AND a.course_id = %(course_id)s)
+"""
+
+EXERCISE_TYPES_SQL = "SELECT name, parameters FROM exercise_types ORDER BY id"
+
+
+# ---------- результаты и ответы ----------
+
+# Один результат (user_id, exercise_type, correct, wrong, points, avg_time), время — NOW() базы
+SAVE_RESULT_SQL = results_insert_sql("""
+    INSERT INTO exercise_results
+        (user_id, exercise_type, correct_count, wrong_count, total_points, average_time, completed_at)
+    VALUES (%s, %s, %s, %s, %s, %s, NOW())
+    RETURNING user_id, exercise_type, correct_count, wrong_count, total_points, average_time, completed_at
+""")
+
+# Идемпотентная пачка из очереди отложенной записи: столбцы передаются массивами (unnest),
+# результаты с уже встречавшимся ключом пропускаются. completed_at — ISO-строки с часовым поясом.
+SAVE_RESULTS_BATCH_SQL = results_insert_sql("""
+    INSERT INTO exercise_results
+        (user_id, exercise_type, correct_count, wrong_count, total_points, average_time, completed_at)
+    SELECT i.user_id, i.exercise_type, i.correct_count, i.wrong_count, i.total_points, i.average_time, i.completed_at
+    FROM input i
+    JOIN fresh f ON f.idempotency_key = i.idempotency_key
+    RETURNING user_id, exercise_type, correct_count, wrong_count, total_points, average_time, completed_at
+""", with_sql="""
+    input AS (
+        SELECT DISTINCT ON (idempotency_key) *
+        FROM unnest(%s::text[], %s::int[], %s::text[], %s::int[],
+                    %s::int[], %s::int[], %s::float8[], %s::timestamptz[])
+             AS v (idempotency_key, user_id, exercise_type, correct_count,
+                   wrong_count, total_points, average_time, completed_at)
+    ),
+    fresh AS (
+        INSERT INTO result_idempotency_keys (idempotency_key)
+        SELECT idempotency_key FROM input
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING idempotency_key
+    ),
+""")
+
+
+def results_batch_params(items):
+    """Параметры SAVE_RESULTS_BATCH_SQL: по массиву на столбец"""
+    columns = zip(*[(
+        item["key"],
+        item["user_id"],
+        item["payload"].get("exercise_type", "multiplication_basic"),
+        int(item["payload"].get("correct", 0)),
+        int(item["payload"].get("wrong", 0)),
+        int(item["payload"].get("points", 0)),
+        float(item["payload"].get("avg_time", 0.0)),
+        item["completed_at"],
+    ) for item in items])
+    return [list(c) for c in columns]
+
+
+ATTEMPT_ROW_SQL = "(%s, %s, %s, %s, %s, %s)"
+
+
+def attempts_insert_sql(row_count=None):
+    """
+    Многострочный INSERT ответов (user_id, exercise_type, task_data, user_answer, is_correct, time_spent).
+    row_count=None — «VALUES %s» для execute_values, иначе — плейсхолдеры для row_count строк.
+    """
+    values = "%s" if row_count is None else ", ".join([ATTEMPT_ROW_SQL] * row_count)
+    return f"""
+        INSERT INTO exercise_attempts
+            (user_id, exercise_type, task_data, user_answer, is_correct, time_spent)
+        VALUES {values}
+    """
+
+
+# ---------- статистика ученика ----------
+
+BEST_SCORE_SQL = """
+    SELECT best_points
+    FROM user_exercise_stats
+    WHERE user_id = %s AND exercise_type = %s
+"""
+
+# Итоги по типу упражнения из user_exercise_stats (строка есть всегда). Параметры: user_id, exercise_type
+TOTALS_SQL = """
+    SELECT
+        COALESCE(s.sessions_count, 0) AS total_sessions,
+        COALESCE(s.correct_total, 0)  AS total_correct,
+        COALESCE(s.wrong_total, 0)    AS total_wrong,
+        COALESCE(s.best_points, 0)    AS overall_best,
+        COALESCE(s.time_total / NULLIF(s.timed_sessions, 0), 0) AS avg_time
+    FROM (VALUES (1)) AS one(x)
+    LEFT JOIN user_exercise_stats s
+      ON s.user_id = %(user_id)s AND s.exercise_type = %(exercise_type)s
+"""
+
+# Последние limit результатов типа для графика, от старых к новым, одним json-массивом.
+# Идёт по индексу (user_id, exercise_type, completed_at DESC)
+LAST_ATTEMPTS_SQL = """
+    SELECT COALESCE(json_agg(json_build_object(
+                'label',    to_char(completed_at, 'DD.MM'),
+                'points',   COALESCE(total_points, 0),
+                'correct',  COALESCE(correct_count, 0),
+                'wrong',    COALESCE(wrong_count, 0),
+                'avg_time', COALESCE(average_time, 0)
+            ) ORDER BY completed_at), '[]'::json)
+    FROM (
+        SELECT completed_at, correct_count, wrong_count, total_points, average_time
+        FROM exercise_results
+        WHERE user_id = %(user_id)s AND exercise_type = %(exercise_type)s
+        ORDER BY completed_at DESC
+        LIMIT %(limit)s
+    ) AS typed
+"""
+
+# Последние limit результатов любых типов, от новых к старым, одним json-массивом
+# (индекс idx_exercise_results_user_completed)
+RECENT_RESULTS_SQL = """
+    SELECT COALESCE(json_agg(json_build_object(
+                'created_at',    completed_at,
+                'exercise_type', exercise_type,
+                'points',        COALESCE(total_points, 0),
+                'correct',       COALESCE(correct_count, 0),
+                'wrong',         COALESCE(wrong_count, 0),
+                'avg_time',      COALESCE(average_time, 0)
+            ) ORDER BY completed_at DESC), '[]'::json)
+    FROM (
+        SELECT completed_at, exercise_type, correct_count, wrong_count, total_points, average_time
+        FROM exercise_results
+        WHERE user_id = %(user_id)s
+        ORDER BY completed_at DESC
+        LIMIT %(limit)s
+    ) AS recent
+"""
+
+# Итоги и последние попытки одним запросом
+USER_STATS_SQL = f"""
+    SELECT t.*, ({LAST_ATTEMPTS_SQL}) AS last_attempts
+    FROM ({TOTALS_SQL}) AS t
+"""
+
+# Всё для страницы профиля одним запросом
+PROFILE_SQL = f"""
+    SELECT t.*,
+           ({LAST_ATTEMPTS_SQL}) AS last_attempts,
+           ({RECENT_RESULTS_SQL}) AS recent_results
+    FROM ({TOTALS_SQL}) AS t
+"""
+
+LAST_RESULTS_SQL = """
+    SELECT
+        completed_at AS created_at,
+        COALESCE(total_points, 0)  AS points,
+        COALESCE(correct_count, 0) AS correct,
+        COALESCE(wrong_count, 0)   AS wrong,
+        COALESCE(average_time, 0)  AS avg_time
+    FROM exercise_results
+    WHERE user_id = %s
+    ORDER BY completed_at DESC
+    LIMIT %s
+"""
+
+
+def finish_last_attempts(items):
+    """Дополнить строки LAST_ATTEMPTS_SQL процентом верных ответов"""
+    for item in items:
+        total = item['correct'] + item['wrong']
+        item['percent'] = round(item['correct'] / total * 100.0, 1) if total else 0.0
+        item['avg_time'] = float(item['avg_time'])
+    return items
+
+
+def user_stats_row(totals, last_attempts):
+    """get_user_stats из строки TOTALS_SQL (total_sessions, total_correct, total_wrong, overall_best, ...)"""
+    return {
+        'total_sessions': totals[0] or 0,
+        'total_correct': totals[1] or 0,
+        'total_wrong': totals[2] or 0,
+        'overall_best': totals[3] or 0,
+        'last_attempts': finish_last_attempts(last_attempts),
+    }
+
+
+def profile_row(exercise_type, totals, last_attempts, recent):
+    """get_profile_data из строки TOTALS_SQL и двух json-массивов"""
+    stats = user_stats_row(totals, last_attempts)
+    stats.update({
+        # ключи строки таблицы «Статистика по упражнениям» в profile.html
+        'exercise_type': exercise_type,
+        'correct': stats['total_correct'],
+        'wrong': stats['total_wrong'],
+        'points': stats['overall_best'],
+        'avg_time': round(float(totals[4] or 0.0), 2),
+    })
+    return {'stats': stats, 'recent_results': recent}
+
+
+# ---------- курсы: keyset-пагинация ----------
+
+# Ключи keyset-пагинации: все по возрастанию, последний — id (уникальность).
+# NULLS LAST выражен булевым «IS NULL» перед значением, DESC — сменой знака.
+ROSTER_SORT_KEYS = [
+    "u.last_name IS NULL", "COALESCE(u.last_name, '')",
+    "u.first_name IS NULL", "COALESCE(u.first_name, '')",
+    "u.email", "u.id",
+]
+STATS_SORT_KEYS = {
+    "percent_desc":  ["-percent_correct", "id"],
+    "percent_asc":   ["percent_correct", "id"],
+    "avg_time_desc": ["avg_time IS NULL", "COALESCE(-avg_time, 0)", "id"],
+    "avg_time_asc":  ["avg_time IS NULL", "COALESCE(avg_time, 0)", "id"],
+    "attempts_desc": ["-attempts", "-percent_correct", "id"],
+    "attempts_asc":  ["attempts", "-percent_correct", "id"],
+}
+
+
+def encode_cursor(values):
+    """Курсор keyset-пагинации: значения ключей последней строки страницы, строками"""
+    raw = json.dumps([None if v is None else str(v) for v in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# Ключи с текстовыми и целочисленными (с границей типа) значениями;
+# остальные — числа (numeric/float) или IS NULL
+TEXT_SORT_KEYS = {"COALESCE(u.last_name, '')", "COALESCE(u.first_name, '')", "u.email"}
+INTEGER_SORT_KEYS = {"u.id": 2 ** 31, "id": 2 ** 31, "attempts": 2 ** 63, "-attempts": 2 ** 63}
+
+
+def _check_cursor_value(key, value):
+    """Значение курсора подходит к типу ключа key — иначе БД ответила бы DataError"""
+    if value is None:
+        return
+    if not isinstance(value, str):
+        raise ValueError("Некорректный курсор")
+    if key.endswith(" IS NULL"):
+        valid = value in ("True", "False")
+    elif key in TEXT_SORT_KEYS:
+        valid = "\x00" not in value
+    elif key in INTEGER_SORT_KEYS:
+        digits = value[1:] if value.startswith("-") else value
+        bound = INTEGER_SORT_KEYS[key]
+        valid = digits.isascii() and digits.isdigit() and -bound <= int(value) < bound
+    else:
+        try:
+            valid = math.isfinite(float(value))
+        except ValueError:
+            valid = False
+    if not valid:
+        raise ValueError("Некорректный курсор")
+
+
+def decode_cursor(token, keys):
+    """Значения курсора для ключей сортировки keys; ValueError (-> 400), если курсор подделан"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("Некорректный курсор")
+    for key, value in zip(keys, values):
+        _check_cursor_value(key, value)
+    return values
+
+
+def search_patterns(query):
+    """
+    LIKE-шаблоны поиска по users.search_text: по одному на слово запроса (все должны совпасть),
+    в нижнем регистре и с экранированными % и _. Такие шаблоны обслуживает триграммный GIN-индекс.
+    """
+    words = (query or "").lower().split()
+    return ["%" + w.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%" for w in words]
+
+
+def strip_service_columns(row, key_count):
+    for i in range(key_count):
+        row.pop(f"_k{i}", None)
+    row.pop("_total", None)
+    return row
+
+
+def keyset_page(rows, limit, key_count):
+    """
+    Страница из строк запроса с LIMIT limit + 1: лишняя строка означает, что есть следующая
+    страница, и next_cursor строится по ключам последней показанной строки.
+    """
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([last[f"_k{i}"] for i in range(key_count)])
+    total = rows[0].get("_total") if rows else None
+    return {
+        'students': [strip_service_columns(r, key_count) for r in rows],
+        'next_cursor': next_cursor,
+        'total': total,
+    }
+
+
+def _after_params(params, keys, after):
+    """Значения курсора в params (k0..kN) и условие «строго после курсора» для ключей keys"""
+    params.update(zip([f"k{i}" for i in range(len(keys))], decode_cursor(after, keys)))
+    return f"({', '.join(keys)}) > ({', '.join(f'%(k{i})s' for i in range(len(keys)))})"
+
+
+def course_students_sql(course_id, after=None, limit=None):
+    """Страница списка учеников курса: (sql, params, число ключей), строки — как у keyset_page"""
+    keys = ROSTER_SORT_KEYS
+    params = {'course_id': course_id, 'limit': limit + 1 if limit else None}
+    after_sql = f"AND {_after_params(params, keys, after)}" if after else ""
+    sql = f"""
+        SELECT
+            u.id,
+            u.email,
+            COALESCE(u.first_name, '') AS first_name,
+            COALESCE(u.last_name, '')  AS last_name,
+            ac.assigned_at,
+            {', '.join(f'{k} AS _k{i}' for i, k in enumerate(keys))}
+        FROM assigned_courses ac
+        JOIN users u ON u.id = ac.student_id
+        WHERE ac.course_id = %(course_id)s
+        {after_sql}
+        ORDER BY {', '.join(keys)}
+        {'LIMIT %(limit)s' if limit else ''}
+    """
+    return sql, params, len(keys)
+
+
+def course_stats_sql(course_id, query, date_from, date_to, sort, after=None, limit=None):
+    """
+    Запрос агрегированной статистики учеников курса (keyset-пагинация по ключам сортировки).
+    Возвращает (sql, params, число ключей); в строках — служебные _total (всего строк
+    без учёта курсора) и _k0.._kN (значения ключей для следующего курсора).
+    """
+    params = {'course_id': course_id, 'limit': limit + 1 if limit else None}
+    date_sql = []
+    if date_from:
+        date_sql.append("d.day >= %(date_from)s::date")
+        params['date_from'] = date_from
+    if date_to:
+        date_sql.append("d.day < %(date_to)s::date")
+        params['date_to'] = date_to
+
+    # Поиск по users.search_text (ФИО + e-mail в нижнем регистре) — через триграммный индекс
+    patterns = search_patterns(query)
+    params.update((f"q{i}", p) for i, p in enumerate(patterns))
+    search_sql = "".join(f" AND u.search_text LIKE %(q{i})s" for i in range(len(patterns)))
+
+    keys = STATS_SORT_KEYS.get(sort or "percent_desc", STATS_SORT_KEYS["percent_desc"])
+    after_sql = f"WHERE {_after_params(params, keys, after)}" if after else ""
+
+    sql = f"""
+        WITH daily AS (
+            SELECT
+                d.user_id,
+                SUM(d.attempts)       AS attempts,
+                SUM(d.correct_total)  AS total_correct,
+                SUM(d.wrong_total)    AS total_wrong,
+                SUM(d.time_total)     AS time_total,
+                SUM(d.timed_sessions) AS timed_sessions
+            FROM assigned_courses ac
+            JOIN user_daily_stats d ON d.user_id = ac.student_id
+            WHERE ac.course_id = %(course_id)s
+            {('AND ' + ' AND '.join(date_sql)) if date_sql else ''}
+            GROUP BY d.user_id
+        ),
+        stats AS (
+            SELECT
+                u.id,
+                u.email,
+                COALESCE(u.first_name,'') AS first_name,
+                COALESCE(u.last_name,'')  AS last_name,
+                COALESCE(d.attempts,0)      AS attempts,
+                COALESCE(d.total_correct,0) AS total_correct,
+                COALESCE(d.total_wrong,0)   AS total_wrong,
+                CASE
+                  WHEN COALESCE(d.total_correct + d.total_wrong,0) > 0
+                  THEN ROUND( (d.total_correct::decimal * 100.0) /
+                             (d.total_correct + d.total_wrong), 2)
+                  ELSE 0
+                END AS percent_correct,
+                ROUND((d.time_total / NULLIF(d.timed_sessions,0))::numeric, 2) AS avg_time
+            FROM assigned_courses ac
+            JOIN users u ON u.id = ac.student_id
+            LEFT JOIN daily d ON d.user_id = u.id
+            WHERE ac.course_id = %(course_id)s
+            {search_sql}
+        )
+        SELECT *, {', '.join(f'{k} AS _k{i}' for i, k in enumerate(keys))}
+        FROM (SELECT *, COUNT(*) OVER () AS _total FROM stats) AS page
+        {after_sql}
+        ORDER BY {', '.join(keys)}
+        {'LIMIT %(limit)s' if limit else ''}
+    """
+    return sql, params, len(keys)
+
+
+def course_search_sql(course_id, query, limit):
+    """
+    Подсказки поиска учеников курса: (sql, params) или None для пустого запроса.
+    Не больше limit совпадений по ФИО или e-mail, самые похожие (similarity) — первыми.
+    """
+    patterns = search_patterns(query)
+    if not patterns:
+        return None
+    params = {'course_id': course_id, 'q': ' '.join(query.lower().split()), 'limit': limit}
+    params.update((f"q{i}", p) for i, p in enumerate(patterns))
+    sql = f"""
+        SELECT
+            u.id,
+            u.email,
+            COALESCE(u.first_name, '') AS first_name,
+            COALESCE(u.last_name, '')  AS last_name
+        FROM users u
+        JOIN assigned_courses ac
+          ON ac.student_id = u.id AND ac.course_id = %(course_id)s
+        WHERE {' AND '.join(f"u.search_text LIKE %(q{i})s" for i in range(len(patterns)))}
+        ORDER BY similarity(u.search_text, %(q)s) DESC, u.last_name, u.id
+        LIMIT %(limit)s
+    """
+    return sql, params
+
+
+# ---------- курсы: состав ----------
+
+# Параметры: student_id, course_id, course_id
+REMOVE_STUDENT_SQL = """
+    WITH removed AS (
+        DELETE FROM assigned_courses
+        WHERE student_id = %s AND course_id = %s
+        RETURNING 1
+    )
+    -- подзапрос видит снимок до удаления, поэтому вычитаем удалённое
+    SELECT (SELECT COUNT(*) FROM removed) AS removed,
+           (SELECT COUNT(*) FROM assigned_courses WHERE course_id = %s) AS before
+"""
+
+# Параметры: ids, course_id, assigned_by
+ASSIGN_STUDENTS_SQL = """
+    WITH input AS (
+        SELECT DISTINCT unnest(%(ids)s::int[]) AS student_id
+    ),
+    valid AS (
+        SELECT i.student_id
+        FROM input i
+        JOIN users u ON u.id = i.student_id AND u.role = 'student'
+    ),
+    inserted AS (
+        INSERT INTO assigned_courses (student_id, course_id, assigned_by)
+        SELECT student_id, %(course_id)s, %(assigned_by)s FROM valid
+        ON CONFLICT (student_id, course_id) DO NOTHING
+        RETURNING student_id
+    )
+    SELECT i.student_id,
+           CASE
+             WHEN ins.student_id IS NOT NULL THEN 'assigned'
+             WHEN v.student_id IS NOT NULL THEN 'already_assigned'
+             ELSE 'not_found'
+           END AS status
+    FROM input i
+    LEFT JOIN valid v ON v.student_id = i.student_id
+    LEFT JOIN inserted ins ON ins.student_id = i.student_id
+    ORDER BY i.student_id
+"""
+
+# Параметры: ids, course_id
+REMOVE_STUDENTS_SQL = """
+    WITH input AS (
+        SELECT DISTINCT unnest(%(ids)s::int[]) AS student_id
+    ),
+    removed AS (
+        DELETE FROM assigned_courses
+        WHERE course_id = %(course_id)s AND student_id IN (SELECT student_id FROM input)
+        RETURNING student_id
+    )
+    SELECT i.student_id,
+           CASE WHEN r.student_id IS NOT NULL THEN 'removed' ELSE 'not_assigned' END AS status,
+           -- подзапрос видит снимок до удаления
+           (SELECT COUNT(*) FROM assigned_courses WHERE course_id = %(course_id)s)
+             - (SELECT COUNT(*) FROM removed) AS remaining
+    FROM input i
+    LEFT JOIN removed r ON r.student_id = i.student_id
+    ORDER BY i.student_id
+"""
+
+# Параметры: emails, first_names, last_names, course_id, assigned_by
+IMPORT_STUDENTS_SQL = """
+    WITH input AS (
+        SELECT DISTINCT ON (email) email, first_name, last_name, invite_hash, ord
+        FROM unnest(%(emails)s::text[], %(first_names)s::text[], %(last_names)s::text[],
+                    %(invite_hashes)s::text[])
+             WITH ORDINALITY AS t(email, first_name, last_name, invite_hash, ord)
+        ORDER BY email, ord
+    ),
+    created AS (
+        INSERT INTO users (email, password_hash, role, first_name, last_name, invite_hash)
+        SELECT email, '', 'student', first_name, last_name, invite_hash FROM input
+        ON CONFLICT (email) DO NOTHING
+        RETURNING id, email
+    ),
+    matched AS (
+        -- users здесь — снимок до запроса: новых строк в нём нет, они в created
+        SELECT i.email, i.ord,
+               COALESCE(c.id, u.id) AS student_id,
+               c.id IS NOT NULL AS is_new,
+               COALESCE(u.role, 'student') AS role
+        FROM input i
+        LEFT JOIN created c ON c.email = i.email
+        LEFT JOIN users u ON u.email = i.email
+    ),
+    inserted AS (
+        INSERT INTO assigned_courses (student_id, course_id, assigned_by)
+        SELECT student_id, %(course_id)s, %(assigned_by)s
+        FROM matched
+        WHERE role = 'student' AND student_id IS NOT NULL
+        ON CONFLICT (student_id, course_id) DO NOTHING
+        RETURNING student_id
+    )
+    SELECT m.email, m.student_id,
+           CASE
+             WHEN m.student_id IS NULL THEN 'not_found'  -- создан параллельным запросом
+             WHEN m.role <> 'student' THEN 'not_student'
+             WHEN m.is_new THEN 'created'
+             WHEN ins.student_id IS NOT NULL THEN 'assigned'
+             ELSE 'already_assigned'
+           END AS status
+    FROM matched m
+    LEFT JOIN inserted ins ON ins.student_id = m.student_id
+    ORDER BY m.ord
+"""
+
+
+def import_students_params(course_id, students, assigned_by):
+    return {
+        'emails': [s['email'] for s in students],
+        'first_names': [s.get('first_name') or '' for s in students],
+        'last_names': [s.get('last_name') or '' for s in students],
+        'invite_hashes': [s.get('invite_hash') for s in students],
+        'course_id': course_id,
+        'assigned_by': assigned_by,
+    }
@@ -0,0 +1,318 @@
+import atexit
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import psycopg2
+
+from config import Config
+from database import db
+from leaderboard import leaderboard
+from pool import PoolTimeout
+
+# Ошибки, после которых пачку имеет смысл повторить: БД недоступна или пул исчерпан.
+# Остальные (IntegrityError, DataError, ...) не пройдут и при повторе.
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout)
+
+
+class ResultWriter:
+    """
+    Отложенная (write-behind) запись результатов тренировок.
+
+    Поток запроса только кладёт результат в очередь (enqueue), фоновый поток пачками
+    сохраняет его в БД через save_batch с повторами. Каждый результат несёт ключ
+    идемпотентности, так что повтор пачки после «потерянного» COMMIT не создаёт дублей.
+    Если Postgres недоступен, пачка дописывается в локальный spool-файл (JSON Lines)
+    и досылается, когда БД снова отвечает.
+
+    Пачка, отвергнутая БД по другой причине (например, ученик удалён — нарушение FK),
+    сохраняется по одному результату; непрошедшие уходят в dead-letter файл и больше не повторяются.
+    Spool-файл может быть общим для нескольких процессов (воркеры gunicorn): дописывание и
+    досылка защищены блокировками flock на <spool>.lock и <spool>.replay.lock.
+    """
+
+    def __init__(self, save_batch, spool_path, batch_size=100, flush_interval=1.0,
+                 max_retries=3, retry_backoff=0.5, max_queue=10000, spool_retry_interval=30.0,
+                 on_saved=None, dead_letter_path=None):
+        self.save_batch = save_batch
+        self.on_saved = on_saved    # вызывается с пачкой после успешной записи (рейтинги и т.п.)
+        self.spool_path = spool_path
+        self.dead_letter_path = dead_letter_path or spool_path + '.dead'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.spool_retry_interval = spool_retry_interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_spool_attempt = 0.0
+
+        # Метрики
+        self._enqueued = 0
+        self._saved = 0
+        self._spooled = 0
+        self._retries = 0
+        self._failed_batches = 0
+        self._dead = 0
+        self._flushes = 0
+        self._flush_seconds_total = 0.0
+        self._last_flush_ms = 0.0
+        self._last_error = None
+
+    # ---------- поток запроса ----------
+    def enqueue(self, user_id: int, payload: dict, key: str | None = None):
+        """Поставить результат в очередь на запись; возвращает ключ идемпотентности."""
+        item = {
+            'key': f"{user_id}:{key or uuid.uuid4().hex}",
+            'user_id': user_id,
+            'payload': payload,
+            # Время с часовым поясом: БД переведёт его в свой, как NOW() при прямой записи
+            'completed_at': datetime.now(timezone.utc).isoformat(timespec='microseconds'),
+        }
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Очередь переполнена — сразу на диск, результат не теряем
+            self._spool([item])
+        with self._metrics_lock:
+            self._enqueued += 1
+        return item['key']
+
+    # ---------- фоновый поток ----------
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+            self._thread.start()
+
+    def _count_spooled(self):
+        total = 0
+        for path in (self.spool_path, self.spool_path + '.replay'):
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    total += sum(1 for line in f if line.strip())
+        with self._metrics_lock:
+            self._spooled = total
+
+    def _run(self):
+        self._count_spooled()
+        self._safe_replay()
+        while not self._stop.is_set():
+            batch = self._collect(self.flush_interval)
+            if batch:
+                self._flush(batch)
+            if time.monotonic() - self._last_spool_attempt >= self.spool_retry_interval:
+                self._safe_replay()
+        # Останов: дописываем всё, что осталось в очереди
+        while True:
+            batch = self._collect(0)
+            if not batch:
+                break
+            self._flush(batch)
+
+    def _collect(self, timeout):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait())
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _save(self, batch):
+        started = time.perf_counter()
+        self.save_batch(batch)
+        elapsed = time.perf_counter() - started
+        with self._metrics_lock:
+            self._saved += len(batch)
+            self._flushes += 1
+            self._flush_seconds_total += elapsed
+            self._last_flush_ms = round(elapsed * 1000, 2)
+        if self.on_saved is not None:
+            try:
+                self.on_saved(batch)
+            except Exception as e:
+                print(f"Result writer: ошибка обработчика on_saved: {e}")
+
+    def _save_with_retry(self, batch):
+        """Записать пачку; возвращает результаты, которые не удалось записать из-за недоступной БД."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._save(batch)
+                return []
+            except TRANSIENT_ERRORS as e:
+                with self._metrics_lock:
+                    self._last_error = str(e)
+                    if attempt < self.max_retries:
+                        self._retries += 1
+                if attempt < self.max_retries and not self._stop.is_set():
+                    time.sleep(self.retry_backoff * (2 ** attempt))
+            except Exception as e:
+                with self._metrics_lock:
+                    self._last_error = str(e)
+                return self._save_one_by_one(batch, e)
+        return batch
+
+    def _save_one_by_one(self, batch, error):
+        """Пачку отвергли данные: пишем по одному, плохие результаты — в dead-letter файл."""
+        if len(batch) == 1:
+            self._dead_letter(batch[0], error)
+            return []
+        for i, item in enumerate(batch):
+            try:
+                self._save([item])
+            except TRANSIENT_ERRORS as e:
+                with self._metrics_lock:
+                    self._last_error = str(e)
+                return batch[i:]
+            except Exception as e:
+                self._dead_letter(item, e)
+        return []
+
+    def _flush(self, batch):
+        left = self._save_with_retry(batch)
+        if left:
+            print(f"Result writer: БД недоступна, {len(left)} результатов отложено в {self.spool_path}")
+            with self._metrics_lock:
+                self._failed_batches += 1
+            self._spool(left)
+
+    # ---------- spool-файл ----------
+    @contextmanager
+    def _file_lock(self, suffix, blocking=True):
+        """Межпроцессная блокировка flock на <spool_path><suffix>; без blocking — None, если занято."""
+        with open(self.spool_path + suffix, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield None
+                return
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _append(self, path, items):
+        # Дописываем под flock: другой процесс не переименует файл посреди записи
+        with self._spool_lock, self._file_lock('.lock'):
+            with open(path, 'a', encoding='utf-8') as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _spool(self, items):
+        self._append(self.spool_path, items)
+        with self._metrics_lock:
+            self._spooled += len(items)
+
+    def _dead_letter(self, item, error):
+        print(f"Result writer: результат {item.get('key')} отвергнут БД ({error}), записан в {self.dead_letter_path}")
+        self._append(self.dead_letter_path, [dict(item, error=str(error))])
+        with self._metrics_lock:
+            self._dead += 1
+
+    def _safe_replay(self):
+        try:
+            self._replay_spool()
+        except Exception as e:
+            print(f"Result writer: ошибка досылки spool-файла: {e}")
+            with self._metrics_lock:
+                self._last_error = str(e)
+
+    def _replay_spool(self):
+        """Дослать результаты из spool-файла. Не записанные из-за недоступной БД вернутся в файл."""
+        self._last_spool_attempt = time.monotonic()
+        replay_path = self.spool_path + '.replay'
+        with self._file_lock('.replay.lock', blocking=False) as locked:
+            if locked is None:
+                return   # досылает другой процесс
+            with self._spool_lock, self._file_lock('.lock'):
+                if not os.path.exists(replay_path):
+                    if not os.path.exists(self.spool_path):
+                        return
+                    os.replace(self.spool_path, replay_path)
+
+            items = []
+            try:
+                with open(replay_path, encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            items.append(json.loads(line))
+                        except ValueError:
+                            print(f"Result writer: пропущена повреждённая строка spool-файла: {line[:80]}")
+            except FileNotFoundError:
+                return   # уже дослан
+
+            failed = []
+            for i in range(0, len(items), self.batch_size):
+                failed.extend(self._save_with_retry(items[i:i + self.batch_size]))
+
+            with self._metrics_lock:
+                self._spooled -= len(items)
+            if failed:
+                self._spool(failed)
+            try:
+                os.remove(replay_path)
+            except FileNotFoundError:
+                pass
+
+    # ---------- управление и метрики ----------
+    def stop(self, timeout=10.0):
+        """Остановить фоновый поток, дописав очередь в БД (или в spool)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'enqueued': self._enqueued,
+                'saved': self._saved,
+                'spooled_pending': self._spooled,
+                'retries': self._retries,
+                'failed_batches': self._failed_batches,
+                'dead_letters': self._dead,
+                'flushes': self._flushes,
+                'last_flush_ms': self._last_flush_ms,
+                'avg_flush_ms': round(self._flush_seconds_total / self._flushes * 1000, 2) if self._flushes else 0.0,
+                'last_error': self._last_error,
+            }
+
+
+# Глобальный экземпляр
+result_writer = ResultWriter(
+    db.save_exercise_results_batch,
+    Config.RESULT_SPOOL_PATH,
+    batch_size=Config.RESULT_QUEUE_BATCH_SIZE,
+    flush_interval=Config.RESULT_QUEUE_FLUSH_INTERVAL,
+    max_retries=Config.RESULT_QUEUE_MAX_RETRIES,
+    max_queue=Config.RESULT_QUEUE_MAX_SIZE,
+    on_saved=leaderboard.record_results,
+    dead_letter_path=Config.RESULT_DEAD_LETTER_PATH,
+)
+atexit.register(result_writer.stop)
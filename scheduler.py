@@ -0,0 +1,290 @@
+import math
+import random
+import threading
+from array import array
+from collections import OrderedDict
+
+from config import Config
+from database import db
+from fenwick import FenwickTree
+from tasks import task_generator
+
+# Веса фактов при выборе следующей задачи
+NEW_WEIGHT = 1.0       # факт ещё не встречался
+REVIEW_WEIGHT = 0.2    # выученный факт изредка повторяется
+ERROR_WEIGHT = 4.0     # × доля ошибок (EWMA)
+SLOW_WEIGHT = 1.0      # × насколько ответ медленнее target_time (0..2)
+EWMA_ALPHA = 0.3       # вес нового ответа в скользящих средних
+REPEAT_DAMPING = 0.25  # вес уже выбранного в этом раунде факта до конца раунда
+NEW_FACT_TRIES = 64    # попыток случайно найти ещё не встречавшийся факт до полного перебора
+
+# Память MasteryState (замер tracemalloc, CPython 3.11, 64 бит): пустое состояние и один
+# встреченный факт (запись в slots, четыре массива по 4 байта и два массива дерева по 8 байт).
+# История из 2000 ответов по arithmetic_advanced — около 1900 фактов, ~240 КБ
+STATE_BYTES = 1536
+SLOT_BYTES = 128
+
+
+class MasteryState:
+    """
+    Освоенность фактов одного типа упражнения для одного ученика.
+    Факт — (операция, a, b) в пределах [min, max] типа. Память заводится только под факты,
+    которые ученик уже встречал (или получил в раунде): для каждого — число ответов, доля ошибок
+    и время ответа (EWMA) и вес в дереве Фенвика. Остальные факты равноправны (NEW_WEIGHT)
+    и выбираются равномерно без хранения, так что размер состояния растёт с историей ученика,
+    а не с len(operators) × span².
+    """
+
+    def __init__(self, cfg, target_time, history=()):
+        self.cfg = cfg
+        self.lo = cfg['min']
+        self.span = cfg['max'] - cfg['min'] + 1
+        self.operators = list(cfg['operators'])
+        self.target_time = target_time
+        # Число допустимых фактов по операциям: вычитание — только «большее минус меньшее»
+        self.op_facts = [self.span * (self.span + 1) // 2 if op == '-' else self.span * self.span
+                         for op in self.operators]
+        self.facts = sum(self.op_facts)
+        self.slots = {}              # номер факта -> слот
+        self.indexes = array('I')    # слот -> номер факта
+        self.seen = array('I')
+        self.error = array('f')
+        self.time = array('f')
+        self.fenwick = None
+        # История — [{task_data, is_correct, time_spent}] от старых к новым; дерево строим один раз после
+        for item in history:
+            index = self.index(item.get('task_data'))
+            if index is not None:
+                self._observe(self._slot(index), item.get('is_correct'), item.get('time_spent'))
+        self.fenwick = FenwickTree([self._weight(slot) for slot in range(len(self.indexes))])
+        self.lock = threading.Lock()
+
+    def index(self, task):
+        """Номер факта для задачи {a, b, op} или None, если она вне диапазона типа"""
+        try:
+            a, b, op = int(task['a']) - self.lo, int(task['b']) - self.lo, task.get('op') or '*'
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None
+        if op not in self.operators or not (0 <= a < self.span and 0 <= b < self.span):
+            return None
+        if op == '-' and a < b:
+            return None   # вычитание всегда «большее минус меньшее» (TaskGenerator.make_task)
+        return (self.operators.index(op) * self.span + a) * self.span + b
+
+    def fact(self, index):
+        op_index, rest = divmod(index, self.span * self.span)
+        a, b = divmod(rest, self.span)
+        return a + self.lo, b + self.lo, self.operators[op_index]
+
+    def footprint(self):
+        """Примерный объём состояния в памяти, байт"""
+        return STATE_BYTES + SLOT_BYTES * len(self.indexes)
+
+    def _slot(self, index):
+        slot = self.slots.get(index)
+        if slot is None:
+            slot = self.slots[index] = len(self.indexes)
+            self.indexes.append(index)
+            self.seen.append(0)
+            self.error.append(0.0)
+            self.time.append(0.0)
+            if self.fenwick is not None:
+                self.fenwick.append(NEW_WEIGHT)
+        return slot
+
+    def _weight(self, slot):
+        if not self.seen[slot]:
+            return NEW_WEIGHT
+        slow = min(max(self.time[slot] / self.target_time - 1.0, 0.0), 2.0) if self.target_time else 0.0
+        return REVIEW_WEIGHT + ERROR_WEIGHT * self.error[slot] + SLOW_WEIGHT * slow
+
+    def _observe(self, slot, is_correct, time_spent):
+        # Время без смысла (NaN, inf, <= 0) в EWMA не пускаем: NaN-вес испортил бы всё дерево
+        if not (isinstance(time_spent, (int, float)) and 0 < time_spent < math.inf):
+            time_spent = None
+        miss = 0.0 if is_correct else 1.0
+        if self.seen[slot]:
+            self.error[slot] += EWMA_ALPHA * (miss - self.error[slot])
+            if time_spent:
+                self.time[slot] += EWMA_ALPHA * (time_spent - self.time[slot])
+        else:
+            self.error[slot] = miss
+            self.time[slot] = time_spent or 0.0
+        self.seen[slot] = min(self.seen[slot] + 1, 2 ** 32 - 1)
+
+    def observe(self, index, is_correct, time_spent):
+        """Учесть ответ и обновить вес факта в дереве"""
+        slot = self._slot(index)
+        self._observe(slot, is_correct, time_spent)
+        self.fenwick.set(slot, self._weight(slot))
+
+    def _nth(self, k):
+        """k-й допустимый факт (0 <= k < facts) -> номер факта"""
+        for op_index, count in enumerate(self.op_facts):
+            if k < count:
+                break
+            k -= count
+        if self.operators[op_index] == '-':
+            a = (math.isqrt(8 * k + 1) - 1) // 2   # k-я пара b <= a в треугольнике
+            b = k - a * (a + 1) // 2
+        else:
+            a, b = divmod(k, self.span)
+        return (op_index * self.span + a) * self.span + b
+
+    def _new_fact(self, rng):
+        """Равномерно выбранный факт без слота"""
+        for _ in range(NEW_FACT_TRIES):
+            index = self._nth(rng.randrange(self.facts))
+            if index not in self.slots:
+                return index
+        # Почти все факты уже встречались — перебираем оставшиеся
+        rest = [index for index in map(self._nth, range(self.facts)) if index not in self.slots]
+        return rng.choice(rest) if rest else None
+
+    def draw(self, n, rng):
+        """n фактов взвешенной выборкой; уже выбранные до конца раунда реже (REPEAT_DAMPING)"""
+        fenwick = self.fenwick
+        damped = {}
+        facts = []
+        for _ in range(n):
+            new_total = (self.facts - len(self.indexes)) * NEW_WEIGHT
+            total = new_total + fenwick.total()
+            if total <= 0:
+                break
+            if rng.random() * total < new_total:
+                # Новый факт получает слот с весом NEW_WEIGHT — иначе его не приглушить до конца раунда
+                index = self._new_fact(rng)
+                slot = None if index is None else self._slot(index)
+            else:
+                slot = fenwick.sample(rng)
+            if slot is None:
+                break
+            if slot not in damped:
+                damped[slot] = fenwick.weights[slot]
+            fenwick.set(slot, fenwick.weights[slot] * REPEAT_DAMPING)
+            facts.append(self.fact(self.indexes[slot]))
+        for slot, weight in damped.items():
+            fenwick.set(slot, weight)
+        return facts
+
+
+class AdaptiveScheduler:
+    """
+    Подбор задач по истории ответов ученика: чаще — факты с ошибками и медленными ответами,
+    иногда — новые, изредка — уже выученные.
+
+    Состояние (MasteryState) загружается лениво из последних history ответов в exercise_attempts
+    при первой задаче ученика этого типа и дальше обновляется по каждому пакету /api/attempts.
+    В памяти держится не больше max_states состояний общим объёмом не больше max_bytes
+    (оценка MasteryState.footprint); вытесняются давно не использованные.
+    Выбор одной задачи — O(log n) по дереву Фенвика, так что раунд из TASK_BATCH_MAX задач
+    собирается за доли миллисекунды.
+    """
+
+    def __init__(self, load_history, generator, max_states=2000, max_bytes=64 * 2 ** 20,
+                 history=2000, target_time=3.0):
+        self.load_history = load_history
+        self.generator = generator
+        self.max_states = max_states
+        self.max_bytes = max_bytes
+        self.history = history
+        self.target_time = target_time
+        self._states = OrderedDict()   # (user_id, exercise_type) -> MasteryState
+        self._lock = threading.Lock()
+
+        # Метрики
+        self._loads = 0
+        self._hits = 0
+        self._evictions = 0
+        self._observed = 0
+        self._bytes = 0
+
+    def _get(self, key):
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+                self._hits += 1
+            return state
+
+    def _state(self, user_id, exercise_type):
+        cfg = self.generator.config(exercise_type)
+        key = (user_id, exercise_type)
+        state = self._get(key)
+        if state is not None and state.cfg == cfg:
+            return state
+
+        # Загрузка вне общей блокировки; при гонке победит последняя — история у них одна
+        try:
+            history = self.load_history(user_id, exercise_type, self.history)
+        except Exception as e:
+            print(f"Scheduler: не удалось загрузить историю ответов: {e}")
+            return None
+        state = MasteryState(cfg, self.target_time, history)
+        with self._lock:
+            self._states[key] = state
+            self._states.move_to_end(key)
+            self._loads += 1
+            # Состояния растут с каждым ответом — пересчитываем объём при загрузке, а не храним
+            self._bytes = sum(s.footprint() for s in self._states.values())
+            while len(self._states) > 1 and (len(self._states) > self.max_states or self._bytes > self.max_bytes):
+                _, evicted = self._states.popitem(last=False)
+                self._bytes -= evicted.footprint()
+                self._evictions += 1
+        return state
+
+    def generate(self, user_id, exercise_type='multiplication_basic', n=1, rng=random):
+        """Список из n задач для ученика (формат TaskGenerator.generate)"""
+        state = self._state(user_id, exercise_type)
+        if state is None:
+            return self.generator.generate(exercise_type, n, rng)
+        with state.lock:
+            facts = state.draw(n, rng)
+        if len(facts) < n:
+            return self.generator.generate(exercise_type, n, rng)
+        return [self.generator.make_task(a, b, op) for a, b, op in facts]
+
+    def record(self, user_id, attempts):
+        """
+        Учесть новые ответы (строки validate_attempt). Незагруженные состояния не трогаем:
+        при первой загрузке эти ответы прочитаются из exercise_attempts.
+        """
+        for attempt in attempts:
+            state = self._get((user_id, attempt['exercise_type']))
+            if state is None:
+                continue
+            index = state.index(attempt['task_data'])
+            if index is None:
+                continue
+            with state.lock:
+                state.observe(index, attempt['is_correct'], attempt['time_spent'])
+            with self._lock:
+                self._observed += 1
+
+    def forget(self, user_id=None):
+        """Сбросить состояния (одного ученика или все) — перечитаются из БД"""
+        with self._lock:
+            for key in [k for k in self._states if user_id is None or k[0] == user_id]:
+                del self._states[key]
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'states': len(self._states),
+                'bytes': self._bytes,
+                'loads': self._loads,
+                'hits': self._hits,
+                'evictions': self._evictions,
+                'observed': self._observed,
+            }
+
+
+# Глобальный экземпляр
+scheduler = AdaptiveScheduler(
+    db.get_recent_attempts,
+    task_generator,
+    max_states=Config.SCHEDULER_MAX_STATES,
+    max_bytes=Config.SCHEDULER_MAX_MEMORY_MB * 2 ** 20,
+    history=Config.SCHEDULER_HISTORY,
+    target_time=Config.SCHEDULER_TARGET_TIME,
+)
@@ -0,0 +1,270 @@
+import atexit
+import copy
+import hashlib
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import MISSING, MemoryCache
+from config import Config
+from database import db
+
+
+class DatabaseSession(CallbackDict, SessionMixin):
+    """Flask session, содержимое которой хранится в user_sessions; в cookie — только токен"""
+
+    def __init__(self, initial=None, token=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.token = token
+        self.expires_at = expires_at
+        self.new = token is None
+        self.modified = False
+        self.regenerate_token = False
+
+    def regenerate(self):
+        """Выдать новый токен при сохранении (вход, смена роли); прежний перестанет действовать"""
+        self.regenerate_token = True
+        self.modified = True
+
+
+def regenerate_session(session):
+    """Новый токен серверной сессии; подписанной cookie (SESSION_BACKEND=cookie) это не нужно"""
+    regenerate = getattr(session, 'regenerate', None)
+    if regenerate is not None:
+        regenerate()
+
+
+class DatabaseSessionInterface(SessionInterface):
+    """
+    Серверные сессии в таблице user_sessions.
+
+    Чтение идёт через кеш в процессе (TTL SESSION_CACHE_TTL), так что большинство запросов
+    не обращаются к БД. Изменённая сессия записывается сразу; скользящее продление срока
+    (не чаще раза в touch_interval) копится и пишется фоновым потоком одним UPDATE на пачку.
+    Тот же поток периодически удаляет истёкшие сессии порциями по sweep_batch строк.
+    При нескольких процессах изменения (в том числе logout) видны в других не позже cache_ttl.
+    """
+
+    def __init__(self, store, cache_ttl=30.0, cache_maxsize=10000, touch_interval=300.0,
+                 flush_interval=5.0, sweep_interval=300.0, sweep_batch=1000):
+        self.store = store
+        self.cache = MemoryCache(maxsize=cache_maxsize, ttl=cache_ttl)
+        self.touch_interval = timedelta(seconds=touch_interval)
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+
+        self._pending = {}              # token_hash -> новый expires_at
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_sweep = time.monotonic()
+
+        # Метрики
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._touches = 0
+        self._swept = 0
+        self._last_error = None
+
+    @staticmethod
+    def _hash(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    # ---------- Flask SessionInterface ----------
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        if token:
+            entry = self._load(self._hash(token))
+            if entry is not None and entry['expires_at'] > datetime.now():
+                # Копия: сессию запроса меняют, а запись кеша общая для потоков
+                return DatabaseSession(copy.deepcopy(entry['data']), token, entry['expires_at'])
+        return DatabaseSession()
+
+    def save_session(self, app, session, response):
+        self._ensure_started()
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            # Пустая сессия (например, после logout): удаляем запись и cookie
+            if session.modified and session.token:
+                self._delete(session.token)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = datetime.now()
+        expires_at = now + app.permanent_session_lifetime
+        if session.modified or session.new:
+            if session.regenerate_token and session.token:
+                # Защита от фиксации сессии: токен, известный до входа, больше не действует
+                self._delete(session.token)
+                session.token = None
+            token = session.token or secrets.token_urlsafe(32)
+            token_hash = self._hash(token)
+            data = dict(session)
+            user_id = (data.get('user') or {}).get('id')
+            try:
+                self.store.save_session(token_hash, user_id, data, expires_at)
+            except Exception as e:
+                # Без записи в БД сессия не переживёт запрос — cookie не выдаём
+                print(f"Session save error: {e}")
+                with self._lock:
+                    self._last_error = str(e)
+                return
+            self.cache.set(token_hash, {'data': copy.deepcopy(data), 'expires_at': expires_at})
+            with self._lock:
+                self._writes += 1
+                self._pending.pop(token_hash, None)
+        else:
+            token = session.token
+            # Скользящий срок: продлеваем, только если с прошлого продления прошло touch_interval
+            if session.expires_at and expires_at - session.expires_at >= self.touch_interval:
+                self._touch(self._hash(token), session, expires_at)
+            else:
+                expires_at = session.expires_at
+
+        if not self.should_set_cookie(app, session) and not session.new:
+            return
+        response.set_cookie(
+            name, token,
+            expires=expires_at if session.permanent else None,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    # ---------- кеш и БД ----------
+    def _delete(self, token):
+        token_hash = self._hash(token)
+        try:
+            self.store.delete_session(token_hash)
+        except Exception as e:
+            print(f"Session delete error: {e}")
+        self.cache.set(token_hash, None)
+        with self._lock:
+            self._pending.pop(token_hash, None)
+
+    def _load(self, token_hash):
+        entry = self.cache.get(token_hash)
+        if entry is not MISSING:
+            with self._lock:
+                self._hits += 1
+            return entry
+        with self._lock:
+            self._misses += 1
+        try:
+            row = self.store.load_session(token_hash)
+        except Exception as e:
+            print(f"Session load error: {e}")
+            return None
+        entry = {'data': row[0], 'expires_at': row[1]} if row else None
+        # Неизвестный токен тоже кешируем — повторы с ним не ходят в БД
+        self.cache.set(token_hash, entry)
+        return entry
+
+    def _touch(self, token_hash, session, expires_at):
+        session.expires_at = expires_at
+        self.cache.set(token_hash, {'data': copy.deepcopy(dict(session)), 'expires_at': expires_at})
+        with self._lock:
+            self._pending[token_hash] = expires_at
+
+    # ---------- фоновый поток ----------
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="session-maintenance", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            if time.monotonic() - self._last_sweep >= self.sweep_interval:
+                self.sweep()
+        self.flush()
+
+    def flush(self):
+        """Записать накопленные продления сроков одним запросом"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self.store.touch_sessions(list(pending.items()))
+        except Exception as e:
+            print(f"Session touch error: {e}")
+            with self._lock:
+                self._last_error = str(e)
+                # вернуть в очередь, если за это время не появилось более свежих продлений
+                for token_hash, expires_at in pending.items():
+                    self._pending.setdefault(token_hash, expires_at)
+            return 0
+        with self._lock:
+            self._touches += len(pending)
+        return len(pending)
+
+    def sweep(self):
+        """Удалить истёкшие сессии порциями, чтобы не держать долгих блокировок"""
+        self._last_sweep = time.monotonic()
+        now = datetime.now()
+        total = 0
+        try:
+            while not self._stop.is_set():
+                deleted = self.store.delete_expired_sessions(now, self.sweep_batch)
+                total += deleted
+                if deleted < self.sweep_batch:
+                    break
+        except Exception as e:
+            print(f"Session sweep error: {e}")
+            with self._lock:
+                self._last_error = str(e)
+        with self._lock:
+            self._swept += total
+        return total
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'cache_hits': self._hits,
+                'cache_misses': self._misses,
+                'cached': len(self.cache),
+                'writes': self._writes,
+                'pending_touches': len(self._pending),
+                'touches': self._touches,
+                'swept': self._swept,
+                'last_error': self._last_error,
+            }
+
+
+# Глобальный экземпляр
+session_interface = DatabaseSessionInterface(
+    db,
+    cache_ttl=Config.SESSION_CACHE_TTL,
+    cache_maxsize=Config.SESSION_CACHE_MAXSIZE,
+    touch_interval=Config.SESSION_TOUCH_INTERVAL,
+    flush_interval=Config.SESSION_FLUSH_INTERVAL,
+    sweep_interval=Config.SESSION_SWEEP_INTERVAL,
+    sweep_batch=Config.SESSION_SWEEP_BATCH,
+)
+atexit.register(session_interface.stop)
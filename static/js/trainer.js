@@ -1,99 +1,166 @@
-let a, b;
-let correct = 0;
-let wrong = 0;
-let points = 0;
-let timer = 10;
-let timerId = null;
-let started = false; // флаг — игра началась или нет
-
-const problemEl = document.getElementById("problem");
-const answerEl = document.getElementById("answer");
-const timerEl = document.getElementById("timer");
-const correctEl = document.getElementById("correct");
-const wrongEl = document.getElementById("wrong");
-const pointsEl = document.getElementById("points");
-
-// Генерация новой задачи
-function newTask() {
-  a = Math.floor(Math.random() * 9) + 1;
-  b = Math.floor(Math.random() * 9) + 1;
-  problemEl.textContent = `${a} × ${b} =`;
-  answerEl.value = "";
-  answerEl.focus();
-}
-
-// Запуск таймера
-function startTimer() {
-  if (timerId) return; // если уже запущен — не дублируем
-  timer = 10;
-  timerEl.textContent = timer;
-
-  timerId = setInterval(() => {
-    timer--;
-    timerEl.textContent = timer;
-    if (timer <= 0) endGame();
-  }, 1000);
-}
-
-// Завершение тренировки
-function endGame() {
-  clearInterval(timerId);
-  timerId = null;
-  answerEl.disabled = true;
-
-  const total = correct + wrong || 1;
-  const avg = 10 / total; // или своя метрика среднего времени
-
-  fetch("/result", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({
-      correct,
-      wrong,
-      points,
-      avg_time: avg
-    })
-  })
-    .then((r) => r.text())
-    .then((html) => {
-      document.open();
-      document.write(html);
-      document.close();
-    })
-    .catch((e) => console.error(e));
-}
-
-// Проверка ответа
-function checkAnswer() {
-  const userAnswer = Number(answerEl.value.trim());
-  if (isNaN(userAnswer) || answerEl.value === "") return;
-
-  // если это первый ввод — запускаем таймер
-  if (!started) {
-    started = true;
-    startTimer();
-  }
-
-  const rightAnswer = a * b;
-  if (userAnswer === rightAnswer) {
-    correct++;
-    points += 10;
-  } else {
-    wrong++;
-    points = Math.max(0, points - 5);
-  }
-
-  correctEl.textContent = correct;
-  wrongEl.textContent = wrong;
-  pointsEl.textContent = points;
-
-  newTask();
-}
-
-// Обработка Enter
-answerEl.addEventListener("keydown", (e) => {
-  if (e.key === "Enter") checkAnswer();
-});
-
-// Первая задача при загрузке
-newTask();
+let task = null; // текущая задача: {a, b, op, answer}
+let correct = 0;
+let wrong = 0;
+let points = 0;
+let timer = 10;
+let timerId = null;
+let started = false; // флаг — игра началась или нет
+let taskStartedAt = 0; // когда показали текущую задачу (мс)
+
+// Буфер ответов для /api/attempts: отправляем пачками, а не по запросу на ответ
+const ATTEMPTS_FLUSH_SIZE = 20;
+const ATTEMPTS_FLUSH_MS = 5000;
+let attemptsBuffer = [];
+let flushTimerId = null;
+
+const problemEl = document.getElementById("problem");
+const answerEl = document.getElementById("answer");
+const timerEl = document.getElementById("timer");
+const correctEl = document.getElementById("correct");
+const wrongEl = document.getElementById("wrong");
+const pointsEl = document.getElementById("points");
+
+// Задачи генерирует сервер (/api/task) целым раундом за один запрос
+const EXERCISE_TYPE = "multiplication_basic";
+const TASKS_BATCH = 50;
+const TASKS_REFILL_AT = 10;
+const OP_SIGNS = { "*": "×", "+": "+", "-": "−" };
+let tasksQueue = [];
+let tasksLoading = null;
+
+function loadTasks() {
+  if (tasksLoading) return tasksLoading;
+  tasksLoading = fetch(`/api/task?type=${encodeURIComponent(EXERCISE_TYPE)}&n=${TASKS_BATCH}`)
+    .then((r) => (r.ok ? r.json() : Promise.reject(r.status)))
+    .then((data) => { tasksQueue.push(...(data.tasks || [])); })
+    .catch((e) => console.error(e))
+    .finally(() => { tasksLoading = null; });
+  return tasksLoading;
+}
+
+// Запасной вариант, если сервер не ответил: те же границы, что у multiplication_basic
+function localTask() {
+  const a = Math.floor(Math.random() * 8) + 2;
+  const b = Math.floor(Math.random() * 8) + 2;
+  return { a, b, op: "*", answer: a * b };
+}
+
+// Показ новой задачи
+function newTask() {
+  task = tasksQueue.shift() || localTask();
+  if (tasksQueue.length < TASKS_REFILL_AT) loadTasks();
+  problemEl.textContent = `${task.a} ${OP_SIGNS[task.op] || task.op} ${task.b} =`;
+  answerEl.value = "";
+  answerEl.focus();
+  taskStartedAt = performance.now();
+}
+
+// Отправка накопленных ответов; keepalive — чтобы запрос пережил уход со страницы
+function flushAttempts(keepalive = false) {
+  if (!attemptsBuffer.length) return Promise.resolve();
+  const batch = attemptsBuffer;
+  attemptsBuffer = [];
+  return fetch("/api/attempts", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ attempts: batch }),
+    keepalive
+  }).catch((e) => console.error(e));
+}
+
+// Запуск таймера
+function startTimer() {
+  if (timerId) return; // если уже запущен — не дублируем
+  timer = 10;
+  timerEl.textContent = timer;
+
+  timerId = setInterval(() => {
+    timer--;
+    timerEl.textContent = timer;
+    if (timer <= 0) endGame();
+  }, 1000);
+  flushTimerId = setInterval(() => flushAttempts(), ATTEMPTS_FLUSH_MS);
+}
+
+// Завершение тренировки
+function endGame() {
+  clearInterval(timerId);
+  timerId = null;
+  clearInterval(flushTimerId);
+  flushTimerId = null;
+  answerEl.disabled = true;
+  flushAttempts(true);
+
+  // Ключ результата: повторная отправка того же раунда не создаст дубль в БД
+  const resultId = (window.crypto && crypto.randomUUID)
+    ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+
+  const total = correct + wrong || 1;
+  const avg = 10 / total; // или своя метрика среднего времени
+
+  fetch("/result", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({
+      correct,
+      wrong,
+      points,
+      avg_time: avg,
+      result_id: resultId
+    })
+  })
+    .then((r) => r.text())
+    .then((html) => {
+      document.open();
+      document.write(html);
+      document.close();
+    })
+    .catch((e) => console.error(e));
+}
+
+// Проверка ответа
+function checkAnswer() {
+  const userAnswer = Number(answerEl.value.trim());
+  if (isNaN(userAnswer) || answerEl.value === "") return;
+
+  // если это первый ввод — запускаем таймер
+  if (!started) {
+    started = true;
+    startTimer();
+  }
+
+  const rightAnswer = task.answer;
+  attemptsBuffer.push({
+    exercise_type: EXERCISE_TYPE,
+    task: { a: task.a, b: task.b, answer: rightAnswer, op: task.op },
+    user_answer: userAnswer,
+    time_spent: (performance.now() - taskStartedAt) / 1000
+  });
+  if (attemptsBuffer.length >= ATTEMPTS_FLUSH_SIZE) flushAttempts();
+
+  if (userAnswer === rightAnswer) {
+    correct++;
+    points += 10;
+  } else {
+    wrong++;
+    points = Math.max(0, points - 5);
+  }
+
+  correctEl.textContent = correct;
+  wrongEl.textContent = wrong;
+  pointsEl.textContent = points;
+
+  newTask();
+}
+
+// Обработка Enter
+answerEl.addEventListener("keydown", (e) => {
+  if (e.key === "Enter") checkAnswer();
+});
+
+// Закрыли вкладку посреди раунда — дописываем то, что успели ответить
+window.addEventListener("pagehide", () => flushAttempts(true));
+
+// Первая задача при загрузке — когда придёт раунд с сервера
+loadTasks().then(newTask);
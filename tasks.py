@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+
+from config import Config
+from database import db
+
+
+# Параметры типов упражнений на случай, если БД недоступна (совпадают с init_db.sql)
+DEFAULT_EXERCISE_TYPES = {
+    'multiplication_basic': {'min': 2, 'max': 9, 'operators': ['*']},
+    'multiplication_advanced': {'min': 10, 'max': 99, 'operators': ['*']},
+    'arithmetic_basic': {'min': 1, 'max': 20, 'operators': ['+', '-']},
+    'arithmetic_advanced': {'min': 10, 'max': 100, 'operators': ['+', '-', '*']},
+}
+
+SUPPORTED_OPERATORS = ('+', '-', '*')
+
+
+class UnknownExerciseType(Exception):
+    """Запрошен тип упражнения, которого нет в exercise_types"""
+
+
+class TaskGenerator:
+    """
+    Генератор задач по параметрам exercise_types.parameters ({min, max, operators}).
+    Конфигурация читается из БД один раз и кешируется на ttl секунд.
+    """
+
+    def __init__(self, load_types, ttl=300.0):
+        self.load_types = load_types
+        self.ttl = ttl
+        self._types = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _normalize(self, params):
+        lo, hi = int(params.get('min', 1)), int(params.get('max', 9))
+        if lo > hi:
+            lo, hi = hi, lo
+        operators = [op for op in params.get('operators') or ['*'] if op in SUPPORTED_OPERATORS]
+        return {'min': lo, 'max': hi, 'operators': operators or ['*']}
+
+    def stale(self):
+        """Конфигурация не загружена или старше ttl"""
+        return self._types is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    def _store(self, raw):
+        self._types = {name: self._normalize(params or {}) for name, params in raw.items()}
+        self._loaded_at = time.monotonic()
+
+    def types(self):
+        """Кешированная конфигурация всех типов упражнений: {name: {min, max, operators}}"""
+        if not self.stale():
+            return self._types
+        with self._lock:
+            if self.stale():
+                try:
+                    raw = self.load_types() or {}
+                except Exception as e:
+                    print(f"Task generator: не удалось загрузить exercise_types: {e}")
+                    # Пробуем снова не раньше, чем через ttl; до тех пор — прошлая или встроенная конфигурация
+                    raw = self._types or DEFAULT_EXERCISE_TYPES
+                self._store(raw)
+        return self._types
+
+    async def refresh_async(self, load_types):
+        """
+        Обновить устаревшую конфигурацию асинхронным загрузчиком (ASGI-режим),
+        чтобы types() не ходил в БД синхронным драйвером из цикла событий.
+        """
+        if not self.stale():
+            return
+        try:
+            raw = await load_types() or {}
+        except Exception as e:
+            print(f"Task generator: не удалось загрузить exercise_types: {e}")
+            raw = self._types or DEFAULT_EXERCISE_TYPES
+        with self._lock:
+            self._store(raw)
+
+    def config(self, exercise_type):
+        types = self.types()
+        if exercise_type not in types:
+            raise UnknownExerciseType(exercise_type)
+        return types[exercise_type]
+
+    def make_task(self, a, b, op):
+        """Задача с ответом; для вычитания уменьшаемое не меньше вычитаемого."""
+        if op == '-' and a < b:
+            a, b = b, a
+        if op == '+':
+            answer = a + b
+        elif op == '-':
+            answer = a - b
+        else:
+            answer = a * b
+        return {'a': a, 'b': b, 'op': op, 'answer': answer}
+
+    def generate(self, exercise_type='multiplication_basic', n=1, rng=random):
+        """Список из n задач заданного типа"""
+        cfg = self.config(exercise_type)
+        lo, hi, operators = cfg['min'], cfg['max'], cfg['operators']
+        return [
+            self.make_task(rng.randint(lo, hi), rng.randint(lo, hi), rng.choice(operators))
+            for _ in range(n)
+        ]
+
+    def invalidate(self):
+        """Сбросить кеш — конфигурация перечитается при следующем обращении"""
+        with self._lock:
+            self._types = None
+
+
+# Глобальный экземпляр
+task_generator = TaskGenerator(db.get_exercise_types, ttl=Config.EXERCISE_TYPES_TTL)